@@ -2,6 +2,7 @@
 import statsmodels.stats.power as smp
 import statsmodels.api as sm
 import math
+import os
 
 # COMMAND ----------
 
@@ -27,6 +28,36 @@ math.ceil(sample_size)
 
 # COMMAND ----------
 
+# batch version of the above for many scenarios at once (see power_batch.py)
+# each row leaves one of nobs1, power or mde empty and that one is solved
+import pandas as pd
+from power_batch import solve_power_batch, check_statsmodels
+
+scenarios = pd.DataFrame({'baseline_rate': [0.615, 0.615, 0.615, 0.90],
+                          'mde':           [0.02,  0.02,  None,  0.002],
+                          'nobs1':         [None,  None,  12000, None],
+                          'power':         [0.80,  0.90,  0.80,  0.80],
+                          'ratio':         [19,    19,    19,    49],
+                          'alternative':   'larger'})
+
+solved = solve_power_batch(scenarios)
+check_statsmodels(solved)
+
+# COMMAND ----------
+
+# precomputed lookup table for repeated sample size questions (see power_lookup.py)
+# build_lookup() only needs to run once, afterwards SampleSizeLookup() memory-maps the saved table
+from power_lookup import build_lookup, SampleSizeLookup
+
+if os.path.exists('power_lookup/error_estimate.npy'):
+    lookup = SampleSizeLookup('power_lookup/')
+else:
+    lookup = build_lookup('power_lookup/')
+
+math.ceil(lookup.nobs1(baseline_retention_rate, mde_retention_rate - baseline_retention_rate, ratio = 19, alternative = 'larger'))
+
+# COMMAND ----------
+
 # estimate sample size via power analysis
 from statsmodels.stats.power import TTestIndPower
 
@@ -104,7 +135,7 @@ def five_num_sum_by_group(df, by, metric):
                 max     = (metric, 'max'),
             ).reset_index() 
             .assign(metric = metric)
-            .iloc[:,[0,10,1,2,3,4,5,6,7,8,9]] 
+            .loc[:, list(by) + ['metric', 'count', 'mean', 'std', 'min', 'q1', 'median', 'q3', 'max']]   # NOTE: by name, so any number of by columns works
         ) 
 
     return df
@@ -132,7 +163,7 @@ def q3(x):
         max     = ('points', 'max'),
     ).reset_index() 
     .assign(metric = 'points') 
-    .iloc[:,[0,1,10,2,3,4,5,6,7,8,9]] 
+    .loc[:, ['league', 'points_bucket'] + ['metric', 'count', 'mean', 'std', 'min', 'q1', 'median', 'q3', 'max']] 
 ) 
 
 # COMMAND ----------
@@ -0,0 +1,315 @@
+# **Overview**
+# * Benchmarks for the public entry points: sim(), test_runner(), prop_test_runner() and five_num_sum_by_group()
+#   * plus the faster engines next to them (sim_fast(), sim_runner_parallel(), test_runner_fast(), prop_test_runner_fast(), five_num_sum_fast())
+# * Deterministic synthetic data, so two runs on different commits time exactly the same inputs
+#   * user level retention frames with `lifetime_month`, `potential_lifetime_month` and `group_var` (1e5 / 1e6 / 1e7 rows)
+#   * cohort level frames for prop_test_runner() and simulation output frames for five_num_sum_by_group()
+#   * the long-term and short-term simulation grids
+# * Each benchmark records wall time (min and median of the repeats) and peak memory (tracemalloc, a separate run)
+# * Results go to a JSON file tagged with the git commit, `compare` prints the ratios between two such files
+# * Runs offline on a plain Linux box, only numpy / pandas / scipy / statsmodels are needed (a failing benchmark is recorded, not fatal)
+#
+# **Usage**
+# * python benchmark.py run --sizes 1e5 1e6 -o bench_before.json
+# * python benchmark.py run --only test_runner five_num_sum -o bench_after.json
+# * python benchmark.py compare bench_before.json bench_after.json
+
+
+import argparse
+import ast
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+LONG_TERM_GRID  = {'baseline_rates': [0.55, 0.60, 0.65],
+                   'mdes':           [0.02, 0.03, 0.04],
+                   'populations':    [175000, 200000, 225000],
+                   'control_ratios': [5.66, 9, 19]}
+
+SHORT_TERM_GRID = {'baseline_rates': [0.85, 0.90, 0.95],
+                   'mdes':           [0.01, 0.02, 0.03],
+                   'populations':    [2750000, 3000000, 3250000],
+                   'control_ratios': [19, 32.33, 49]}
+
+
+def load_functions(file_name, names):
+
+    # NOTE: the analysis files are notebook exports with top level cells that need real data, so they cannot be imported
+    # this pulls only their import statements and the named function definitions and runs those
+    with open(os.path.join(HERE, file_name)) as f:
+        tree = ast.parse(f.read())
+
+    namespace = {'np': np, 'pd': pd}   # NOTE: the notebook exports may use np / pd from the notebook namespace without importing them
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            try:
+                exec(compile(ast.Module(body = [node], type_ignores = []), file_name, 'exec'), namespace)
+            except ImportError:
+                pass   # NOTE: plotting / pingouin imports are optional here
+
+    # NOTE: module level constants the functions use (e.g. METRICS) are pulled the same way when they are named
+    for node in tree.body:
+        defines = ((isinstance(node, ast.FunctionDef) and node.name in names) or
+                   (isinstance(node, ast.Assign) and any(isinstance(t, ast.Name) and t.id in names for t in node.targets)))
+        if defines:
+            exec(compile(ast.Module(body = [node], type_ignores = []), file_name, 'exec'), namespace)
+
+    return {name: namespace[name] for name in names}
+
+
+# DEFINE data generators
+
+def make_retention_frame(n_rows, n_months = 36, seed = 0):
+
+    # NOTE: one row per user, potential_lifetime_month comes from the signup cohort and lifetime_month from a geometric churn
+    rng = np.random.default_rng(seed)
+
+    potential = rng.integers(0, n_months + 1, size = n_rows)
+    group_var = rng.random(n_rows) < 0.05                        # NOTE: a 5% control, like the long-term design
+    churn     = np.where(group_var, 0.12, 0.10)
+    lifetime  = np.minimum(rng.geometric(churn) - 1, potential)
+
+    return pd.DataFrame({'user_id':                  np.arange(n_rows),
+                         'lifetime_month':           lifetime,
+                         'potential_lifetime_month': potential,
+                         'group_var':                np.where(group_var, 'Yes', 'No'),
+                         'tier_type':                rng.choice(['basic', 'standard', 'premium'], size = n_rows),
+                         'payment_provider':         rng.choice(['card', 'paypal', 'apple', 'google', 'carrier'], size = n_rows)})
+
+
+def make_cohort_frame(n_rows, n_months = 36, seed = 0):
+
+    # NOTE: pre-aggregated counts, the input prop_test_runner() expects
+    rng = np.random.default_rng(seed)
+
+    cohort_count = rng.integers(50, 5000, size = n_rows)
+
+    return pd.DataFrame({'lifetime_month': rng.integers(0, n_months, size = n_rows),
+                         'group_var':      rng.choice(['Yes', 'No'], size = n_rows),
+                         'cohort_count':   cohort_count,
+                         'retained_count': rng.binomial(cohort_count, 0.6)})
+
+
+def make_sim_frame(n_rows, seed = 0, grid = LONG_TERM_GRID):
+
+    # NOTE: a frame shaped like sim_runner() output, for the summary functions
+    rng   = np.random.default_rng(seed)
+    cells = pd.MultiIndex.from_product([['t test', 'prop test']] + list(grid.values()),
+                                       names = ['test', 'baseline_rate', 'mde', 'population', 'control_ratio']).to_frame(index = False)
+    df    = cells.iloc[rng.integers(0, len(cells), size = n_rows)].reset_index(drop = True)
+
+    return df.assign(**{'t statistic': rng.normal(5, 2, size = n_rows),
+                        'pvalue':      rng.beta(0.2, 5, size = n_rows),
+                        'low_CI':      rng.normal(0.02, 0.005, size = n_rows),
+                        'high_CI':     np.inf})
+
+
+# DEFINE benchmarks
+# NOTE: each entry is name -> (sizes it runs at, setup(size) returning the call arguments, the function to call)
+# sizes of None means the benchmark has a fixed input and runs once per invocation
+
+def _sim():
+    return load_functions('sim_t_test_vs_prop_test.py', ['extract_t_test', 'sim'])['sim']
+
+
+def _sim_fast():
+    from sim_engine import sim_fast
+    return sim_fast
+
+
+def _sim_runner_parallel():
+    from sim_engine import sim_runner_parallel
+    return sim_runner_parallel
+
+
+def _test_runner():
+    return load_functions('t_test_or_anova_multi.py', ['extract_t_test', 't_test', 'METRICS', 'engagement_metric', 'report_metric', 'test_runner'])['test_runner']
+
+
+def _test_runner_fast():
+    from retention_engine import test_runner_fast
+    return test_runner_fast
+
+
+def _prop_test_runner():
+    return load_functions('prop_test_multi.py', ['prop_test', 'prop_test_runner'])['prop_test_runner']
+
+
+def _prop_test_runner_fast():
+    return load_functions('prop_test_multi.py', ['prop_tests_from_totals', 'prop_test_runner_fast'])['prop_test_runner_fast']
+
+
+def _five_num_sum_by_group():
+    return load_functions('sim_t_test_vs_prop_test.py', ['five_num_sum_by_group'])['five_num_sum_by_group']
+
+
+def _five_num_sum_fast():
+    from five_num_summary import five_num_sum_fast
+    return five_num_sum_fast
+
+
+BENCHMARKS = {
+    'sim':                  (None,
+                             lambda size: ((), {'baseline_rate': 0.615, 'mde': 0.02, 'population': 200000, 'control_ratio': 19, 'samples': 5}),
+                             _sim),
+    'sim_fast_short_term':  (None,
+                             lambda size: ((), {'baseline_rate': 0.90, 'mde': 0.002, 'population': 3000000, 'control_ratio': 49, 'samples': 500,
+                                                'rng': np.random.default_rng(0)}),
+                             _sim_fast),
+    'sim_runner_parallel_short_term':
+                            (None,
+                             lambda size: ((), dict(SHORT_TERM_GRID, samples = 500, seed = 0)),
+                             _sim_runner_parallel),
+    'test_runner_t_test_cumulative':
+                            ([1e5, 1e6, 1e7],
+                             lambda size: ((make_retention_frame(int(size)),), {'test': 't-test', 'metric': 'is_retained', 'period': 'cumulative', 'groups': ['group_var']}),
+                             _test_runner),
+    'test_runner_t_test_prior':
+                            ([1e5, 1e6, 1e7],
+                             lambda size: ((make_retention_frame(int(size)),), {'test': 't-test', 'metric': 'is_retained', 'period': 'prior', 'groups': ['group_var']}),
+                             _test_runner),
+    'test_runner_fast_t_test_cumulative':
+                            ([1e5, 1e6, 1e7],
+                             lambda size: ((make_retention_frame(int(size)),), {'test': 't-test', 'metric': 'is_retained', 'period': 'cumulative', 'groups': ['group_var']}),
+                             _test_runner_fast),
+    'test_runner_fast_t_test_prior':
+                            ([1e5, 1e6, 1e7],
+                             lambda size: ((make_retention_frame(int(size)),), {'test': 't-test', 'metric': 'is_retained', 'period': 'prior', 'groups': ['group_var']}),
+                             _test_runner_fast),
+    'prop_test_runner':     ([1e5, 1e6, 1e7],
+                             lambda size: ((make_cohort_frame(int(size)),), {'group_var': 'group_var'}),
+                             _prop_test_runner),
+    'prop_test_runner_fast':
+                            ([1e5, 1e6, 1e7],
+                             lambda size: ((make_cohort_frame(int(size)),), {'group_var': 'group_var'}),
+                             _prop_test_runner_fast),
+    'five_num_sum_by_group':
+                            ([1e5, 1e6, 1e7],
+                             lambda size: ((make_sim_frame(int(size)), ['test', 'baseline_rate', 'mde', 'population', 'control_ratio'], 'low_CI'), {}),
+                             _five_num_sum_by_group),
+    'five_num_sum_fast':
+                            ([1e5, 1e6, 1e7],
+                             lambda size: ((make_sim_frame(int(size)), ['test', 'baseline_rate', 'mde', 'population', 'control_ratio'], 'low_CI'), {}),
+                             _five_num_sum_fast),
+}
+
+
+def time_call(fn, args, kwargs, repeats):
+
+    # NOTE: wall time of each repeat, then one more call under tracemalloc for the peak memory
+    seconds = []
+    for _ in range(repeats):
+        gc.collect()
+        start = time.perf_counter()
+        fn(*args, **kwargs)
+        seconds.append(time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    fn(*args, **kwargs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {'seconds_min':    min(seconds),
+            'seconds_median': statistics.median(seconds),
+            'repeats':        repeats,
+            'peak_mb':        peak / 2 ** 20}
+
+
+def run_benchmarks(names = None, sizes = None, repeats = 3):
+
+    # NOTE: sizes limits the sized benchmarks to those row counts, None keeps each benchmark's own list
+    results = []
+    for name, (bench_sizes, setup, loader) in BENCHMARKS.items():
+        if names and not any(name.startswith(n) for n in names):
+            continue
+
+        for size in (bench_sizes and [s for s in bench_sizes if sizes is None or s in sizes]) or ([None] if bench_sizes is None else []):
+            result = {'name': name, 'size': size}
+            try:
+                fn           = loader()
+                args, kwargs = setup(size)
+                result.update(time_call(fn, args, kwargs, repeats), status = 'ok')
+            except Exception as e:   # NOTE: record and move on, e.g. a missing optional package or a bug in the function
+                result.update(status = 'error', error = f'{type(e).__name__}: {e}')
+
+            print(f"{name:<36} {str(size):>10}  " +
+                  (f"{result['seconds_min']:>10.3f}s  {result['peak_mb']:>10.1f}MB" if result['status'] == 'ok' else result['error']))
+            results.append(result)
+
+    return results
+
+
+def environment():
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd = HERE, capture_output = True, text = True).stdout.strip()
+    except OSError:
+        commit = None
+
+    return {'commit':     commit,
+            'timestamp':  time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python':     platform.python_version(),
+            'machine':    platform.machine(),
+            'processor':  platform.processor(),
+            'cpu_count':  os.cpu_count(),
+            'numpy':      np.__version__,
+            'pandas':     pd.__version__}
+
+
+def compare(before_path, after_path):
+
+    # NOTE: joins two result files on (name, size), ratio < 1 means the after run is faster / smaller
+    frames = []
+    for path in (before_path, after_path):
+        with open(path) as f:
+            frames.append(pd.DataFrame(json.load(f)['results']))
+
+    keys = ['name', 'size']
+    cols = ['seconds_min', 'peak_mb']
+    df   = pd.merge(frames[0].loc[:, keys + cols], frames[1].loc[:, keys + cols], on = keys, how = 'outer', suffixes = ('_before', '_after'))
+
+    return df.assign(time_ratio   = lambda x: x['seconds_min_after'] / x['seconds_min_before'],
+                     memory_ratio = lambda x: x['peak_mb_after'] / x['peak_mb_before'])
+
+
+def main(argv = None):
+
+    parser     = argparse.ArgumentParser(description = 'Benchmark the sim / test_runner / prop_test_runner / five_num_sum entry points')
+    subparsers = parser.add_subparsers(dest = 'command', required = True)
+
+    run = subparsers.add_parser('run')
+    run.add_argument('--only',    nargs = '*', help = 'benchmark name prefixes to run')
+    run.add_argument('--sizes',   nargs = '*', type = float, help = 'row counts for the sized benchmarks, e.g. 1e5 1e6')
+    run.add_argument('--repeats', type = int, default = 3)
+    run.add_argument('-o', '--output', default = 'bench_results.json')
+
+    cmp = subparsers.add_parser('compare')
+    cmp.add_argument('before')
+    cmp.add_argument('after')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        results = run_benchmarks(names = args.only, sizes = args.sizes, repeats = args.repeats)
+        with open(args.output, 'w') as f:
+            json.dump({'environment': environment(), 'results': results}, f, indent = 2)
+        print(f'wrote {args.output}')
+    else:
+        pd.set_option('display.width', 200)
+        print(compare(args.before, args.after).to_string(index = False))
+
+
+if __name__ == '__main__':
+    main()
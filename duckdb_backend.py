@@ -0,0 +1,146 @@
+# **Overview**
+# * An optional DuckDB backend for the relational steps of `test_runner()` / `report_metric()` / `prop_test_runner()`
+#   * the eligibility filters, the `lifetime_month_ref` expansion and the grouped counts run as SQL in an in-process DuckDB database
+#   * DuckDB scans Parquet files (or a registered DataFrame) on all cores and pushes the column selection down to the files
+#   * only the aggregated tables come back to Python, the statistics are the existing vectorized code (retention_engine.py, prop_test_multi.py)
+# * The SQL first collapses the users to a histogram by (keys, lifetime_month, potential_lifetime_month) and then expands the months
+#   on that small table, so the month expansion never multiplies the user rows
+# * Needs `pip install duckdb`, nothing else in the repo imports this module
+#
+# **Usage**
+# * con = duckdb_connect('new_subs_user_level/')                  # a Parquet file or directory (hive partitions are read as columns)
+# * con = duckdb_connect(new_subs_user_level)                     # or a pandas DataFrame, registered without a copy
+# * test_results, df_agg_results = test_runner_duckdb(con, 't-test', 'is_retained', 'cumulative', ['group_var'])
+# * prop_test_results, df_agg_results = prop_test_runner_duckdb(duckdb_connect(new_subs_cohort_level))
+
+
+import os
+
+import duckdb
+import numpy as np
+import pandas as pd
+
+from prop_test_multi import prop_tests_from_totals
+from retention_engine import period_months, run_from_stats
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def duckdb_connect(source, table = 'users', con = None):
+    # source: a Parquet file / directory path or a DataFrame, exposed to SQL as `table`
+
+    con = con or duckdb.connect()
+
+    if isinstance(source, pd.DataFrame):
+        con.register(table, source)
+    else:
+        path = os.fspath(source)
+        if os.path.isdir(path):
+            path = os.path.join(path, '**', '*.parquet')
+        path = path.replace("'", "''")
+        con.execute(f"CREATE OR REPLACE VIEW {_quote(table)} AS SELECT * FROM read_parquet('{path}', hive_partitioning = true)")
+
+    return con
+
+
+def retention_stats_sql(keys, metric, period, table = 'users'):
+
+    # NOTE: the eligible n / retained / sum / sumsq per (month, keys), the months come in as a list parameter ($months)
+    # eligible for 'prior': lifetime_month >= month - 1 and potential_lifetime_month >= month, 'cumulative': potential_lifetime_month >= month
+    key_cols = ', '.join(_quote(key) for key in keys)
+
+    if period == 'prior':
+        eligible = 'h.lifetime_month >= m.month - 1 AND h.potential_lifetime_month >= m.month'
+    elif period == 'cumulative':
+        eligible = 'h.potential_lifetime_month >= m.month'
+    else:
+        raise ValueError("period must be 'prior' or 'cumulative'")
+
+    # NOTE: is_retained depends on the month, it is 0 / 1 so its sum and sum of squares are the retained count
+    if metric == 'is_retained':
+        metric_sums = '0 AS s, 0 AS ss'
+        sums        = ('SUM(CASE WHEN h.lifetime_month > m.month THEN h.n ELSE 0 END) AS sum, '
+                       'SUM(CASE WHEN h.lifetime_month > m.month THEN h.n ELSE 0 END) AS sumsq')
+    else:
+        metric_sums = f'SUM({_quote(metric)}) AS s, SUM({_quote(metric)} * {_quote(metric)}) AS ss'
+        sums        = 'SUM(h.s) AS sum, SUM(h.ss) AS sumsq'
+
+    return f"""
+        WITH h AS (
+            SELECT {key_cols}, lifetime_month, potential_lifetime_month, COUNT(*) AS n, {metric_sums}
+            FROM {_quote(table)}
+            GROUP BY ALL
+        ),
+        m AS (SELECT UNNEST($months) AS month)
+        SELECT m.month,
+               {', '.join('h.' + _quote(key) for key in keys)},
+               SUM(h.n) AS n,
+               SUM(CASE WHEN h.lifetime_month > m.month THEN h.n ELSE 0 END) AS retained,
+               {sums}
+        FROM h JOIN m ON {eligible}
+        GROUP BY ALL
+        ORDER BY ALL
+    """
+
+
+def _stats_arrays(df, keys, months):
+
+    # NOTE: the long (month, keys) SQL result as the (months, keys) arrays retention_engine works on
+    key_table = (df.loc[:, keys]
+                   .drop_duplicates()
+                   .sort_values(keys)
+                   .reset_index(drop = True))
+    rows = np.searchsorted(np.asarray(months), df['month'].to_numpy())
+    cols = pd.MultiIndex.from_frame(key_table).get_indexer(pd.MultiIndex.from_frame(df.loc[:, keys]))
+
+    stats = {}
+    for stat in ['n', 'sum', 'sumsq', 'retained']:
+        values = np.zeros((len(months), len(key_table)))
+        values[rows, cols] = df[stat].to_numpy(dtype = float)
+        stats[stat] = values
+
+    return stats, key_table
+
+
+# DEFINE test_runner_duckdb()
+def test_runner_duckdb(con, test, metric, period, groups, table = 'users'):
+    # the same arguments and outputs as test_runner(), con is from duckdb_connect()
+    # test:   't-test', 'anova'
+    # metric: 'is_retained' or any numeric user level column
+    # period: 'prior', 'cumulative'
+    # groups: a list with any single value or combination of values: 'group_var', tier_type' & 'payment_provider'
+
+    keys = list(dict.fromkeys(groups + ['group_var']))
+
+    lifetime_months = con.execute(f"SELECT DISTINCT lifetime_month FROM {_quote(table)}").df()['lifetime_month'].tolist()
+    months          = period_months(lifetime_months, period)
+
+    df           = con.execute(retention_stats_sql(keys, metric, period, table), {'months': months}).df()
+    stats, cells = _stats_arrays(df, keys, months)
+
+    return run_from_stats(stats, cells, months, test, period, groups)
+
+
+# DEFINE prop_test_runner_duckdb()
+def prop_test_runner_duckdb(con, group_var = 'group_var', table = 'users'):
+    # the same outputs as prop_test_runner_fast() for a cohort level table (lifetime_month, group_var, cohort_count, retained_count)
+    # con is from duckdb_connect(), months come back sorted (a scan has no row order to keep)
+    # group_var keeps its name and a month missing one of the groups gets a NaN row, as in prop_test_runner_fast()
+
+    df_agg = con.execute(f"""
+        SELECT lifetime_month,
+               {_quote(group_var)},
+               CAST(SUM(cohort_count)   AS BIGINT) AS cohort_count_total,
+               CAST(SUM(retained_count) AS BIGINT) AS retained_count_total
+        FROM {_quote(table)}
+        GROUP BY ALL
+        ORDER BY ALL
+    """).df()
+
+    prop_test_results = prop_tests_from_totals(df_agg, group_var, pd.unique(df_agg['lifetime_month']))
+
+    df_agg = df_agg.assign(retained_percent = lambda x: ((x['retained_count_total'] / x['cohort_count_total']) * 100).round(2))
+
+    return prop_test_results, df_agg
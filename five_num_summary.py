@@ -0,0 +1,262 @@
+# **Overview**
+# * A streaming version of `five_num_sum_by_group()` (Effect_Size.py and sim_t_test_vs_prop_test.py) for simulation output
+#   * `five_num_sum_by_group()` needs the whole frame in memory and calls Python `q1` / `q3` lambdas per group
+#   * `StreamingSummary` takes the results batch by batch and keeps a small state per group key instead of every replicate
+# * Per group state
+#   * count / mean / variance with Welford updates, merged across batches with Chan's parallel formula, plus exact min / max
+#   * a KLL quantile sketch for q1 / median / q3, mergeable and bounded to about 3 * k values whatever the number of rows
+#   * while a group has fewer rows than the sketch holds its quantiles are exact (the same linear interpolation as pandas)
+#   * after that the rank error is about 2 / k of the group size (about 1% at the default k = 200, checked against exact quantiles)
+# * States from different worker processes merge with `merge()`, the object pickles as plain numpy arrays
+# * `result()` returns the same columns as five_num_sum_by_group(), see SUMMARY_COLUMNS:
+#   the `by` columns, metric, count, mean, std, min, q1, median, q3, max
+# * It also works as a `sink` for sim_runner_fast() / sim_runner_parallel(), which call append() and flush()
+# * `five_num_sum_fast()` is the exact, in memory counterpart for frames that fit in memory
+#   * the rows are sorted once by (group code, value) per metric, so every group is a contiguous sorted run
+#   * count / mean / std come from bincounts, min / q1 / median / q3 / max are index lookups into the runs (pandas' linear interpolation)
+#   * no Python call per group, so 100k+ groups (e.g. replicates x grid cells) cost about one sort of the rows
+#   * several metrics in one call, stacked in the long format of five_num_sum_by_group(), one block of rows per metric
+
+
+import math
+
+import numpy as np
+import pandas as pd
+
+from group_keys import key_codes
+
+
+SUMMARY_COLUMNS = ['metric', 'count', 'mean', 'std', 'min', 'q1', 'median', 'q3', 'max']
+
+
+class KLLSketch:
+
+    # NOTE: a KLL sketch, level h holds values that each stand for 2 ** h inputs
+    # a full level is sorted and every other value (random offset) moves up one level, which halves its size
+
+    def __init__(self, k = 200, seed = 0):
+
+        self.k      = k
+        self.n      = 0
+        self.levels = [np.empty(0)]
+        self._rng   = np.random.default_rng(seed)
+
+    def _capacity(self, level):
+
+        # NOTE: lower levels get geometrically smaller capacities (factor 2/3), the top level gets k
+        depth = len(self.levels) - 1 - level
+        return max(2, int(math.ceil(self.k * (2.0 / 3.0) ** depth)))
+
+    def _compress(self):
+
+        level = 0
+        while level < len(self.levels):
+            if len(self.levels[level]) > self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+
+                values = np.sort(self.levels[level])
+                keep   = values[-1:] if len(values) % 2 else values[:0]      # NOTE: an odd value out stays on this level
+                values = values[:len(values) - len(keep)]
+                offset = self._rng.integers(0, 2)
+
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], values[offset::2]])
+                self.levels[level]     = keep
+            level += 1
+
+    def update(self, values):
+
+        values = np.asarray(values, dtype = float)
+        values = values[~np.isnan(values)]
+
+        # NOTE: large batches go in in slices so level 0 never holds more than a few capacities at once
+        step = max(self.k, 1)
+        for start in range(0, len(values), step):
+            self.levels[0] = np.concatenate([self.levels[0], values[start:start + step]])
+            self.n        += len(values[start:start + step])
+            self._compress()
+
+    def merge(self, other):
+
+        for level, values in enumerate(other.levels):
+            if level == len(self.levels):
+                self.levels.append(np.empty(0))
+            self.levels[level] = np.concatenate([self.levels[level], values])
+
+        self.n += other.n
+        self._compress()
+
+        return self
+
+    def is_exact(self):
+        return len(self.levels) == 1
+
+    def quantile(self, q):
+
+        if self.n == 0:
+            return np.full(np.shape(q), np.nan)
+
+        if self.is_exact():
+            return np.quantile(self.levels[0], q)   # NOTE: linear interpolation, the same as pandas Series.quantile
+
+        values  = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(v), 2.0 ** level) for level, v in enumerate(self.levels)])
+        order   = np.argsort(values, kind = 'stable')
+        values  = values[order]
+        cum     = np.cumsum(weights[order])
+
+        # NOTE: the smallest retained value whose cumulative weight reaches the target rank
+        ranks = np.asarray(q) * cum[-1]
+        index = np.clip(np.searchsorted(cum, ranks, side = 'left'), 0, len(values) - 1)
+
+        return values[index]
+
+
+class StreamingSummary:
+
+    # NOTE: usage
+    #   summary = StreamingSummary(['test', 'baseline_rate'], 'low_CI')
+    #   for batch in batches: summary.update(batch)
+    #   summary.merge(summary_from_another_process)
+    #   summary.result()
+
+    def __init__(self, by, metric, k = 200):
+
+        self.by     = list(by)
+        self.metric = metric
+        self.k      = k
+        self.groups = {}    # NOTE: group key -> [count, mean, m2, min, max, KLLSketch]
+
+    def update(self, df):
+
+        df    = df.loc[:, self.by + [self.metric]].dropna(subset = [self.metric])
+        batch = (df
+                  .groupby(self.by, sort = False, observed = True)[self.metric]
+                  .agg(['count', 'mean', 'var', 'min', 'max']))
+        batch['var'] = batch['var'].fillna(0)
+
+        # NOTE: one groupby for the moments, the sketches need the values of each group
+        positions = df.groupby(self.by, sort = False, observed = True).indices
+        values    = df[self.metric].to_numpy(dtype = float)
+
+        for key, row in zip(batch.index, batch.itertuples(index = False)):
+            key   = key if isinstance(key, tuple) else (key,)
+            state = [row.count, row.mean, row.var * (row.count - 1), row.min, row.max, None]
+            index = positions[key if len(self.by) > 1 else key[0]]
+
+            sketch = KLLSketch(self.k, seed = len(self.groups))
+            sketch.update(values[index])
+            state[5] = sketch
+
+            self._merge_state(key, state)
+
+        return self
+
+    def _merge_state(self, key, state):
+
+        # NOTE: Chan et al. parallel update of count / mean / m2
+        if key not in self.groups:
+            self.groups[key] = state
+            return
+
+        n_a, mean_a, m2_a, min_a, max_a, sketch_a = self.groups[key]
+        n_b, mean_b, m2_b, min_b, max_b, sketch_b = state
+
+        n     = n_a + n_b
+        delta = mean_b - mean_a
+
+        self.groups[key] = [n,
+                            mean_a + delta * n_b / n,
+                            m2_a + m2_b + delta ** 2 * n_a * n_b / n,
+                            min(min_a, min_b),
+                            max(max_a, max_b),
+                            sketch_a.merge(sketch_b)]
+
+    def merge(self, other):
+
+        for key, state in other.groups.items():
+            self._merge_state(key, state)
+
+        return self
+
+    def append(self, df):
+        # NOTE: the ResultSink interface, so a summary can be passed as sink= to the sim runners
+        self.update(df)
+
+    def flush(self):
+        pass
+
+    def result(self):
+
+        rows = []
+        for key, (n, mean, m2, min_, max_, sketch) in self.groups.items():
+            q1, median, q3 = sketch.quantile([0.25, 0.5, 0.75])
+            rows.append(key + (self.metric, n, mean, math.sqrt(m2 / (n - 1)) if n > 1 else np.nan, min_, q1, median, q3, max_))
+
+        df = pd.DataFrame(rows, columns = self.by + SUMMARY_COLUMNS)
+
+        return df.sort_values(self.by).reset_index(drop = True)
+
+
+def _run_quantile(values, start, count, q):
+
+    # NOTE: the q quantile of each sorted run values[start:start + count], linear interpolation like pandas / numpy, NaN for empty runs
+    if not len(values):
+        return np.full(len(count), np.nan)
+
+    position = (count - 1) * q
+    lower    = np.floor(position).astype('int64')
+    last     = start + np.maximum(count - 1, 0)
+
+    low  = values[np.clip(np.minimum(start + lower,     last), 0, len(values) - 1)]
+    high = values[np.clip(np.minimum(start + lower + 1, last), 0, len(values) - 1)]
+
+    return np.where(count > 0, low + (high - low) * (position - lower), np.nan)
+
+
+# DEFINE five_num_sum_fast()
+def five_num_sum_fast(df, by, metrics):
+    # by:      the group columns, rows with a missing key are dropped like groupby()
+    # metrics: a column or a list of columns, NaN values are left out of their metric's statistics like the pandas aggregations
+    # the same rows and columns as five_num_sum_by_group() for each metric, the metric blocks stacked in the order given
+
+    by      = list(by)
+    metrics = [metrics] if isinstance(metrics, str) else list(metrics)
+
+    codes, key_table = key_codes(df, by)
+    n_groups         = len(key_table)
+
+    frames = []
+    for metric in metrics:
+        values = df[metric].to_numpy(dtype = float)
+        keep   = (codes >= 0) & ~np.isnan(values)
+        group  = codes[keep]
+        values = values[keep]
+
+        # NOTE: by value, then a stable sort by group, every group becomes a contiguous sorted run (faster than np.lexsort)
+        order  = np.argsort(values)
+        order  = order[np.argsort(group[order], kind = 'stable')]
+        group  = group[order]
+        values = values[order]
+
+        count = np.bincount(group, minlength = n_groups)
+        start = np.cumsum(count) - count
+
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            mean = np.bincount(group, weights = values, minlength = n_groups) / count
+            m2   = np.bincount(group, weights = (values - mean[group]) ** 2, minlength = n_groups)
+            std  = np.where(count > 1, np.sqrt(m2 / (count - 1)), np.nan)
+
+        q1, median, q3 = (_run_quantile(values, start, count, q) for q in (0.25, 0.5, 0.75))
+
+        frames.append(key_table.assign(metric = metric,
+                                       count  = count,
+                                       mean   = mean,
+                                       std    = std,
+                                       min    = _run_quantile(values, start, count, 0),
+                                       q1     = q1,
+                                       median = median,
+                                       q3     = q3,
+                                       max    = _run_quantile(values, start, count, 1)))
+
+    return pd.concat(frames, ignore_index = True).loc[:, by + SUMMARY_COLUMNS]
@@ -0,0 +1,68 @@
+# **Overview**
+# * Integer group codes for a DataFrame's key columns, shared by the vectorized engines
+#   (retention_engine.py, multi_arm.py, five_num_summary.py)
+# * `key_codes()` gives every row its group number and the table of groups, in the order of groupby(keys, sort = True),
+#   so per group statistics can be built with np.bincount / np.add.at instead of a groupby
+#   * each column is coded on its own (categoricals reuse their codes) and the codes are combined in mixed radix
+#   * rows with a missing key get -1, like groupby() dropping them
+#   * a key space past int64 (many columns with many levels) falls back to groupby().ngroup()
+
+
+import math
+
+import numpy as np
+import pandas as pd
+
+
+def key_codes(df, keys):
+
+    # NOTE: the group number of every row and the table of groups, the same as groupby(keys, observed = True, sort = True).ngroup()
+    # each column is coded on its own (categoricals already hold their codes) and the codes are combined in mixed radix
+    codes, levels = [], []
+    for key in keys:
+        column = df[key]
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            column_codes, column_levels = column.cat.codes.to_numpy(), column.cat.categories
+        else:
+            column_codes, column_levels = pd.factorize(column, sort = True)
+        codes.append(column_codes.astype('int64'))
+        levels.append(column_levels)
+
+    # NOTE: a key column with no levels (all missing) leaves no group, every row gets -1
+    space = math.prod(len(column_levels) for column_levels in levels)
+    if space == 0:
+        return np.full(len(df), -1, dtype = 'int64'), pd.DataFrame({key: df[key].iloc[:0].reset_index(drop = True) for key in keys})
+
+    # NOTE: a key space past int64 cannot be coded in mixed radix, groupby() hashes the keys instead
+    if space > np.iinfo('int64').max:
+        grouped = df.groupby(keys, sort = True, observed = True)
+        group   = grouped.ngroup().fillna(-1).to_numpy(dtype = 'int64')
+        return group, grouped.size().index.to_frame(index = False)
+
+    combined = np.zeros(len(df), dtype = 'int64')
+    missing  = np.zeros(len(df), dtype = bool)
+    for column_codes, column_levels in zip(codes, levels):
+        combined = combined * len(column_levels) + column_codes
+        missing |= column_codes < 0
+
+    # NOTE: the key space is usually small (the product of the level counts), then the observed keys come from a bincount, not a sort
+    combined[missing] = 0
+    if space <= 4 * len(df) + 1_000_000:
+        present = np.flatnonzero(np.bincount(combined[~missing], minlength = space))
+        lookup  = np.full(space, -1, dtype = 'int64')
+        lookup[present] = np.arange(len(present))
+        group = lookup[combined]
+    else:
+        present = np.unique(combined[~missing])
+        group   = np.searchsorted(present, combined)
+    group[missing] = -1
+
+    # NOTE: back from the combined code to each column's level
+    key_table = {}
+    remainder = present
+    for key, column_levels in reversed(list(zip(keys, levels))):
+        values         = column_levels[remainder % len(column_levels)]
+        key_table[key] = pd.Categorical(values, categories = column_levels) if isinstance(df[key].dtype, pd.CategoricalDtype) else values
+        remainder      = remainder // len(column_levels)
+
+    return group, pd.DataFrame({key: key_table[key] for key in keys})
@@ -0,0 +1,147 @@
+# **Overview**
+# * k-arm versions of `prop_test()` and `t_test()`, which hard-code the two group 'Yes' / 'No' split on group_var
+#   * takes one grouped aggregate table (one row per key and arm) and compares every pair of arms, or every arm with a control arm
+#   * proportions: count / nobs per arm, the agresti-caffo z-test and Newcombe interval of prop_test()
+#   * means: n / sum / sumsq per arm, the Welch ttest and interval of t_test()
+#   * both tables come from `summary_stats()` in summary_tests.py, e.g. by = ['lifetime_month', 'arm']
+# * The aggregate rows are laid out once as (keys, arms) arrays and every comparison is one indexed array operation,
+#   so the cost grows with the aggregate rows and the number of pairs, not with pandas calls
+# * p-values are adjusted for multiplicity within each key (e.g. each lifetime_month is its own family of comparisons)
+#   * 'holm' (default), 'bonferroni' or 'fdr_bh', the same as statsmodels multipletests
+#   * CI Lower / CI Upper are per comparison intervals, simultaneous = True widens them to Bonferroni intervals (alpha / comparisons)
+#
+# **Usage**
+# * stats = summary_stats(df, ['lifetime_month', 'arm'], count = 'retained_count', nobs = 'cohort_count')
+# * multi_arm_test(stats, 'arm', test = 'prop-test', control = 'holdout')
+# * multi_arm_test(summary_stats(df_users, ['arm'], metric = 'is_retained'), 'arm', test = 't-test')
+
+
+import numpy as np
+import pandas as pd
+
+from group_keys import key_codes
+from stats_kernels import prop_confint_newcomb, prop_ztest, welch_ttest
+
+
+STATS = {'prop-test': ['count', 'nobs'],
+         't-test':    ['n', 'sum', 'sumsq']}
+
+
+def adjust_pvalues(pvalues, method = 'holm'):
+
+    # NOTE: multiplicity adjusted p-values along the last axis, each row is a family, NaN entries are not comparisons
+    pvalues = np.asarray(pvalues, dtype = float)
+    m       = np.sum(~np.isnan(pvalues), axis = -1, keepdims = True)
+
+    if method == 'bonferroni':
+        return np.minimum(pvalues * m, 1)
+
+    order  = np.argsort(pvalues, axis = -1)               # NOTE: NaN sorts last
+    ranked = np.take_along_axis(pvalues, order, axis = -1)
+    rank   = np.arange(1, pvalues.shape[-1] + 1)
+
+    if method == 'holm':
+        ranked = np.fmax.accumulate((m - rank + 1) * ranked, axis = -1)
+    elif method == 'fdr_bh':
+        ranked = np.flip(np.fmin.accumulate(np.flip(ranked * m / rank, axis = -1), axis = -1), axis = -1)
+    else:
+        raise ValueError("method must be 'holm', 'bonferroni' or 'fdr_bh'")
+
+    adjusted = np.empty_like(ranked)
+    np.put_along_axis(adjusted, order, np.minimum(ranked, 1), axis = -1)
+    adjusted[np.isnan(pvalues)] = np.nan     # NOTE: the running max carries into the NaN slots, put them back
+
+    return adjusted
+
+
+def _arm_arrays(df_stats, arm, stat_cols):
+
+    # NOTE: (keys, arms) arrays of each stat, NaN where a key has no row for an arm
+    keys = [col for col in df_stats.columns if col not in [arm] + stat_cols]
+
+    if keys:
+        codes, key_table = key_codes(df_stats, keys)
+    else:
+        codes, key_table = np.zeros(len(df_stats), dtype = int), pd.DataFrame(index = [0])
+
+    arm_codes, arms = pd.factorize(df_stats[arm], sort = True)
+
+    # NOTE: a missing key or arm codes as -1, which would index the last key / arm, those rows are dropped like groupby() does
+    keep             = (codes >= 0) & (arm_codes >= 0)
+    codes, arm_codes = codes[keep], arm_codes[keep]
+
+    arrays = {}
+    for stat in stat_cols:
+        values = np.full((len(key_table), len(arms)), np.nan)
+        values[codes, arm_codes] = 0
+        np.add.at(values, (codes, arm_codes), df_stats[stat].to_numpy(dtype = float)[keep])
+        arrays[stat] = values
+
+    return key_table, np.asarray(arms), arrays
+
+
+def _pairs(arms, control):
+
+    # NOTE: (first, second) arm positions of every comparison, first minus second
+    if control is None:
+        first, second = np.triu_indices(len(arms), k = 1)
+        return first, second
+
+    if control not in list(arms):
+        raise ValueError(f"control arm {control!r} is not in the table")
+    position = list(arms).index(control)
+    first    = np.array([i for i in range(len(arms)) if i != position], dtype = int)
+
+    return first, np.full(len(first), position)
+
+
+# DEFINE multi_arm_test()
+def multi_arm_test(df_stats, arm, test = 'prop-test', control = None, method = 'holm', alpha = 0.05, simultaneous = False):
+    # df_stats:     one row per (keys, arm) with count / nobs ('prop-test') or n / sum / sumsq ('t-test'), any other column is a key
+    # arm:          the arm column
+    # control:      an arm value to compare every other arm with, None compares all pairs
+    # method:       the multiplicity adjustment within each key, 'holm', 'bonferroni' or 'fdr_bh'
+    # simultaneous: Bonferroni widened CIs (alpha / number of comparisons in the key) instead of per comparison CIs
+
+    if test not in STATS:
+        raise ValueError("test must be 'prop-test' or 't-test'")
+
+    key_table, arms, arrays = _arm_arrays(df_stats, arm, STATS[test])
+    first, second           = _pairs(arms, control)
+
+    # NOTE: comparisons with a missing arm stay NaN and are left out of the adjustment
+    n_pairs = np.sum(~np.isnan(arrays[STATS[test][0]][:, first] + arrays[STATS[test][0]][:, second]), axis = 1, keepdims = True)
+    ci_alpha = alpha / np.maximum(n_pairs, 1) if simultaneous else alpha
+
+    if test == 'prop-test':
+        count, nobs = arrays['count'], arrays['nobs']
+        result      = prop_ztest(count[:, first], nobs[:, first], count[:, second], nobs[:, second])
+        ci_low, ci_high = prop_confint_newcomb(count[:, first], nobs[:, first], count[:, second], nobs[:, second], alpha = ci_alpha)
+        diff        = count[:, first] / nobs[:, first] - count[:, second] / nobs[:, second]
+        label       = 'prop test'
+    else:
+        n     = arrays['n']
+        mean  = arrays['sum'] / n
+        var   = np.maximum(arrays['sumsq'] / n - mean ** 2, 0)    # NOTE: ddof=0, as DescrStatsW
+        result  = welch_ttest(n[:, first], mean[:, first], var[:, first], n[:, second], mean[:, second], var[:, second], alpha = ci_alpha)
+        ci_low, ci_high = result['low_CI'], result['high_CI']
+        diff    = result['diff']
+        label   = 't test'
+
+    adjusted = adjust_pvalues(result['pvalue'], method = method)
+
+    # NOTE: one row per (key, comparison), keys vary slowest
+    n_keys, n_comp = result['pvalue'].shape
+    output = key_table.iloc[np.repeat(np.arange(n_keys), n_comp)].reset_index(drop = True)
+    output = output.assign(**{'arm':        arms[np.tile(first, n_keys)],
+                              'vs':         arms[np.tile(second, n_keys)],
+                              'test':       label,
+                              'diff':       diff.ravel(),
+                              'statistic':  result['statistic'].ravel(),
+                              'pvalue':     result['pvalue'].ravel(),
+                              'CI Lower':   np.broadcast_to(ci_low,  diff.shape).ravel(),
+                              'CI Upper':   np.broadcast_to(ci_high, diff.shape).ravel(),
+                              'pvalue_adj': adjusted.ravel()})
+    output['stat_sig'] = np.where(output['pvalue_adj'] <= alpha, 'Yes', 'No')
+
+    return output.dropna(subset = ['pvalue']).reset_index(drop = True)
@@ -0,0 +1,78 @@
+# **Overview**
+# * A pre-aggregated rendering path for `boxplot_jitter()` in sim_t_test_vs_prop_test.py
+#   * `boxplot_jitter()` hands every simulated row to geom_boxplot + geom_jitter, so render time and memory grow with the replicates
+#   * here the box statistics are computed per facet / test with one vectorized groupby and drawn with stat = 'identity'
+#   * the jitter layer gets a stratified random sample of at most `max_points` rows per box
+# * So the frames plotnine sees have one row per box plus a bounded number of points, whatever the number of replicates
+# * The boxes follow geom_boxplot: quartiles, whiskers at the most extreme values within 1.5 * IQR of the box
+#   * outliers are not drawn separately, the jitter sample already shows the spread
+
+
+import numpy as np
+import pandas as pd
+import plotnine as pn
+from mizani.formatters import percent_format
+
+
+def box_stats(df, by, y, coef = 1.5):
+
+    # NOTE: one row per group with the columns geom_boxplot(stat = 'identity') needs: ymin, lower, middle, upper, ymax
+    # rows with a missing key are dropped first, groupby() leaves them out of the stats but ngroup() would number them -1
+    df      = df.dropna(subset = by)
+    grouped = df.groupby(by, observed = True)[y]
+    stats   = (grouped
+                .quantile([0.25, 0.5, 0.75])
+                .unstack()
+                .set_axis(['lower', 'middle', 'upper'], axis = 1)
+                .assign(count = grouped.count()))
+
+    iqr = stats['upper'] - stats['lower']
+    stats['fence_low']  = stats['lower'] - coef * iqr
+    stats['fence_high'] = stats['upper'] + coef * iqr
+
+    # NOTE: the whiskers are the most extreme values inside the fences, a masked min / max keyed by each row's group number
+    # ngroup() numbers the groups in the same sorted order as the stats rows
+    codes  = df.groupby(by, observed = True).ngroup().to_numpy()
+    values = df[y].to_numpy()
+    inside = (values >= stats['fence_low'].to_numpy()[codes]) & (values <= stats['fence_high'].to_numpy()[codes])
+
+    stats['ymin'] = pd.Series(np.where(inside, values, np.inf)).groupby(codes).min().to_numpy()
+    stats['ymax'] = pd.Series(np.where(inside, values, -np.inf)).groupby(codes).max().to_numpy()
+
+    return (stats
+             .drop(columns = ['fence_low', 'fence_high'])
+             .reset_index())
+
+
+def stratified_sample(df, by, max_points, seed = 0):
+
+    # NOTE: at most max_points random rows per group, shuffle once and keep the first max_points of each group
+    shuffled = df.sample(frac = 1, random_state = seed)
+    keep     = shuffled.groupby(by, observed = True).cumcount() < max_points
+
+    return shuffled.loc[keep]
+
+
+# DEFINE boxplot_jitter_summary()
+def boxplot_jitter_summary(df, x, y, color, facets = None, max_points = 200, alpha = 0.2, seed = 0):
+    # facets:     the columns the plot will be faceted by, e.g. ['baseline_rate', 'mde', 'population', 'control_ratio']
+    #             they are added to the grouping so every facet panel gets its own boxes
+    # max_points: the jitter points drawn per box
+
+    by = [x] + list(facets or [])
+
+    boxes  = box_stats(df, by, y)
+    points = stratified_sample(df, by, max_points, seed = seed)
+
+    plt = (pn.ggplot() +
+            pn.geom_boxplot(data = boxes,
+                            mapping = pn.aes(x = x, ymin = 'ymin', lower = 'lower', middle = 'middle', upper = 'upper', ymax = 'ymax'),
+                            stat = 'identity',
+                            color = 'black') +
+            pn.geom_jitter(data = points,
+                           mapping = pn.aes(x = x, y = y, color = color),
+                           alpha = alpha) +
+            pn.scale_y_continuous(labels=percent_format()) +
+            pn.guides(color = pn.guide_legend(title = "Test")))
+
+    return plt
@@ -0,0 +1,163 @@
+# **Overview**
+# * Bootstrap CIs for the difference in means of a user level metric, for heavy-tailed engagement metrics where the
+#   Welch normal theory of `t_test()` is off
+# * A resampling bootstrap draws n indices per replicate and gathers the rows, far too slow for millions of users
+#   * here each replicate gives every user a Poisson(1) weight instead (the Poisson bootstrap), so a replicate's mean is
+#     sum(w * x) / sum(w) and a block of replicates is one (replicates x rows) weight matrix times the value vector
+#   * the weights come from a 65536 entry Poisson(1) lookup table indexed by random uint16s, several times faster than
+#     rng.poisson() and within 1 / 65536 of the Poisson(1) probabilities
+# * The rows are processed in chunks of chunk_rows and the replicates in blocks of block, so memory stays at about
+#   block x chunk_rows weights per worker whatever the number of users
+# * The (chunk, block) tasks run on a thread pool, numpy releases the GIL in the random draws and the matrix products
+#   * every task has its own stream spawned from one `numpy.random.SeedSequence`, so the result does not depend on max_workers
+#   * seed is an int (the same weights on every call), a SeedSequence or Generator (fresh weights on every call from one
+#     reproducible root), or None (the default, fresh OS entropy), like sim_runner_parallel() in sim_engine.py
+# * The weights and values are float64 by default, dtype = 'float32' halves the memory traffic of the weights
+#   at the cost of float32 rounding of the within-chunk sums (the chunks are still added up in float64)
+# * `bootstrap_test()` takes the same arguments as `t_test()` and returns its columns (statistic in place of t statistic),
+#   it is test = 'bootstrap' in test_runner()
+#   * CI Lower / CI Upper are percentile intervals of exposed - control, pvalue is the two-sided bootstrap p-value
+#     (twice the share of replicates on the far side of 0), statistic is the difference over its bootstrap standard error
+#
+# **Usage**
+# * bootstrap_test(df, month = 3, metric = 'streaming_hours')
+# * test_runner(new_subs_user_level, 'bootstrap', 'streaming_hours', 'cumulative', ['group_var'])
+
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from math import factorial
+
+import numpy as np
+import pandas as pd
+
+from retention_schema import is_yes
+
+
+def _poisson_table(bits = 16):
+
+    # NOTE: value k repeated round(P(k) * 2 ** bits) times, so indexing with a uniform random integer gives a Poisson(1) draw
+    k     = np.arange(20)
+    pmf   = np.exp(-1) / np.array([factorial(i) for i in k], dtype = float)
+    edges = np.round(np.cumsum(pmf) * 2 ** bits).astype('int64')
+    edges[-1] = 2 ** bits
+
+    return np.repeat(k.astype(float), np.diff(edges, prepend = 0))
+
+
+POISSON_TABLE = _poisson_table()
+
+
+POISSON_TABLES = {np.dtype(dtype): POISSON_TABLE.astype(dtype) for dtype in ('float64', 'float32')}
+
+
+def poisson_weights(rng, replicates, rows, dtype = 'float64'):
+
+    # NOTE: a (replicates, rows) block of Poisson(1) weights in dtype, ready for the matrix product with the values
+    return POISSON_TABLES[np.dtype(dtype)][rng.integers(0, len(POISSON_TABLE), size = (replicates, rows), dtype = np.uint16)]
+
+
+def _block_sums(task):
+
+    # NOTE: the weights take the dtype of the values, the integer weight totals stay exact in float32 as well
+    values, seed, replicates = task
+    weights = poisson_weights(np.random.default_rng(seed), replicates, len(values), dtype = values.dtype)
+
+    return weights @ values, weights.sum(axis = 1)
+
+
+def _root_seed(seed):
+
+    # NOTE: the SeedSequence every task's stream is spawned from
+    # a SeedSequence is used as it is (its spawn() moves on, so the next call gets new children), a Generator gives a fresh
+    # root from its stream, an int or None goes to SeedSequence() like sim_runner_parallel()
+    if isinstance(seed, np.random.SeedSequence):
+        return seed
+    if isinstance(seed, np.random.Generator):
+        return np.random.SeedSequence(seed.integers(2 ** 63))
+
+    return np.random.SeedSequence(seed)
+
+
+def bootstrap_means(samples, replicates = 2000, block = 64, chunk_rows = 65_536, max_workers = None, seed = None, dtype = 'float64'):
+    # samples: a list of 1d arrays, e.g. [exposed, control]
+    # seed:    an int, a SeedSequence, a Generator or None (fresh OS entropy), see _root_seed()
+    # dtype:   'float64' or 'float32', the weights and the within-chunk sums
+    # returns a (samples, replicates) array of the Poisson bootstrap means
+
+    if np.dtype(dtype) not in POISSON_TABLES:
+        raise ValueError("dtype must be 'float64' or 'float32'")
+
+    tasks, owners = [], []
+    for i, values in enumerate(samples):
+        values = np.asarray(values, dtype = dtype)
+        for start in range(0, len(values), chunk_rows):
+            for first in range(0, replicates, block):
+                tasks.append([values[start:start + chunk_rows], None, min(block, replicates - first)])
+                owners.append((i, first))
+
+    for task, child in zip(tasks, _root_seed(seed).spawn(len(tasks))):
+        task[1] = child
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+
+    if max_workers == 1 or len(tasks) <= 1:
+        outputs = list(map(_block_sums, tasks))
+    else:
+        with ThreadPoolExecutor(max_workers = max_workers) as executor:
+            outputs = list(executor.map(_block_sums, tasks))
+
+    # NOTE: the chunks of a sample add up, weighted sum and weight total per replicate
+    sums   = np.zeros((len(samples), replicates))
+    totals = np.zeros((len(samples), replicates))
+    for (i, first), (block_sums, block_totals) in zip(owners, outputs):
+        sums[i, first:first + len(block_sums)]   += block_sums
+        totals[i, first:first + len(block_sums)] += block_totals
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        return sums / totals
+
+
+def bootstrap_diff(exposed, control, replicates = 2000, alpha = 0.05, **options):
+
+    # NOTE: the Poisson bootstrap of mean(exposed) - mean(control)
+    # returns a dict like welch_ttest(): statistic, pvalue, diff, std_diff, low_CI, high_CI
+    # options go to bootstrap_means(): block, chunk_rows, max_workers, seed, dtype
+    exposed = np.asarray(exposed, dtype = float)
+    control = np.asarray(control, dtype = float)
+
+    means = bootstrap_means([exposed, control], replicates = replicates, **options)
+    diffs = means[0] - means[1]
+    diffs = diffs[~np.isnan(diffs)]
+
+    diff     = exposed.mean() - control.mean()
+    std_diff = diffs.std(ddof = 1)
+    pvalue   = min(1.0, 2 * min(np.mean(diffs <= 0), np.mean(diffs >= 0)))
+
+    low_CI, high_CI = np.quantile(diffs, [alpha / 2, 1 - alpha / 2])
+
+    return {'statistic': diff / std_diff,
+            'pvalue':    pvalue,
+            'diff':      diff,
+            'std_diff':  std_diff,
+            'low_CI':    low_CI,
+            'high_CI':   high_CI}
+
+
+# DEFINE bootstrap_test()
+def bootstrap_test(df, month, metric, replicates = 2000, alpha = 0.05, **options):
+    # NOTE: month is just for adding a data label, like t_test()
+    # month, test, statistic, pvalue, CI Lower, CI Upper for exposed ('No') - control ('Yes'), like t_test()
+
+    control_mask = is_yes(df['group_var'])
+    values       = df[metric].to_numpy(dtype = float)
+
+    result = bootstrap_diff(values[~control_mask], values[control_mask], replicates = replicates, alpha = alpha, **options)
+
+    return pd.DataFrame({'month':     month,
+                         'test':      'bootstrap',
+                         'statistic': result['statistic'],
+                         'pvalue':    result['pvalue'],
+                         'CI Lower':  result['low_CI'],
+                         'CI Upper':  result['high_CI']}, index = [0])
@@ -0,0 +1,324 @@
+# **Overview**
+# * A batch version of the power analysis in Effect_Size.py
+#   * Effect_Size.py calls `NormalIndPower().solve_power` and `TTestIndPower().power` one scenario at a time, each a scalar root-find
+#   * Here a whole table of scenarios (baseline x MDE x ratio x alpha x power x alternative) is solved at once with numpy arrays
+# * Each row solves for whichever of `nobs1`, `power` or `mde` / `effect_size` is missing (NaN)
+#   * 'normal' rows (NormalIndPower) use the closed-form normal approximation, two-sided rows get a few Newton steps for the second tail
+#   * 't' rows (TTestIndPower) use a vectorized bisection on the noncentral t power curve
+# * `check_statsmodels()` puts every solved row back into statsmodels' `power()` and compares the power with the target (within ATOL)
+# * `mde` is an absolute lift on `baseline_rate` (target rate = baseline_rate + mde), turned into Cohen's h with proportion_effectsize()
+#
+# **CLI**
+# * python power_batch.py scenarios.csv -o solved.csv --check
+#   * with --check the exit status is 1 when any row is off by more than ATOL, so it can gate CI
+# * Columns: baseline_rate, mde, effect_size, nobs1, power, alpha, ratio, alternative, test (missing columns get the defaults below)
+
+
+import argparse
+import sys
+
+import numpy as np
+import pandas as pd
+from scipy import special, stats
+
+
+# NOTE: the check is on the power scale, not against statsmodels' solve_power()
+# its effect_size root-finding stops early, at nobs1 of 2e5 - 3e6 it is off by up to ~5e-4 relative while the batch answer
+# lands on the power curve, so comparing the solved values would fail correct rows
+ATOL = 1e-6
+
+SCENARIO_DEFAULTS = {'baseline_rate': np.nan,
+                     'mde':           np.nan,
+                     'effect_size':   np.nan,
+                     'nobs1':         np.nan,
+                     'power':         np.nan,
+                     'alpha':         0.05,
+                     'ratio':         1.0,
+                     'alternative':   'two-sided',
+                     'test':          'normal'}
+
+
+def _tail_alpha(alpha, alternative):
+
+    # NOTE: the one tail alpha, halved for two-sided the same way statsmodels does
+    return np.where(alternative == 'two-sided', alpha / 2.0, alpha)
+
+
+def effective_nobs(nobs1, ratio):
+
+    # NOTE: the nobs used by NormalIndPower / TTestIndPower, 1 / (1 / nobs1 + 1 / nobs2) with nobs2 = nobs1 * ratio
+    return 1.0 / (1.0 / nobs1 + 1.0 / (nobs1 * ratio))
+
+
+def normal_power(effect_size, nobs1, alpha, ratio = 1.0, alternative = 'two-sided'):
+
+    # NOTE: vectorized NormalIndPower().power, every argument can be an array (alternative an array of strings)
+    effect_size, nobs1, alpha, ratio, alternative = np.broadcast_arrays(effect_size, nobs1, alpha, ratio, np.asarray(alternative, dtype = object))
+
+    alpha_ = _tail_alpha(alpha, alternative)
+    shift  = effect_size * np.sqrt(effective_nobs(nobs1, ratio))
+
+    upper = np.where(alternative != 'smaller', stats.norm.sf(stats.norm.isf(alpha_) - shift),  0.0)
+    lower = np.where(alternative != 'larger',  stats.norm.cdf(stats.norm.ppf(alpha_) - shift), 0.0)
+
+    return upper + lower
+
+
+def ttest_power(effect_size, nobs1, alpha, ratio = 1.0, alternative = 'two-sided'):
+
+    # NOTE: vectorized TTestIndPower().power, pooled variance with df = nobs1 + nobs2 - 2
+    effect_size, nobs1, alpha, ratio, alternative = np.broadcast_arrays(effect_size, nobs1, alpha, ratio, np.asarray(alternative, dtype = object))
+
+    alpha_ = _tail_alpha(alpha, alternative)
+    df     = nobs1 * (1 + ratio) - 2
+    nc     = effect_size * np.sqrt(effective_nobs(nobs1, ratio))
+
+    upper = np.where(alternative != 'smaller', 1 - special.nctdtr(df, nc, stats.t.isf(alpha_, df)), 0.0)
+    lower = np.where(alternative != 'larger',  special.nctdtr(df, nc, stats.t.ppf(alpha_, df)),     0.0)
+
+    return upper + lower
+
+
+def power_fn(test):
+
+    # NOTE: a helper function to pick the power curve for a 'normal' or 't' row
+    return normal_power if test == 'normal' else ttest_power
+
+
+def _bisect(fn, target, lo, hi, n_iter = 100, log_scale = False):
+
+    # NOTE: vectorized bisection for fn(x) = target where fn is increasing in x, every row keeps its own bracket
+    # log_scale bisects on log(x), better for sample sizes that span several orders of magnitude
+    lo = np.array(lo, dtype = float)
+    hi = np.array(hi, dtype = float)
+
+    for _ in range(n_iter):
+        mid     = np.sqrt(lo * hi) if log_scale else (lo + hi) / 2.0
+        too_low = fn(mid) < target
+        lo      = np.where(too_low, mid, lo)
+        hi      = np.where(too_low, hi, mid)
+
+    return (lo + hi) / 2.0
+
+
+def _expand_bracket(fn, target, hi, max_doublings = 60):
+
+    # NOTE: doubles hi until fn(hi) >= target, so bisection always starts from a valid bracket
+    hi = np.array(hi, dtype = float)
+    for _ in range(max_doublings):
+        short = fn(hi) < target
+        if not short.any():
+            break
+        hi = np.where(short, hi * 2, hi)
+
+    return hi
+
+
+def _two_sided_normal_shift(alpha, power, n_iter = 8):
+
+    # NOTE: the shift t = d * sqrt(n_eff) with norm.sf(z - t) + norm.cdf(-z - t) = power, z = norm.isf(alpha / 2)
+    # Newton from the one tail solution, the other tail is tiny so a few steps reach machine precision
+    z = stats.norm.isf(alpha / 2.0)
+    t = z + stats.norm.ppf(power)
+    for _ in range(n_iter):
+        f = stats.norm.sf(z - t) + stats.norm.cdf(-z - t) - power
+        t = t - f / (stats.norm.pdf(z - t) - stats.norm.pdf(-z - t))
+
+    return t
+
+
+def solve_nobs1(effect_size, power, alpha, ratio, alternative, test = 'normal'):
+
+    # NOTE: closed form for normal rows (Newton for the two-sided shift), bisection on the noncentral t power curve for t rows
+    effect_size, power, alpha, ratio, alternative = np.broadcast_arrays(effect_size, power, alpha, ratio, np.asarray(alternative, dtype = object))
+
+    alpha_ = _tail_alpha(alpha, alternative)
+    d      = np.where(alternative == 'smaller', -effect_size, np.where(alternative == 'two-sided', np.abs(effect_size), effect_size))
+
+    # NOTE: nobs1 from n_eff = ((z_alpha + z_power) / d) ** 2 and n_eff = nobs1 * ratio / (1 + ratio)
+    # an effect size with the wrong sign for a one-sided alternative (or zero) has no solution and gives NaN
+    solvable = d > 0
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        nobs1 = np.where(solvable, ((stats.norm.isf(alpha_) + stats.norm.ppf(power)) / d) ** 2 * (1 + ratio) / ratio, np.nan)
+
+    if test == 'normal':
+        two_sided = alternative == 'two-sided'
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            exact = (_two_sided_normal_shift(alpha, power) / d) ** 2 * (1 + ratio) / ratio
+        return np.where(two_sided & solvable, exact, nobs1)
+
+    power_curve = power_fn(test)
+    fn          = lambda n: power_curve(effect_size, n, alpha, ratio, alternative)
+
+    lo    = (2 + 1e-6) / (1 + ratio)
+    hi    = _expand_bracket(fn, power, np.fmax(np.nan_to_num(nobs1, nan = 2.0), lo) * 2)
+    exact = _bisect(fn, power, lo, hi, log_scale = True)
+
+    return np.where(solvable, exact, np.nan)
+
+
+def solve_effect_size(nobs1, power, alpha, ratio, alternative, test = 'normal'):
+
+    # NOTE: the effect size reaching power, positive for 'larger' / 'two-sided' and negative for 'smaller'
+    nobs1, power, alpha, ratio, alternative = np.broadcast_arrays(nobs1, power, alpha, ratio, np.asarray(alternative, dtype = object))
+
+    alpha_ = _tail_alpha(alpha, alternative)
+    sign   = np.where(alternative == 'smaller', -1.0, 1.0)
+    d      = (stats.norm.isf(alpha_) + stats.norm.ppf(power)) / np.sqrt(effective_nobs(nobs1, ratio))
+
+    if test == 'normal':
+        two_sided = alternative == 'two-sided'
+        exact     = _two_sided_normal_shift(alpha, power) / np.sqrt(effective_nobs(nobs1, ratio))
+        return sign * np.where(two_sided, exact, d)
+
+    power_curve = power_fn(test)
+    fn          = lambda es: power_curve(sign * es, nobs1, alpha, ratio, alternative)
+
+    hi = _expand_bracket(fn, power, d * 2)
+    d  = _bisect(fn, power, np.zeros_like(d), hi)
+
+    return sign * d
+
+
+def proportion_effectsize(prop1, prop2):
+
+    # NOTE: Cohen's h, the same as statsmodels.stats.proportion.proportion_effectsize
+    return 2 * np.arcsin(np.sqrt(prop1)) - 2 * np.arcsin(np.sqrt(prop2))
+
+
+def effectsize_to_mde(effect_size, baseline_rate):
+
+    # NOTE: inverts proportion_effectsize(baseline_rate + mde, baseline_rate) for mde, NaN when no rate in [0, 1] reaches it
+    phi = np.arcsin(np.sqrt(baseline_rate)) + effect_size / 2.0
+    ok  = (phi >= 0) & (phi <= np.pi / 2)
+
+    return np.where(ok, np.sin(np.clip(phi, 0, np.pi / 2)) ** 2 - baseline_rate, np.nan)
+
+
+def scenario_frame(scenarios):
+
+    # NOTE: a helper function to fill in default columns and the effect size implied by baseline_rate + mde
+    df = pd.DataFrame(scenarios).copy()
+    for col, default in SCENARIO_DEFAULTS.items():
+        if col not in df:
+            df[col] = default
+
+    df['alternative'] = df['alternative'].astype(str)
+    df['test']        = df['test'].astype(str)
+
+    from_mde = df['effect_size'].isna() & df['mde'].notna()
+    df.loc[from_mde, 'effect_size'] = proportion_effectsize(df.loc[from_mde, 'baseline_rate'] + df.loc[from_mde, 'mde'],
+                                                            df.loc[from_mde, 'baseline_rate'])
+
+    return df
+
+
+# DEFINE solve_power_batch()
+def solve_power_batch(scenarios):
+    # scenarios: a DataFrame (or anything pd.DataFrame() takes), one row per scenario
+    #            each row leaves exactly one of nobs1, power or (mde and effect_size) as NaN, that one is solved
+    # returns the scenarios with effect_size, mde, nobs1, nobs2, power filled in and a solved_for column
+
+    df = scenario_frame(scenarios)
+
+    missing = pd.DataFrame({'nobs1':       df['nobs1'].isna(),
+                            'power':       df['power'].isna(),
+                            'effect_size': df['effect_size'].isna()})
+    if (missing.sum(axis = 1) != 1).any():
+        bad = df.index[missing.sum(axis = 1) != 1].tolist()
+        raise ValueError(f"rows {bad} must leave exactly one of nobs1, power or mde / effect_size missing")
+
+    df['solved_for'] = missing.idxmax(axis = 1)
+
+    for test in df['test'].unique():
+        if test not in ('normal', 't'):
+            raise ValueError("test must be 'normal' or 't'")
+
+        for solved_for in ('nobs1', 'power', 'effect_size'):
+            rows = (df['test'] == test) & (df['solved_for'] == solved_for)
+            if not rows.any():
+                continue
+
+            s    = df.loc[rows]
+            args = (s['alpha'].to_numpy(float), s['ratio'].to_numpy(float), s['alternative'].to_numpy(object))
+
+            if solved_for == 'nobs1':
+                df.loc[rows, 'nobs1'] = solve_nobs1(s['effect_size'].to_numpy(float), s['power'].to_numpy(float), *args, test = test)
+            elif solved_for == 'power':
+                df.loc[rows, 'power'] = power_fn(test)(s['effect_size'].to_numpy(float), s['nobs1'].to_numpy(float), *args)
+            else:
+                df.loc[rows, 'effect_size'] = solve_effect_size(s['nobs1'].to_numpy(float), s['power'].to_numpy(float), *args, test = test)
+
+    solve_mde = (df['solved_for'] == 'effect_size') & df['baseline_rate'].notna()
+    df.loc[solve_mde, 'mde'] = effectsize_to_mde(df.loc[solve_mde, 'effect_size'].to_numpy(float),
+                                                 df.loc[solve_mde, 'baseline_rate'].to_numpy(float))
+
+    df['nobs2']      = df['nobs1'] * df['ratio']
+    df['nobs1_ceil'] = np.ceil(df['nobs1'])
+
+    return df
+
+
+def check_statsmodels(solved, atol = ATOL):
+
+    # NOTE: puts every solved row back into statsmodels' power() one row at a time and compares with the row's power
+    # for rows solved for power that is statsmodels' power at the same inputs, otherwise it is the target power
+    # slow on purpose, this is the reference the batch solver is held to
+    from statsmodels.stats.power import NormalIndPower, TTestIndPower
+
+    power_diff = []
+    for row in solved.itertuples(index = False):
+        analysis = NormalIndPower() if row.test == 'normal' else TTestIndPower()
+        actual   = getattr(row, row.solved_for)
+
+        if np.isnan(actual):
+            # NOTE: no solution from the batch solver, statsmodels should not find one either
+            kwargs = {'effect_size': row.effect_size, 'nobs1': row.nobs1, 'alpha': row.alpha,
+                      'power': row.power, 'ratio': row.ratio, 'alternative': row.alternative}
+            kwargs[row.solved_for] = None
+            try:
+                expected = analysis.solve_power(**kwargs)
+            except ValueError:
+                expected = np.nan
+            power_diff.append(0.0 if np.isnan(expected) else np.inf)
+            continue
+
+        power = analysis.power(effect_size = row.effect_size,
+                               nobs1       = row.nobs1,
+                               alpha       = row.alpha,
+                               ratio       = row.ratio,
+                               alternative = row.alternative)
+        power_diff.append(abs(power - row.power))
+
+    check = solved.assign(statsmodels_power_diff = power_diff)
+    check['within_tol'] = check['statsmodels_power_diff'] <= atol
+
+    return check
+
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(description = 'Solve sample size, power or MDE for a table of scenarios')
+    parser.add_argument('scenarios', help = 'CSV with one scenario per row')
+    parser.add_argument('-o', '--output', help = 'CSV to write, prints to stdout if omitted')
+    parser.add_argument('--check', action = 'store_true', help = f'check every row against statsmodels power() (atol = {ATOL})')
+    args = parser.parse_args(argv)
+
+    solved = solve_power_batch(pd.read_csv(args.scenarios))
+
+    if args.check:
+        solved = check_statsmodels(solved)
+        print(f"within atol {ATOL}: {solved['within_tol'].sum()} of {len(solved)} rows, "
+              f"max power difference {solved['statsmodels_power_diff'].max():.2e}")
+
+    if args.output:
+        solved.to_csv(args.output, index = False)
+    else:
+        print(solved.to_string())
+
+    if args.check and not solved['within_tol'].all():
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
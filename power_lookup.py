@@ -0,0 +1,217 @@
+# **Overview**
+# * A precomputed sample size table for the `proportion_effectsize` + `NormalIndPower().solve_power` pattern in Effect_Size.py
+#   * e.g. 0.615 -> 0.635 (baseline_rate = 0.615, mde = 0.02), ratio = 19, alpha = 0.05, power = 0.80, alternative = 'larger'
+# * The grid covers (baseline_rate, mde, ratio, alpha, power, alternative) and is stored as .npy files opened with mmap_mode = 'r'
+#   * so many processes can share one copy and only the pages that are touched get read
+# * baseline_rate, log(mde) and log(ratio) are interpolated (trilinear on log(nobs1)), alpha / power / alternative must be grid values
+# * Every grid cell also stores an estimate of its interpolation error in log(nobs1), the larger of
+#   * a curvature estimate from the multilinear interpolation error formula, 1/8 * sum of the second differences along
+#     each axis (max over the cell corners), times SAFETY
+#   * the error measured against the exact solver at the cell's midpoint when the table is built
+#     (the corners are grid points, where the interpolation is exact)
+#   * neither is a guaranteed bound, the second differences only sample the curvature at the nodes, but the midpoint
+#     check catches cells where the curvature estimate is too low
+# * A lookup falls back to the exact solver (power_batch.py) outside the grid or when the cell's estimate is above rtol
+# * alternative = 'smaller' needs a negative mde and 'larger' a positive one, other rows raise a ValueError
+# * An LRU cache sits in front of `nobs1()` for exact repeats
+
+
+import json
+import os
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from power_batch import proportion_effectsize, solve_nobs1
+
+
+SAFETY = 2.0
+
+DEFAULT_AXES = {'baseline_rate': np.round(np.arange(0.02, 0.981, 0.01), 4).tolist(),
+                'mde':           np.geomspace(0.0005, 0.2, 61).tolist(),
+                'ratio':         np.geomspace(1, 100, 41).tolist(),
+                'alpha':         [0.01, 0.05, 0.10],
+                'power':         [0.80, 0.85, 0.90, 0.95],
+                'alternative':   ['larger', 'two-sided']}
+
+DISCRETE_AXES   = ['alpha', 'power', 'alternative']
+CONTINUOUS_AXES = ['baseline_rate', 'mde', 'ratio']
+
+
+def exact_nobs1(baseline_rate, mde, ratio, alpha, power, alternative):
+
+    # NOTE: the exact solver the table is built from and falls back to, vectorized over arrays
+    # baseline_rate + mde outside [0, 1] has no effect size and gives NaN
+    with np.errstate(invalid = 'ignore'):
+        effect_size = proportion_effectsize(np.asarray(baseline_rate) + np.asarray(mde), np.asarray(baseline_rate))
+
+    return solve_nobs1(effect_size, power, alpha, ratio, alternative, test = 'normal')
+
+
+def _axis_coords(axes):
+
+    # NOTE: the coordinates interpolation works in, linear in baseline_rate and log in mde and ratio
+    return [np.asarray(axes['baseline_rate'], dtype = float),
+            np.log(np.asarray(axes['mde'],   dtype = float)),
+            np.log(np.asarray(axes['ratio'], dtype = float))]
+
+
+def _curvature_error(log_n):
+
+    # NOTE: log_n has the continuous axes last, (..., baseline_rate, mde, ratio)
+    # second differences along each axis, edge nodes reuse their neighbour's value
+    estimate = 0
+    for axis in (-3, -2, -1):
+        second = np.abs(np.diff(log_n, n = 2, axis = axis))
+        second = np.concatenate([np.take(second, [0], axis = axis), second, np.take(second, [-1], axis = axis)], axis = axis)
+
+        # NOTE: the max over the two corners of every cell along this axis, then over the other axes' corners
+        cell = np.maximum(np.take(second, range(0, second.shape[axis] - 1), axis = axis),
+                          np.take(second, range(1, second.shape[axis]),     axis = axis))
+        for other in (-3, -2, -1):
+            if other != axis:
+                cell = np.maximum(np.take(cell, range(0, cell.shape[other] - 1), axis = other),
+                                  np.take(cell, range(1, cell.shape[other]),     axis = other))
+        estimate = estimate + cell / 8.0
+
+    return SAFETY * estimate
+
+
+def _midpoint_error(log_n, grid_axes):
+
+    # NOTE: |interpolated - exact| log(nobs1) at every cell's midpoint, the interpolation there is the mean of the 8 corners
+    # grid_axes: the axis values, discrete axes first, in the order of log_n's dimensions
+    interpolated = 0
+    for corner in range(8):
+        offsets      = [(corner >> shift) & 1 for shift in (2, 1, 0)]
+        interpolated = interpolated + log_n[(Ellipsis,) + tuple(slice(o, o + n - 1) for o, n in zip(offsets, log_n.shape[-3:]))] / 8.0
+
+    baseline_rate, log_mde, log_ratio = _axis_coords(dict(zip(CONTINUOUS_AXES, grid_axes[-3:])))
+    midpoints = [np.asarray(axis, dtype = object if name == 'alternative' else float) for name, axis in zip(DISCRETE_AXES, grid_axes[:-3])]
+    midpoints = midpoints + [(baseline_rate[:-1] + baseline_rate[1:]) / 2, np.exp((log_mde[:-1] + log_mde[1:]) / 2), np.exp((log_ratio[:-1] + log_ratio[1:]) / 2)]
+    mid       = dict(zip(DISCRETE_AXES + CONTINUOUS_AXES, np.meshgrid(*midpoints, indexing = 'ij')))
+
+    exact = exact_nobs1(*[mid[name].ravel() for name in ['baseline_rate', 'mde', 'ratio', 'alpha', 'power', 'alternative']])
+
+    return np.abs(interpolated - np.log(exact).reshape(interpolated.shape))
+
+
+# DEFINE build_lookup()
+def build_lookup(path, axes = DEFAULT_AXES):
+    # writes axes.json, log_nobs1.npy and error_estimate.npy to path and returns a SampleSizeLookup on them
+
+    os.makedirs(path, exist_ok = True)
+
+    names = DISCRETE_AXES + CONTINUOUS_AXES
+    grid  = np.meshgrid(*[np.asarray(axes[name], dtype = object if name == 'alternative' else float) for name in names], indexing = 'ij')
+    grid  = dict(zip(names, grid))
+
+    # NOTE: grid points with baseline_rate + mde > 1 have no solution and stay NaN, their cells always use the exact solver
+    nobs1 = exact_nobs1(grid['baseline_rate'].ravel(), grid['mde'].ravel(), grid['ratio'].ravel(),
+                        grid['alpha'].ravel(), grid['power'].ravel(), grid['alternative'].ravel())
+    log_n = np.log(nobs1).reshape(grid['mde'].shape)
+
+    # NOTE: fmax would drop a NaN, a cell with a NaN corner or midpoint keeps NaN and always uses the exact solver
+    error = np.maximum(_curvature_error(log_n), _midpoint_error(log_n, [axes[name] for name in names]))
+
+    np.save(os.path.join(path, 'log_nobs1.npy'),      log_n)
+    np.save(os.path.join(path, 'error_estimate.npy'), error)
+    with open(os.path.join(path, 'axes.json'), 'w') as f:
+        json.dump({name: list(axes[name]) for name in names}, f)
+
+    return SampleSizeLookup(path)
+
+
+class SampleSizeLookup:
+
+    # NOTE: usage
+    #   lookup = build_lookup('power_lookup/')      # once
+    #   lookup = SampleSizeLookup('power_lookup/')  # afterwards, memory-maps the table
+    #   lookup.nobs1(0.615, 0.02, ratio = 19, alternative = 'larger')
+    #   lookup.lookup(scenarios)                   # a DataFrame, vectorized, adds nobs1 / error_estimate / source
+
+    def __init__(self, path, rtol = 1e-3, cache_size = 65536):
+        # rtol: the largest estimated relative error in nobs1 accepted from interpolation, above it the exact solver is used
+
+        with open(os.path.join(path, 'axes.json')) as f:
+            self.axes = json.load(f)
+
+        self.log_n  = np.load(os.path.join(path, 'log_nobs1.npy'),      mmap_mode = 'r')
+        self.error  = np.load(os.path.join(path, 'error_estimate.npy'), mmap_mode = 'r')
+        self.coords = _axis_coords(self.axes)
+        self.rtol   = rtol
+        self.nobs1  = lru_cache(maxsize = cache_size)(self._nobs1)
+
+    def _discrete_index(self, name, values):
+
+        # NOTE: position of each value on a discrete axis, -1 when it is not on the grid
+        axis  = self.axes[name]
+        index = np.full(len(values), -1)
+        for i, axis_value in enumerate(axis):
+            if name == 'alternative':
+                index[values == axis_value] = i
+            else:
+                index[np.isclose(values.astype(float), axis_value)] = i
+
+        return index
+
+    def lookup(self, scenarios):
+        # scenarios: columns baseline_rate, mde, ratio, alpha, power, alternative (defaults 1, 0.05, 0.8, 'larger')
+
+        df = pd.DataFrame(scenarios).copy()
+        for col, default in {'ratio': 1.0, 'alpha': 0.05, 'power': 0.80, 'alternative': 'larger'}.items():
+            if col not in df:
+                df[col] = default
+
+        values = {name: df[name].to_numpy(object if name == 'alternative' else float) for name in DISCRETE_AXES + CONTINUOUS_AXES}
+
+        # NOTE: a one-sided alternative against the direction of mde has no solution, the solver would return NaN silently
+        wrong_sign = ((values['alternative'] == 'smaller') & (values['mde'] > 0)) | ((values['alternative'] == 'larger') & (values['mde'] < 0))
+        if wrong_sign.any():
+            raise ValueError(f"rows {df.index[wrong_sign].tolist()} test in the opposite direction of their mde, "
+                             "alternative = 'smaller' needs mde < 0 and 'larger' needs mde > 0")
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            points = _axis_coords({name: values[name] for name in CONTINUOUS_AXES})   # NOTE: mde <= 0 gives NaN, off the grid
+
+        discrete = [self._discrete_index(name, values[name]) for name in DISCRETE_AXES]
+        on_grid  = np.all([index >= 0 for index in discrete], axis = 0)
+
+        # NOTE: cell index and weight along each continuous axis, points outside the grid are flagged and clipped
+        cells, weights = [], []
+        for coord, point in zip(self.coords, points):
+            on_grid &= (point >= coord[0]) & (point <= coord[-1])
+            cell     = np.clip(np.searchsorted(coord, point, side = 'right') - 1, 0, len(coord) - 2)
+            cells.append(cell)
+            weights.append(np.clip((point - coord[cell]) / (coord[cell + 1] - coord[cell]), 0, 1))
+
+        discrete = [np.where(on_grid, index, 0) for index in discrete]
+
+        log_n = 0
+        for corner in range(8):
+            offsets = [(corner >> shift) & 1 for shift in (2, 1, 0)]
+            weight  = np.prod([w if o else 1 - w for w, o in zip(weights, offsets)], axis = 0)
+            log_n   = log_n + weight * self.log_n[tuple(discrete) + tuple(c + o for c, o in zip(cells, offsets))]
+
+        error      = np.where(on_grid, np.expm1(self.error[tuple(discrete) + tuple(cells)]), np.inf)
+        use_exact  = ~(error <= self.rtol)   # NOTE: also catches NaN estimates next to grid points with no solution (baseline_rate + mde > 1)
+        nobs1      = np.exp(log_n)
+
+        if use_exact.any():
+            nobs1[use_exact] = exact_nobs1(*[values[name][use_exact] for name in ['baseline_rate', 'mde', 'ratio', 'alpha', 'power', 'alternative']])
+
+        return df.assign(nobs1          = nobs1,
+                         error_estimate = np.where(use_exact, 0.0, error),
+                         source         = np.where(use_exact, 'exact', 'grid'))
+
+    def _nobs1(self, baseline_rate, mde, ratio = 1.0, alpha = 0.05, power = 0.80, alternative = 'larger'):
+
+        # NOTE: the scalar entry point, wrapped in an LRU in __init__ so exact repeats skip the interpolation
+        result = self.lookup(pd.DataFrame({'baseline_rate': [baseline_rate],
+                                           'mde':           [mde],
+                                           'ratio':         [ratio],
+                                           'alpha':         [alpha],
+                                           'power':         [power],
+                                           'alternative':   [alternative]}))
+
+        return float(result['nobs1'].iloc[0])
@@ -1,17 +1,25 @@
 
+import numpy as np
+import pandas as pd
 from statsmodels.stats.proportion import test_proportions_2indep, confint_proportions_2indep 
 
+from retention_schema import is_yes
+from stats_kernels import prop_confint_newcomb, prop_ztest
+
 
 def prop_test(df, month, group_var): 
     # NOTE month is just for adding a data labels in params   
 
     # group_var conditon needs to be adjusted 
 
-    retained = int(df.query("group_var == 'Yes'").loc[:,['retained_count_total']].values[0])
-    total    = int(df.query("group_var == 'Yes'").loc[:,['cohort_count_total']].values[0])
+    control = df.loc[is_yes(df[group_var])]     # NOTE: 'Yes' / 'No' strings or bool flags
+    exposed = df.loc[~is_yes(df[group_var])]
+
+    retained = int(control['retained_count_total'].iloc[0])
+    total    = int(control['cohort_count_total'].iloc[0])
 
-    non_retained = int(df.query("group_var == 'No'").loc[:,['retained_count_total']].values[0])
-    non_total    = int(df.query("group_var == 'No'").loc[:,['cohort_count_total']].values[0])    
+    non_retained = int(exposed['retained_count_total'].iloc[0])
+    non_total    = int(exposed['cohort_count_total'].iloc[0])    
 
     prop_test = test_proportions_2indep(count1      = non_retained, 
                                         nobs1       = non_total,
@@ -47,13 +55,13 @@ def prop_test_runner(df, group_var):
 
         df_agg = (df
                     .query(lifetime_months_var) 
-                    .loc[:, ['lifetime_month', 'group_var', 'cohort_count', 'retained_count']]
-                    .groupby(['lifetime_month', 'group_var'])
+                    .loc[:, ['lifetime_month', group_var, 'cohort_count', 'retained_count']]
+                    .groupby(['lifetime_month', group_var])
                     .agg(cohort_count_total  = ('cohort_count', 'sum'),
                         retained_count_total = ('retained_count', 'sum'))
                     .reset_index())  
 
-        prop_test_output             = prop_test(df_agg, month)
+        prop_test_output             = prop_test(df_agg, month, group_var)
         prop_test_output['stat_sig'] = prop_test_output['pvalue'].apply(lambda x: 'Yes' if x <= 0.05 else 'No') 
 
         df_agg = (df_agg
@@ -67,4 +75,61 @@ def prop_test_runner(df, group_var):
             prop_test_results = pd.concat([prop_test_results, prop_test_output], ignore_index=True, axis=0) 
             df_agg_results    = pd.concat([df_agg_results, df_agg], ignore_index=True, axis=0) 
 
-    return prop_test_results, df_agg_results 
+    return prop_test_results, df_agg_results
+
+
+def prop_tests_from_totals(df_agg, group_var, months):
+
+    # NOTE: the prop test of every month from the per (month, group) totals, one row per month in the order of months
+    # the control ('Yes') and exposed ('No') totals of every month side by side, NaN when a month lacks one of the groups
+    # shared with prop_test_runner_duckdb() (duckdb_backend.py), so both backends give the same table
+    order   = pd.Series(np.arange(len(months)), index = months)
+    row     = order.loc[df_agg['lifetime_month']].to_numpy()
+    control = is_yes(df_agg[group_var])
+    counts  = np.full((2, 2, len(months)), np.nan)    # NOTE: (exposed / control, retained / cohort, month)
+    counts[control.astype(int), 0, row] = df_agg['retained_count_total'].to_numpy()
+    counts[control.astype(int), 1, row] = df_agg['cohort_count_total'].to_numpy()
+
+    (non_retained, non_total), (retained, total) = counts
+
+    prop_test       = prop_ztest(non_retained, non_total, retained, total)
+    ci_low, ci_high = prop_confint_newcomb(non_retained, non_total, retained, total)
+
+    prop_test_results = pd.DataFrame({'month':     months,
+                                      'test':      'prop test',
+                                      'statistic': prop_test['statistic'],
+                                      'pvalue':    prop_test['pvalue'],
+                                      'CI Lower':  ci_low,
+                                      'CI Upper':  ci_high})
+    prop_test_results['stat_sig'] = np.where(prop_test_results['pvalue'] <= 0.05, 'Yes', 'No')
+
+    return prop_test_results
+
+
+def prop_test_runner_fast(df, group_var): 
+
+    # NOTE: the same outputs as prop_test_runner() from one groupby, the tests for every month are array operations
+    # agresti-caffo z-test and Newcombe interval, the defaults of test_proportions_2indep / confint_proportions_2indep
+    # months stay in the order they first appear in df, like prop_test_runner()
+
+    df_agg = (df
+                .loc[:, ['lifetime_month', group_var, 'cohort_count', 'retained_count']]
+                .groupby(['lifetime_month', group_var], observed = True)
+                .agg(cohort_count_total   = ('cohort_count', 'sum'),
+                     retained_count_total = ('retained_count', 'sum'))
+                .reset_index())
+
+    months = pd.unique(df['lifetime_month'])
+    order  = pd.Series(np.arange(len(months)), index = months)
+    df_agg = (df_agg
+                .assign(month_order = lambda x: order.loc[x['lifetime_month']].to_numpy())
+                .sort_values(['month_order', group_var], kind = 'stable')
+                .drop(columns = 'month_order')
+                .reset_index(drop = True))
+
+    prop_test_results = prop_tests_from_totals(df_agg, group_var, months)
+
+    df_agg_results = (df_agg
+                        .assign(retained_percent = lambda x: ((x['retained_count_total'] / x['cohort_count_total']) * 100).round(2)))
+
+    return prop_test_results, df_agg_results
@@ -0,0 +1,210 @@
+# **Overview**
+# * A memo cache for the two group tests, so dashboards / notebooks asking the same question again get the stored answer
+#   * `prop_test()` and the statsmodels `test_proportions_2indep()` / `confint_proportions_2indep()` pair rebuild frames and rerun
+#     the test and its interval on every call, even for counts they have seen before
+#   * `t_test()` rebuilds DescrStatsW / CompareMeans from the user level columns every time
+# * The key is a fingerprint of the aggregate the result depends on, not of the input frame
+#   * proportions: count / nobs of both groups, plus alternative, alpha and method
+#   * t-test: n / sum / sumsq of both groups (the Welch test only depends on those), plus the same options
+#   * the statsmodels functions: every argument, defaults included, so positional and keyword calls share a key
+# * `ResultCache` is a bounded LRU in memory, optionally backed by one pickle per key on local disk (temp file + rename, like sim_cache.py)
+#   * a key evicted from memory (or from an earlier session) is read back from disk and counted in disk_hits
+#   * hits / misses / disk_hits counters, see `info()`
+# * Results are returned as copies (DataFrame.copy(), copy.deepcopy() for anything else), callers such as prop_test_runner() add columns to them
+# * The cached functions take the same arguments as the originals, and use the module level RESULT_CACHE unless given cache =
+#
+# **Usage**
+# * from result_cache import prop_test_cached, t_test_cached, test_proportions_2indep_cached, confint_proportions_2indep_cached
+# * result_cache.RESULT_CACHE = ResultCache(maxsize = 100_000, path = 'result_cache/')   # optional, persist across sessions
+# * prop_test_cached(df_agg, month, 'group_var'); RESULT_CACHE.info()
+
+
+import copy
+import functools
+import hashlib
+import inspect
+import json
+import os
+import pickle
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from statsmodels.stats.proportion import confint_proportions_2indep, test_proportions_2indep
+
+from prop_test_multi import prop_test
+from retention_schema import is_yes
+from t_test_or_anova_multi import t_test
+
+
+def _plain(value):
+
+    # NOTE: a JSON friendly version of an argument, numbers go through float() so 19, 19.0 and np.int64(19) share a key
+    if isinstance(value, (bool, np.bool_)) or value is None or isinstance(value, str):
+        return bool(value) if isinstance(value, np.bool_) else value
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return float(value)
+    if isinstance(value, (list, tuple, np.ndarray, pd.Series)):
+        return [_plain(item) for item in np.asarray(value).tolist()]
+
+    return repr(value)
+
+
+def fingerprint(name, fields):
+
+    # NOTE: a hash of the function name and its aggregate inputs / options
+    payload = json.dumps({'name': name, 'fields': {field: _plain(value) for field, value in fields.items()}}, sort_keys = True)
+
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ResultCache:
+
+    # NOTE: usage
+    #   cache  = ResultCache(maxsize = 4096, path = None)   # path = 'result_cache/' also keeps every result on disk
+    #   result = cache.get(key)                             # None on a miss
+    #   cache.put(key, result)
+    #   cache.info()                                        # hits, misses, disk_hits, size, maxsize
+
+    def __init__(self, maxsize = 4096, path = None):
+
+        self.maxsize   = maxsize
+        self.path      = path
+        self.hits      = 0
+        self.misses    = 0
+        self.disk_hits = 0
+        self._results  = OrderedDict()
+
+        if path is not None:
+            os.makedirs(path, exist_ok = True)
+
+    def _file(self, key):
+        return os.path.join(self.path, key[:2], key + '.pkl')
+
+    def _remember(self, key, result):
+
+        self._results[key] = result
+        self._results.move_to_end(key)
+        while len(self._results) > self.maxsize:
+            self._results.popitem(last = False)
+
+    def get(self, key):
+
+        if key in self._results:
+            self.hits += 1
+            self._results.move_to_end(key)
+            return self._results[key]
+
+        if self.path is not None and os.path.exists(self._file(key)):
+            with open(self._file(key), 'rb') as f:
+                result = pickle.load(f)
+            self.disk_hits += 1
+            self._remember(key, result)
+            return result
+
+        self.misses += 1
+        return None
+
+    def put(self, key, result):
+
+        self._remember(key, result)
+
+        if self.path is not None:
+            file_path = self._file(key)
+            os.makedirs(os.path.dirname(file_path), exist_ok = True)
+
+            tmp_path = file_path + f'.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(result, f, protocol = pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, file_path)
+
+    def info(self):
+
+        return {'hits':      self.hits,
+                'misses':    self.misses,
+                'disk_hits': self.disk_hits,
+                'size':      len(self._results),
+                'maxsize':   self.maxsize}
+
+    def clear(self, disk = False):
+
+        self._results.clear()
+        self.hits, self.misses, self.disk_hits = 0, 0, 0
+
+        if disk and self.path is not None:
+            for root, _, files in os.walk(self.path):
+                for file_name in files:
+                    if file_name.endswith('.pkl') or file_name.endswith('.tmp'):
+                        os.remove(os.path.join(root, file_name))
+
+
+RESULT_CACHE = ResultCache()
+
+
+def _lookup(key, compute, cache):
+
+    # NOTE: the cached result of key, or compute() stored under it
+    # the caller always gets a copy, on a miss too, so mutating it (a new column, an array in place) never reaches the cache
+    cache  = RESULT_CACHE if cache is None else cache
+    result = cache.get(key)
+    if result is None:
+        result = compute()
+        cache.put(key, result)
+
+    return result.copy() if isinstance(result, pd.DataFrame) else copy.deepcopy(result)
+
+
+def memoize(func):
+
+    # NOTE: a cached version of func keyed by all of its bound arguments, for functions of scalar aggregates such as the statsmodels tests
+    signature = inspect.signature(func)
+    name      = f'{func.__module__}.{func.__qualname__}'
+
+    @functools.wraps(func)
+    def cached(*args, cache = None, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        return _lookup(fingerprint(name, bound.arguments), lambda: func(*bound.args, **bound.kwargs), cache)
+
+    return cached
+
+
+test_proportions_2indep_cached    = memoize(test_proportions_2indep)
+confint_proportions_2indep_cached = memoize(confint_proportions_2indep)
+
+
+# DEFINE prop_test_cached()
+def prop_test_cached(df, month, group_var, cache = None):
+    # the same arguments and output as prop_test(), keyed by the four totals it tests
+
+    control  = is_yes(df[group_var])
+    retained = df['retained_count_total'].to_numpy()
+    total    = df['cohort_count_total'].to_numpy()
+
+    # NOTE: the first row of each group, like prop_test()
+    fields = {'count1':      retained[~control][0],
+              'nobs1':       total[~control][0],
+              'count2':      retained[control][0],
+              'nobs2':       total[control][0],
+              'month':       month,
+              'alternative': 'two-sided',
+              'alpha':       0.05,
+              'method':      'agresti-caffo / newcomb'}     # NOTE: the statsmodels defaults prop_test() uses
+
+    return _lookup(fingerprint('prop_test', fields), lambda: prop_test(df, month, group_var), cache)
+
+
+# DEFINE t_test_cached()
+def t_test_cached(df, month, metric, cache = None):
+    # the same arguments and output as t_test(), keyed by n / sum / sumsq of the metric in each group
+
+    control = is_yes(df['group_var'])
+    values  = df[metric].to_numpy(dtype = float)
+
+    fields = {}
+    for label, mask in (('1', ~control), ('2', control)):
+        group = values[mask]
+        fields.update({f'n{label}': len(group), f'sum{label}': group.sum(), f'sumsq{label}': group @ group})
+    fields.update({'month': month, 'alternative': 'two-sided', 'alpha': 0.05, 'method': 'welch'})
+
+    return _lookup(fingerprint('t_test', fields), lambda: t_test(df, month, metric), cache)
@@ -0,0 +1,146 @@
+# **Overview**
+# * An append-only, columnar sink for simulation output, instead of growing a DataFrame with `pd.concat` every iteration
+#   * Rows are copied into preallocated typed numpy arrays (one per column)
+#   * When the buffer is full it is flushed as one batch to a partitioned Parquet dataset on local disk
+#   * Memory stays bounded by `batch_rows` and every row is copied a fixed number of times, so the cost is linear
+# * The dataset is partitioned by the grid parameters, so a single cell can be read back without scanning the rest
+# * String columns such as `test` are stored as category codes against a fixed list of categories
+
+
+import os
+import uuid
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+
+# NOTE: a list is a categorical column with those categories, anything else is a numpy dtype
+SIM_SCHEMA = {'test':          ['t test', 'prop test'],
+              't statistic':   'float64',
+              'pvalue':        'float64',
+              'low_CI':        'float64',
+              'high_CI':       'float64',
+              'baseline_rate': 'float64',
+              'mde':           'float64',
+              'population':    'int64',
+              'control_ratio': 'float64'}
+
+SIM_PARTITION_COLS = ['baseline_rate', 'mde', 'population', 'control_ratio']
+
+
+class ResultSink:
+
+    # NOTE: usage
+    #   with ResultSink('sim_results/') as sink:
+    #       sink.append(sim_output)     # a DataFrame (or dict of arrays) with the schema columns
+    #   sim_results = sink.read()
+
+    def __init__(self, path, schema = SIM_SCHEMA, partition_cols = SIM_PARTITION_COLS, batch_rows = 1_000_000):
+
+        self.path           = path
+        self.schema         = dict(schema)
+        self.partition_cols = list(partition_cols)
+        self.batch_rows     = batch_rows
+        self.run_id         = uuid.uuid4().hex[:12]   # NOTE: keeps file names unique across runs writing to the same path
+        self.rows_written   = 0
+        self.batches        = 0
+        self._size          = 0
+        self._buffers       = {}
+
+        for col, dtype in self.schema.items():
+            if isinstance(dtype, (list, tuple)):
+                self._buffers[col] = np.empty(batch_rows, dtype = 'int8' if len(dtype) < 128 else 'int32')
+            else:
+                self._buffers[col] = np.empty(batch_rows, dtype = dtype)
+
+        os.makedirs(path, exist_ok = True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _encode(self, col, values):
+
+        # NOTE: categorical columns are stored as codes, an unknown value would otherwise be silently written as -1
+        categories = self.schema[col]
+        if not isinstance(categories, (list, tuple)):
+            return np.asarray(values)
+
+        # NOTE: get_indexer() gives -1 for values outside categories, pd.Categorical() is deprecated for those
+        codes = pd.Index(categories).get_indexer(values)
+        if (codes < 0).any():
+            raise ValueError(f"column '{col}' has values outside of {categories}")
+
+        return codes
+
+    def append(self, rows):
+
+        # rows: a DataFrame or a dict of equal length arrays holding every schema column
+        columns = {col: self._encode(col, rows[col]) for col in self.schema}
+        n_rows  = len(next(iter(columns.values())))
+
+        start = 0
+        while start < n_rows:
+            take = min(n_rows - start, self.batch_rows - self._size)
+            for col, values in columns.items():
+                self._buffers[col][self._size:self._size + take] = values[start:start + take]
+
+            self._size += take
+            start      += take
+
+            if self._size == self.batch_rows:
+                self.flush()
+
+    def flush(self):
+
+        if self._size == 0:
+            return
+
+        arrays = {}
+        for col, dtype in self.schema.items():
+            values = self._buffers[col][:self._size]
+            if isinstance(dtype, (list, tuple)):
+                arrays[col] = pa.DictionaryArray.from_arrays(pa.array(values), pa.array(list(dtype)))
+            else:
+                arrays[col] = pa.array(values)
+
+        pq.write_to_dataset(pa.table(arrays),
+                            root_path         = self.path,
+                            partition_cols    = self.partition_cols,
+                            basename_template = f"{self.run_id}-{self.batches:06d}-{{i}}.parquet")
+
+        self.rows_written += self._size
+        self.batches      += 1
+        self._size         = 0
+
+    def close(self):
+        self.flush()
+
+    def read(self, filters = None):
+
+        # NOTE: reads the dataset back as one DataFrame, filters is passed to pyarrow e.g. [('mde', '=', 0.02)]
+        self.flush()
+        return read_results(self.path, schema = self.schema, partition_cols = self.partition_cols, filters = filters)
+
+
+def read_results(path, schema = SIM_SCHEMA, partition_cols = SIM_PARTITION_COLS, filters = None):
+
+    # NOTE: the partition columns only live in the directory names, so their types are given explicitly
+    # otherwise pyarrow reads them back as strings and numeric filters fail
+    partitioning = ds.partitioning(pa.schema([(col, pa.from_numpy_dtype(np.dtype(schema[col]))) for col in partition_cols]),
+                                   flavor = 'hive')
+
+    df = pq.read_table(path, partitioning = partitioning, filters = filters).to_pandas()
+
+    for col, dtype in schema.items():
+        if isinstance(dtype, (list, tuple)):
+            df[col] = df[col].astype(pd.CategoricalDtype(list(dtype)))
+        else:
+            df[col] = df[col].astype(dtype)
+
+    return df.loc[:, list(schema)]
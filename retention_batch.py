@@ -0,0 +1,151 @@
+# **Overview**
+# * Runs `test_runner()` for many (test, metric, period, groups) combinations on a process pool
+#   * e.g. every test in ('t-test', 'anova') x period in ('prior', 'cumulative') x every combination of
+#     'group_var', 'tier_type' and 'payment_provider', see `spec_grid()`
+# * The user level frame is written once to an uncompressed Arrow IPC file and every worker memory-maps it
+#   * nothing user level is pickled to the workers, the OS shares the pages between processes
+#   * the columns are read as views into the mapped pages, see `read_arrow()` (columns with nulls are copied)
+#   * each worker only touches the columns its spec needs
+# * Each spec runs through `test_runner_fast()` (retention_engine.py), the same outputs as test_runner()
+# * The results come back as one test table and one aggregate table, each row tagged with its spec
+#   (spec_test, spec_metric, spec_period, spec_groups), t-test and anova columns side by side (NaN where a test has no such column)
+#
+# **Usage**
+# * test_results, df_agg_results = test_runner_batch(new_subs_user_level, spec_grid())
+
+
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+from retention_engine import test_runner_fast
+
+
+SPEC_COLUMNS = ['spec_test', 'spec_metric', 'spec_period', 'spec_groups']
+
+_FRAMES = {}   # NOTE: per worker process, Arrow file path -> memory-mapped table
+
+
+def spec_grid(tests = ('t-test', 'anova'), periods = ('prior', 'cumulative'), groups = ('group_var', 'tier_type', 'payment_provider'), metrics = ('is_retained',)):
+
+    # NOTE: every test x metric x period x non-empty combination of the group columns
+    group_sets = [list(combo) for size in range(1, len(groups) + 1) for combo in combinations(groups, size)]
+
+    return [{'test': test, 'metric': metric, 'period': period, 'groups': group_set}
+            for test in tests for metric in metrics for period in periods for group_set in group_sets]
+
+
+def write_arrow(df, path):
+
+    # NOTE: an uncompressed Arrow IPC file, so readers can memory-map it without a decode step
+    # string columns are dictionary encoded, they come back as pandas categoricals instead of millions of Python strings
+    strings = df.select_dtypes(include = ['object', 'string']).columns
+    table   = pa.Table.from_pandas(df.astype({col: 'category' for col in strings}), preserve_index = False)
+    with pa.OSFile(path, 'wb') as sink:
+        with ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+    return path
+
+
+def _to_series(column):
+
+    # NOTE: a view into the memory-mapped buffers, numeric columns as read-only numpy arrays and
+    # dictionary columns as categoricals over the int8 index buffer
+    # a column with nulls or several chunks has no single buffer to point at, that one is copied
+    if column.null_count or column.num_chunks != 1:
+        return column.to_pandas()
+
+    chunk = column.chunk(0)
+    if pa.types.is_dictionary(chunk.type):
+        codes = chunk.indices.to_numpy(zero_copy_only = True)
+        return pd.Categorical.from_codes(codes, categories = chunk.dictionary.to_pandas())
+
+    try:
+        return chunk.to_numpy(zero_copy_only = True)
+    except pa.ArrowInvalid:
+        return column.to_pandas()
+
+
+def read_arrow(path, columns = None):
+
+    # NOTE: memory-maps the file once per process, the returned columns point into the mapped pages
+    # (see _to_series()), so the workers share the OS page cache instead of each holding a private copy
+    if path not in _FRAMES:
+        _FRAMES[path] = ipc.open_file(pa.memory_map(path, 'r')).read_all()
+
+    table = _FRAMES[path]
+    if columns is not None:
+        table = table.select(columns)
+
+    return pd.DataFrame({name: _to_series(column) for name, column in zip(table.column_names, table.columns)}, copy = False)
+
+
+def _spec_columns(spec):
+
+    keys   = list(dict.fromkeys(spec['groups'] + ['group_var']))
+    metric = [] if spec['metric'] == 'is_retained' else [spec['metric']]
+
+    return list(dict.fromkeys(['lifetime_month', 'potential_lifetime_month'] + keys + metric))
+
+
+def _tag(df, spec):
+
+    tags = {'spec_test':   spec['test'],
+            'spec_metric': spec['metric'],
+            'spec_period': spec['period'],
+            'spec_groups': '+'.join(spec['groups'])}
+
+    return pd.concat([pd.DataFrame(tags, index = df.index), df], axis = 1)
+
+
+def _run_spec(task):
+
+    path, spec = task
+    df_n       = read_arrow(path, _spec_columns(spec))
+
+    test_results, df_agg_results = test_runner_fast(df_n, spec['test'], spec['metric'], spec['period'], spec['groups'])
+
+    return _tag(test_results, spec), _tag(df_agg_results, spec)
+
+
+# DEFINE test_runner_batch()
+def test_runner_batch(df_n, specs, max_workers = None, tmp_dir = None):
+    # df_n:        the user level frame, or the path of an Arrow IPC file written by write_arrow()
+    # specs:       a list of dicts with test / metric / period / groups, e.g. from spec_grid()
+    # max_workers: the process pool size, defaults to os.cpu_count(), 1 runs in this process without a pool
+    # tmp_dir:     where the shared Arrow file is written, defaults to the system temp directory
+
+    owned = None
+    if isinstance(df_n, pd.DataFrame):
+        owned = tempfile.mkdtemp(dir = tmp_dir)
+        path  = write_arrow(df_n, os.path.join(owned, 'df_n.arrow'))
+    else:
+        path = os.fspath(df_n)
+
+    tasks = [(path, spec) for spec in specs]
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+
+    try:
+        if max_workers == 1 or len(tasks) <= 1:
+            outputs = list(map(_run_spec, tasks))
+        else:
+            with ProcessPoolExecutor(max_workers = min(max_workers, len(tasks))) as executor:
+                outputs = list(executor.map(_run_spec, tasks))
+    finally:
+        _FRAMES.pop(path, None)
+        if owned is not None:
+            shutil.rmtree(owned, ignore_errors = True)
+
+    test_results   = pd.concat([output[0] for output in outputs], ignore_index = True)
+    df_agg_results = pd.concat([output[1] for output in outputs], ignore_index = True)
+
+    return test_results, df_agg_results
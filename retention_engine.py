@@ -0,0 +1,456 @@
+# **Overview**
+# * A single pass engine for `test_runner()` in t_test_or_anova_multi.py
+#   * `test_runner()` loops over the lifetime months, rewrites `is_retained` / `is_eligible_population` on the whole frame with
+#     row-wise `.apply(lambda ...)`, re-queries and re-aggregates it, which is O(months x rows) with Python callbacks
+#   * here every user is bucketed once by (group key, lifetime_month, potential_lifetime_month) into a small histogram
+#   * the eligible / retained counts and metric sums for every month then come from 2D suffix sums of that histogram
+# * The month rules are the same as `test_runner()`
+#   * is_retained:             lifetime_month > month
+#   * eligible for 'prior':      lifetime_month >= month - 1 and potential_lifetime_month >= month
+#   * eligible for 'cumulative': potential_lifetime_month >= month
+#   * so both are rectangles in the (lifetime_month, potential_lifetime_month) plane, i.e. one suffix sum lookup each
+# * `test_runner_fast()` returns the same `test_results` / `df_agg_results` as `test_runner()` and does not add columns to df_n
+# * ANOVA for every month also comes from the histogram, see `anova_from_stats()`
+#   * the group level n / sum / sumsq are sufficient for any all-categorical ANOVA, the user level rows are never revisited
+#   * one-way: between / within sums of squares, in the one row per month layout of pingouin's `anova()`
+#     (Source, ddof1, ddof2, F, p-unc, np2, no sums of squares and no 'Within' row)
+#   * multi-factor: the full factorial model with type II sums of squares (what pingouin uses via statsmodels for unbalanced data),
+#     each term is a weighted least squares fit over the group cells, stacked over the months so every month is solved at once
+# * The cost is one pass over the rows plus O(groups x months^2), so tens of millions of users and 36+ months are fine
+# * Histograms of separate chunks of users add up (`MonthHistogram.merge()`)
+#   * `test_runner_chunked()` streams a Parquet dataset or any iterator of DataFrame chunks with a fixed memory budget
+
+
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+from scipy import stats as sp_stats
+
+from group_keys import key_codes
+from retention_schema import is_yes
+from stats_kernels import welch_ttest
+
+
+class MonthHistogram:
+
+    # NOTE: counts (and metric sums / sums of squares) per (key, lifetime_month, potential_lifetime_month)
+    # keys is a DataFrame with one row per group key, the arrays are (keys, months, months) with months offset by lo
+
+    def __init__(self, keys, lo, counts, sums = None, sumsqs = None):
+
+        self.keys   = keys.reset_index(drop = True)
+        self.lo     = lo
+        self.counts = counts
+        self.sums   = sums
+        self.sumsqs = sumsqs
+
+    @classmethod
+    def from_frame(cls, df, keys, metric = 'is_retained', lo = None, hi = None):
+        # metric: 'is_retained' needs no sums (it is derived from the month), any other column is summed per bucket
+        # lo / hi: the month range to cover, defaults to the range in df
+
+        if metric == 'is_retained':
+            return cls._binned(df, keys, None, None, None, lo, hi)
+
+        values = df[metric].to_numpy(dtype = float)
+        return cls._binned(df, keys, None, values, values ** 2, lo, hi)
+
+    @classmethod
+    def from_aggregates(cls, df, keys, lo = None, hi = None):
+        # df: already aggregated cells, columns keys, lifetime_month, potential_lifetime_month, n and optionally sum / sumsq (see to_frame())
+
+        has_sums = 'sum' in df.columns
+        return cls._binned(df, keys,
+                           df['n'].to_numpy(dtype = float),
+                           df['sum'].to_numpy(dtype = float)   if has_sums else None,
+                           df['sumsq'].to_numpy(dtype = float) if has_sums else None,
+                           lo, hi)
+
+    @classmethod
+    def _binned(cls, df, keys, weights, sums, sumsqs, lo, hi):
+
+        # NOTE: one bincount per array over the flat (key, lifetime_month, potential_lifetime_month) index
+        # weights of None counts rows, otherwise each row stands for `weights` users
+        codes, key_table = key_codes(df, keys)
+
+        lifetime  = df['lifetime_month'].to_numpy(dtype = 'int64')
+        potential = df['potential_lifetime_month'].to_numpy(dtype = 'int64')
+
+        valid = codes >= 0   # NOTE: rows with a missing key are dropped, the same as groupby does
+        if lo is None:
+            lo = int(min(lifetime.min(), potential.min())) - 1   # NOTE: room for the month - 1 bound of 'prior'
+        if hi is None:
+            hi = int(max(lifetime.max(), potential.max())) + 1   # NOTE: room for the month + 1 bound of is_retained
+        width = hi - lo + 1
+
+        flat  = (codes[valid] * width + (lifetime[valid] - lo)) * width + (potential[valid] - lo)
+        shape = (len(key_table), width, width)
+        size  = shape[0] * width * width
+
+        if weights is None:
+            counts = np.bincount(flat, minlength = size).reshape(shape)
+        else:
+            counts = np.rint(np.bincount(flat, weights = weights[valid], minlength = size)).astype('int64').reshape(shape)
+
+        if sums is not None:
+            sums   = np.bincount(flat, weights = sums[valid],   minlength = size).reshape(shape)
+            sumsqs = np.bincount(flat, weights = sumsqs[valid], minlength = size).reshape(shape)
+
+        return cls(key_table, lo, counts, sums, sumsqs)
+
+    def to_frame(self):
+
+        # NOTE: the non-empty cells as a long table, the inverse of from_aggregates()
+        key, lifetime, potential = np.nonzero(self.counts)
+
+        df = self.keys.iloc[key].reset_index(drop = True)
+        df['lifetime_month']           = lifetime + self.lo
+        df['potential_lifetime_month'] = potential + self.lo
+        df['n']                        = self.counts[key, lifetime, potential]
+        if self.sums is not None:
+            df['sum']   = self.sums[key, lifetime, potential]
+            df['sumsq'] = self.sumsqs[key, lifetime, potential]
+
+        return df
+
+    def negate(self):
+
+        # NOTE: the histogram with every cell negated, merging it removes these users from another histogram
+        return MonthHistogram(self.keys, self.lo, -self.counts,
+                              None if self.sums is None else -self.sums,
+                              None if self.sumsqs is None else -self.sumsqs)
+
+    def lifetime_months(self):
+
+        # NOTE: the lifetime_month values that have users, what test_months() reads from the user level frame
+        present = self.counts.sum(axis = (0, 2)) > 0
+        return (np.nonzero(present)[0] + self.lo).tolist()
+
+    def _embed(self, keys, lo, hi):
+
+        # NOTE: this histogram's arrays placed into a larger key table / month range, zeros everywhere else
+        width = hi - lo + 1
+        rows  = pd.MultiIndex.from_frame(keys).get_indexer(pd.MultiIndex.from_frame(self.keys))
+        start = self.lo - lo
+        stop  = start + self.counts.shape[1]
+
+        def embed(values):
+            if values is None:
+                return None
+            out = np.zeros((len(keys), width, width), dtype = values.dtype)
+            out[rows, start:stop, start:stop] = values
+            return out
+
+        return embed(self.counts), embed(self.sums), embed(self.sumsqs)
+
+    def merge(self, other):
+
+        # NOTE: histograms of disjoint sets of users add up, so chunks can be counted separately and merged
+        keys = (pd.concat([self.keys, other.keys], ignore_index = True)
+                  .drop_duplicates()
+                  .sort_values(list(self.keys.columns))
+                  .reset_index(drop = True))
+        lo = min(self.lo, other.lo)
+        hi = max(self.lo + self.counts.shape[1], other.lo + other.counts.shape[1]) - 1
+
+        mine, theirs = self._embed(keys, lo, hi), other._embed(keys, lo, hi)
+        summed       = [None if a is None else a + b for a, b in zip(mine, theirs)]
+
+        return MonthHistogram(keys, lo, *summed)
+
+    @staticmethod
+    def _suffix(values):
+
+        # NOTE: S[k, l, p] = sum of values[k, l:, p:], padded with a zero row / column so month + 1 never runs off the end
+        padded = np.pad(values, ((0, 0), (0, 1), (0, 1)))
+        return padded[:, ::-1, ::-1].cumsum(axis = 1).cumsum(axis = 2)[:, ::-1, ::-1]
+
+    def month_stats(self, months, period):
+
+        # NOTE: returns n, sum, sumsq and retained as (months, keys) arrays for the eligible population of each month
+        months = np.asarray(months, dtype = 'int64')
+        p_lo   = months - self.lo
+        r_lo   = months + 1 - self.lo
+
+        if period == 'prior':
+            l_lo = np.maximum(months - 1 - self.lo, 0)
+        elif period == 'cumulative':
+            l_lo = np.zeros_like(months)
+        else:
+            raise ValueError("period must be 'prior' or 'cumulative'")
+
+        counts   = self._suffix(self.counts)
+        n        = counts[:, l_lo, p_lo].T
+        retained = counts[:, r_lo, p_lo].T
+
+        if self.sums is None:
+            sums, sumsqs = retained, retained    # NOTE: is_retained is 0 / 1, so its sum and sum of squares are the retained count
+        else:
+            sums   = self._suffix(self.sums)[:, l_lo, p_lo].T
+            sumsqs = self._suffix(self.sumsqs)[:, l_lo, p_lo].T
+
+        return {'n': n, 'sum': sums, 'sumsq': sumsqs, 'retained': retained}
+
+
+def test_months(df_n, period):
+
+    # NOTE: the months test_runner() loops over
+    return period_months(df_n.loc[:, 'lifetime_month'].unique().tolist(), period)
+
+
+def period_months(lifetime_months, period):
+
+    lifetime_months = sorted(lifetime_months)
+
+    if period == 'prior':
+        lifetime_months = lifetime_months[:-1]
+    elif period == 'cumulative':
+        lifetime_months = lifetime_months[1:-1]
+
+    return lifetime_months
+
+
+def collapse(values, codes, n_groups):
+
+    # NOTE: sums the key columns of a (months, keys) array into (months, groups) given each key's group code
+    out = np.zeros((values.shape[0], n_groups), dtype = values.dtype)
+    np.add.at(out.T, codes, values.T)
+
+    return out
+
+
+def group_codes(keys, by):
+
+    # NOTE: each key row's group number when keys are collapsed to the `by` columns, plus the table of those groups
+    grouped = keys.groupby(by, observed = True, sort = True)
+
+    return grouped.ngroup().to_numpy(), grouped.size().index.to_frame(index = False)
+
+
+def t_test_from_stats(stats, keys, months, alpha = 0.05):
+
+    # NOTE: the t_test() comparison, exposed (group_var 'No') minus control (group_var 'Yes'), two-sided Welch
+    codes, labels = group_codes(keys, ['group_var'])
+    n     = collapse(stats['n'],     codes, len(labels)).astype(float)
+    sums  = collapse(stats['sum'],   codes, len(labels))
+    sumsq = collapse(stats['sumsq'], codes, len(labels))
+
+    yes = np.flatnonzero(is_yes(labels['group_var']))[0]    # NOTE: 'Yes' / 'No' strings or the bool flags of retention_schema.py
+    no  = np.flatnonzero(~is_yes(labels['group_var']))[0]
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        mean = sums / n
+        var  = sumsq / n - mean ** 2   # NOTE: ddof=0 variance, the one DescrStatsW keeps
+
+    t_test = welch_ttest(n[:, no], mean[:, no], var[:, no], n[:, yes], mean[:, yes], var[:, yes], alternative = 'two-sided', alpha = alpha)
+
+    test_results = pd.DataFrame({'month':       months,
+                                 'test':        't test',
+                                 't statistic': t_test['statistic'],
+                                 'pvalue':      t_test['pvalue'],
+                                 'CI Lower':    t_test['low_CI'],
+                                 'CI Upper':    t_test['high_CI']})
+    test_results['stat_sig'] = np.where(test_results['pvalue'] <= 0.05, 'Yes', 'No')
+
+    return test_results
+
+
+def retention_rate_from_stats(stats, keys, months, groups):
+
+    # NOTE: the report_metric(df, 'retention_rate', groups) table for every month
+    # groups with users but none retained are kept with churned_count = 0, the same as report_metric()
+    codes, labels = group_codes(keys, groups)
+    total    = collapse(stats['n'],        codes, len(labels))
+    retained = collapse(stats['retained'], codes, len(labels))
+
+    df_agg = pd.concat([labels] * len(months), ignore_index = True)
+    df_agg.insert(0, 'lifetime_month_ref', np.repeat(months, len(labels)))
+    df_agg['total_count']   = total.ravel()
+    df_agg['churned_count'] = retained.ravel()
+
+    df_agg = (df_agg
+                .query('total_count > 0')
+                .assign(retention_rate = lambda x: ((x['churned_count'] / x['total_count']) * 100).round(3))
+                .reset_index(drop = True))
+
+    return df_agg
+
+
+def _term_columns(cells, term):
+
+    # NOTE: treatment coded dummies for one term (a tuple of factors), the first level of each factor is the reference
+    columns = np.ones((len(cells), 1))
+    for factor in term:
+        codes, levels = pd.factorize(cells[factor], sort = True)
+        dummies = (codes[:, None] == np.arange(1, len(levels))[None, :]).astype(float)
+        columns = (columns[:, :, None] * dummies[:, None, :]).reshape(len(cells), -1)
+
+    return columns
+
+
+def _wls_fit(design, n, sums, sumsqs):
+
+    # NOTE: the residual sum of squares and rank of a cell level model for every month at once
+    # design is (cells, params), n / sums / sumsqs are (months, cells); user level y gives the same fit as cell means weighted by n
+    weights = np.sqrt(n)[:, :, None] * design[None, :, :]
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        means = np.where(n > 0, sums / n, 0)
+
+    beta   = np.linalg.pinv(weights) @ (np.sqrt(n) * means)[:, :, None]
+    fitted = (design[None, :, :] @ beta)[:, :, 0]
+    rss    = (sumsqs - 2 * fitted * sums + n * fitted ** 2).sum(axis = 1)
+    rank   = np.linalg.matrix_rank(design[None, :, :] * (n > 0)[:, :, None])
+
+    return rss, rank
+
+
+def batched_anova(n, sums, sumsqs, cells, factors):
+
+    # NOTE: n / sums / sumsqs are (months, cells) arrays, cells is a DataFrame with the factor levels of each cell
+    # returns a dict of Source -> (SS, DF) arrays over the months, the residual under 'Residual'
+    n      = np.asarray(n,      dtype = float)
+    sums   = np.asarray(sums,   dtype = float)
+    sumsqs = np.asarray(sumsqs, dtype = float)
+
+    terms   = [term for size in range(1, len(factors) + 1) for term in combinations(factors, size)]
+    columns = {term: _term_columns(cells, term) for term in terms}
+    columns[()] = np.ones((len(cells), 1))
+
+    def fit(model):
+        return _wls_fit(np.hstack([columns[term] for term in [()] + model]), n, sums, sumsqs)
+
+    rss_full, rank_full = fit(terms)
+
+    sources = {}
+    for term in terms:
+        # NOTE: type II, the term added to every term that does not contain it
+        without = [other for other in terms if not set(term) <= set(other)]
+        rss_without, rank_without = fit(without)
+        rss_with,    rank_with    = fit(without + [term])
+        sources[' * '.join(term)] = (rss_without - rss_with, rank_with - rank_without)
+
+    sources['Residual'] = (rss_full, n.sum(axis = 1) - rank_full)
+
+    return sources
+
+
+def anova_from_stats(stats, keys, months, groups):
+
+    # NOTE: the df.anova(dv = metric, between = groups) table of test_runner() for every month, one tidy frame
+    # multi-factor columns: month, Source, SS, DF, MS, F, p-unc, np2 (partial eta squared), with a 'Residual' row
+    # one-way columns:      month, Source, ddof1, ddof2, F, p-unc, np2, one row per month, pingouin's layout without detailed = True
+    codes, cells = group_codes(keys, groups)
+    n      = collapse(stats['n'],     codes, len(cells))
+    sums   = collapse(stats['sum'],   codes, len(cells))
+    sumsqs = collapse(stats['sumsq'], codes, len(cells))
+
+    sources = batched_anova(n, sums, sumsqs, cells, groups)
+    ss_res, df_res = sources['Residual']
+
+    if len(groups) == 1:
+        ss, dof = sources[groups[0]]
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            f = (ss / dof) / (ss_res / df_res)
+
+            return pd.DataFrame({'month':  months,
+                                 'Source': groups[0],
+                                 'ddof1':  dof,
+                                 'ddof2':  df_res,
+                                 'F':      f,
+                                 'p-unc':  sp_stats.f.sf(f, dof, df_res),
+                                 'np2':    ss / (ss + ss_res)})
+
+    frames = []
+    for source, (ss, dof) in sources.items():
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            ms     = ss / dof
+            is_res = source == 'Residual'
+            f      = np.full(len(months), np.nan) if is_res else ms / (ss_res / df_res)
+            p      = np.full(len(months), np.nan) if is_res else sp_stats.f.sf(f, dof, df_res)
+            np2    = np.full(len(months), np.nan) if is_res else ss / (ss + ss_res)
+
+        frames.append(pd.DataFrame({'month': months, 'Source': source, 'SS': ss, 'DF': dof, 'MS': ms, 'F': f, 'p-unc': p, 'np2': np2}))
+
+    order = {source: i for i, source in enumerate(sources)}
+
+    return (pd.concat(frames, ignore_index = True)
+             .sort_values(['month', 'Source'], key = lambda col: col.map(order) if col.name == 'Source' else col, kind = 'stable')
+             .reset_index(drop = True))
+
+
+def run_from_stats(stats, keys, months, test, period, groups):
+
+    # NOTE: the test_runner() outputs from the per (month, key) eligible stats, shared by every entry point
+    # stats: n / sum / sumsq / retained as (months, keys) arrays, keys: the key table with one row per column of those arrays
+    if test == 't-test':
+        test_results = t_test_from_stats(stats, keys, months)
+    elif test == 'anova':
+        test_results = anova_from_stats(stats, keys, months, groups).round(2)
+    else:
+        raise ValueError(f"test '{test}' is not supported by test_runner_fast(), use test_runner()")
+
+    df_agg_results = retention_rate_from_stats(stats, keys, months, groups)
+
+    if period == 'prior':
+        test_results   = test_results.query("month > 0")
+        df_agg_results = df_agg_results.query("lifetime_month_ref > 0")
+
+    df_agg_results = df_agg_results.rename(columns = {'lifetime_month_ref': 'lifetime_month'})
+
+    return test_results, df_agg_results
+
+
+# DEFINE test_runner_fast()
+def test_runner_fast(df_n, test, metric, period, groups):
+    # the same arguments and outputs as test_runner()
+    # test:   't-test', 'anova' (the ANOVA is on metric, test_runner() always passes dv = 'is_retained' to pingouin)
+    # metric: 'is_retained' or any numeric user level column
+    # period: 'prior', 'cumulative'
+    # groups: a list with any single value or combination of values: 'group_var', tier_type' & 'payment_provider'
+
+    months = test_months(df_n, period)
+    keys   = list(dict.fromkeys(groups + ['group_var']))
+    hist   = MonthHistogram.from_frame(df_n, keys, metric)
+
+    return run_from_stats(hist.month_stats(months, period), hist.keys, months, test, period, groups)
+
+
+def parquet_chunks(path, columns, batch_rows = 1_000_000):
+
+    # NOTE: streams a Parquet file or directory batch by batch (pyarrow reads a row group at a time), only the named columns
+    import pyarrow.dataset as ds
+
+    dataset = ds.dataset(path, format = 'parquet', partitioning = 'hive')
+    for batch in dataset.to_batches(columns = columns, batch_size = batch_rows):
+        yield batch.to_pandas()
+
+
+# DEFINE test_runner_chunked()
+def test_runner_chunked(source, test, metric, period, groups, batch_rows = 1_000_000):
+    # the same outputs as test_runner() / test_runner_fast() without holding the user level table in memory
+    # source:     a Parquet file / directory path, or an iterable of DataFrame chunks (e.g. pd.read_csv(..., chunksize = ...))
+    # batch_rows: the most rows read at once from Parquet
+    # memory is one chunk plus the month histogram (keys x months x months), whatever the number of users
+
+    keys = list(dict.fromkeys(groups + ['group_var']))
+
+    if isinstance(source, (str, bytes)) or hasattr(source, '__fspath__'):
+        columns = ['lifetime_month', 'potential_lifetime_month'] + keys + ([] if metric == 'is_retained' else [metric])
+        source  = parquet_chunks(source, list(dict.fromkeys(columns)), batch_rows = batch_rows)
+
+    hist, lifetime_months = None, set()
+    for chunk in source:
+        if len(chunk) == 0:
+            continue
+
+        lifetime_months.update(chunk['lifetime_month'].unique().tolist())
+        chunk_hist = MonthHistogram.from_frame(chunk, keys, metric)
+        hist       = chunk_hist if hist is None else hist.merge(chunk_hist)
+
+    if hist is None:
+        raise ValueError("test_runner_chunked() got no rows")
+
+    months = period_months(lifetime_months, period)
+
+    return run_from_stats(hist.month_stats(months, period), hist.keys, months, test, period, groups)
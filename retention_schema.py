@@ -0,0 +1,111 @@
+# **Overview**
+# * A compact, typed schema for the user level retention data test_runner() works on
+#   * the extracts store flags as 'Yes' / 'No' strings (group_var) and months as int64, i.e. a Python object per flag and 8 bytes per month
+#   * `load_retention()` converts to bool flags, int16 months, int8 0 / 1 indicators and categorical group columns
+#   * that is several times less memory and the flag / month filters become vectorized integer comparisons
+# * `validate_retention()` checks the columns test_runner() relies on and raises a ValueError listing every problem
+# * The testing functions accept either form, a flag is 'Yes' when it is True, 1 or the string 'Yes' (see `is_yes()`)
+#
+# **Usage**
+# * new_subs_user_level = load_retention('new_subs_user_level.parquet')
+# * new_subs_user_level = load_retention(new_subs_user_level)    # or convert a frame that is already loaded
+
+
+import os
+
+import numpy as np
+import pandas as pd
+
+
+# NOTE: column -> compact dtype, columns not listed here are left as they are
+RETENTION_SCHEMA = {'user_id':                  'int64',
+                    'lifetime_month':           'int16',
+                    'potential_lifetime_month': 'int16',
+                    'group_var':                'bool',
+                    'is_eligible_population':   'bool',
+                    'is_retained':              'int8',
+                    'tier_type':                'category',
+                    'payment_provider':         'category'}
+
+REQUIRED_COLUMNS = ['lifetime_month', 'potential_lifetime_month', 'group_var']
+
+YES_VALUES = {'Yes', 'yes', 'Y', 'y', 'True', 'true', '1', 1, True}
+NO_VALUES  = {'No', 'no', 'N', 'n', 'False', 'false', '0', 0, False}
+
+
+def is_yes(values):
+
+    # NOTE: a boolean mask of 'Yes' for a flag stored as bool, 0 / 1 or 'Yes' / 'No' strings (plain or categorical)
+    values = pd.Series(values) if not isinstance(values, pd.Series) else values
+
+    if pd.api.types.is_bool_dtype(values.dtype) or pd.api.types.is_integer_dtype(values.dtype):
+        return values.to_numpy().astype(bool)
+
+    return values.isin(YES_VALUES).to_numpy()
+
+
+def _check_flag(values, column, problems):
+
+    known = values.isin(YES_VALUES | NO_VALUES)
+    if not known.all():
+        problems.append(f"{column}: values other than Yes / No: {sorted(map(str, values[~known].unique()))[:5]}")
+
+
+# DEFINE validate_retention()
+def validate_retention(df):
+    # raises a ValueError listing every problem, returns df unchanged when there are none
+
+    problems = [f"missing column {column}" for column in REQUIRED_COLUMNS if column not in df.columns]
+
+    for column in ['lifetime_month', 'potential_lifetime_month']:
+        if column not in df.columns:
+            continue
+        values = pd.to_numeric(df[column], errors = 'coerce')
+        if values.isna().any():
+            problems.append(f"{column}: {int(values.isna().sum())} missing or non numeric values")
+        elif (values < 0).any() or (values != np.floor(values)).any():
+            problems.append(f"{column}: months must be whole numbers >= 0")
+        elif values.max() > np.iinfo('int16').max:
+            problems.append(f"{column}: months above {np.iinfo('int16').max}")
+
+    if not problems and (df['lifetime_month'] > df['potential_lifetime_month']).any():
+        problems.append("lifetime_month is above potential_lifetime_month for "
+                        f"{int((df['lifetime_month'] > df['potential_lifetime_month']).sum())} users")
+
+    for column in ['group_var', 'is_eligible_population']:
+        if column in df.columns and not pd.api.types.is_bool_dtype(df[column].dtype):
+            _check_flag(df[column], column, problems)
+
+    if problems:
+        raise ValueError("invalid retention data:\n  " + "\n  ".join(problems))
+
+    return df
+
+
+# DEFINE load_retention()
+def load_retention(source, columns = None, schema = RETENTION_SCHEMA):
+    # source:  a DataFrame, or a .parquet / .csv path
+    # columns: the columns to read, defaults to all of them
+    # returns a validated copy in the compact schema
+
+    if isinstance(source, pd.DataFrame):
+        df = source if columns is None else source.loc[:, columns]
+    elif os.fspath(source).endswith('.csv'):
+        df = pd.read_csv(source, usecols = columns)
+    else:
+        df = pd.read_parquet(source, columns = columns)
+
+    validate_retention(df)
+
+    converted = {}
+    for column, dtype in schema.items():
+        if column not in df.columns:
+            continue
+        if dtype == 'bool':
+            converted[column] = is_yes(df[column])
+        elif dtype == 'category':
+            converted[column] = df[column].astype('category')
+        else:
+            converted[column] = df[column].to_numpy().astype(dtype)
+
+    return df.assign(**converted)
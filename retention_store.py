@@ -0,0 +1,293 @@
+# **Overview**
+# * Incremental daily refresh of the `test_runner()` and `prop_test_runner()` results
+#   * rerunning them over the full history every day repeats work for months nothing changed in
+#   * here the aggregates are persisted and each update only folds in the new / changed rows
+# * `RetentionStore` keeps the user level aggregates for test_runner()
+#   * per (group key, lifetime_month, potential_lifetime_month) cell: n, and sum / sumsq for an engagement metric
+#   * potential_lifetime_month is fixed by the signup cohort, so a cell is a (cohort, lifetime_month, group) aggregate
+#   * retained counts are not stored, they follow from lifetime_month for each test month (see retention_engine.py)
+# * `CohortStore` keeps cohort_count / retained_count per (lifetime_month, group_var) for prop_test_runner()
+# * `update(new_rows, old_rows)` adds the new rows and subtracts the previous version of changed rows
+#   * a user changes when their lifetime_month / potential_lifetime_month moves on, pass their old row in old_rows
+#   * the stale months are the ones whose eligible n / retained / sums the update moves, read off the delta histogram
+#     (new rows minus old rows) for both periods, so a user who ages by a month only stales the months their rows disagree on
+#     and a new cohort (potential_lifetime_month 0) only stales month 0
+#   * those months are marked stale in every cached result, the other months keep their cached rows
+# * `results()` recomputes the stale months only and reuses the cached rows for the rest
+# * So a daily refresh costs about the size of the new data plus the (small) aggregate table, not the full history
+# * Files are written via a temp file + rename, like sim_cache.py
+#
+# **Usage**
+# * store = RetentionStore('retention_store/', groups = ['group_var', 'tier_type'])
+# * store.update(todays_new_and_changed_users, old_rows = their_previous_rows)
+# * test_results, df_agg_results = store.results('t-test', 'cumulative')
+
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from retention_engine import MonthHistogram, period_months, run_from_stats
+from summary_tests import prop_test_summary
+
+
+def _write_parquet(df, file_path):
+
+    tmp_path = file_path + f'.{os.getpid()}.tmp'
+    df.to_parquet(tmp_path, index = False)
+    os.replace(tmp_path, file_path)
+
+
+def _write_json(state, file_path):
+
+    tmp_path = file_path + f'.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, file_path)
+
+
+class _ResultCache:
+
+    # NOTE: the persisted results of a store, one pair of Parquet files per result name, plus the stale months of each in state.json
+    # state: {'computed': {name: [months]}, 'stale': {name: [months]}}
+
+    def __init__(self, path):
+
+        self.path       = path
+        self.state_path = os.path.join(path, 'state.json')
+        self.state      = {'computed': {}, 'stale': {}}
+
+        os.makedirs(os.path.join(path, 'results'), exist_ok = True)
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                self.state.update(json.load(f))
+
+    def _file(self, name, part):
+        return os.path.join(self.path, 'results', f'{name}_{part}.parquet')
+
+    def mark_stale(self, months):
+
+        for name in self.state['computed']:
+            self.state['stale'][name] = sorted(set(self.state['stale'].get(name, [])) | set(months))
+        _write_json(self.state, self.state_path)
+
+    def months_to_compute(self, name, months):
+
+        # NOTE: months never computed for this result plus the ones an update touched since
+        computed = set(self.state['computed'].get(name, []))
+        stale    = set(self.state['stale'].get(name, []))
+
+        return [month for month in months if month not in computed or month in stale]
+
+    def load(self, name, part):
+
+        file_path = self._file(name, part)
+        return pd.read_parquet(file_path) if os.path.exists(file_path) else None
+
+    def save(self, name, months, parts):
+
+        for part, df in parts.items():
+            _write_parquet(df, self._file(name, part))
+
+        self.state['computed'][name] = sorted(int(month) for month in months)
+        self.state['stale'][name]    = []
+        _write_json(self.state, self.state_path)
+
+
+def _combine(cached, fresh, month_col, months, recomputed):
+
+    # NOTE: the cached rows of months that were not recomputed and are still tested, plus the fresh rows, in month order
+    if cached is not None:
+        keep   = cached[month_col].isin(months) & ~cached[month_col].isin(recomputed)
+        frames = [cached.loc[keep], fresh]
+    else:
+        frames = [fresh]
+
+    frames = [frame for frame in frames if len(frame)]
+    if not frames:
+        return fresh.reset_index(drop = True)
+
+    return (pd.concat(frames, ignore_index = True)
+             .sort_values(month_col, kind = 'stable')
+             .reset_index(drop = True))
+
+
+def _stale_months(delta):
+
+    # NOTE: the months whose eligible n / retained / sum / sumsq the delta histogram moves, for either period
+    # a changed user's old and new rows cancel out in every month they agree on, so those months keep their cached results
+    # the delta starts at lo = -1, so month 0 up are all on its grid, past its last potential_lifetime_month nothing is eligible
+    months = list(range(0, delta.lo + delta.counts.shape[1]))
+
+    stale = set()
+    for period in ('prior', 'cumulative'):
+        stats = delta.month_stats(months, period)
+        moved = np.any([np.any(values != 0, axis = 1) for values in stats.values()], axis = 0)
+        stale.update(month for month, is_moved in zip(months, moved) if is_moved)
+
+    return sorted(stale)
+
+
+class RetentionStore:
+
+    # NOTE: usage
+    #   store = RetentionStore('retention_store/', groups = ['group_var', 'tier_type'], metric = 'is_retained')
+    #   store.update(new_rows)                      # first load, the full history once
+    #   store.update(new_rows, old_rows = old_rows) # daily, new users and the previous rows of changed users
+    #   store.results('t-test', 'cumulative')       # or 'anova', 'prior'; groups can be any subset of the stored ones
+
+    def __init__(self, path, groups, metric = 'is_retained'):
+
+        self.path    = path
+        self.groups  = list(groups)
+        self.metric  = metric
+        self.keys    = list(dict.fromkeys(self.groups + ['group_var']))
+        self.cache   = _ResultCache(path)
+        self.hist    = None
+
+        agg_path = os.path.join(path, 'aggregates.parquet')
+        if os.path.exists(agg_path):
+            self.hist = MonthHistogram.from_aggregates(pd.read_parquet(agg_path), self.keys)
+
+        meta = {'keys': self.keys, 'metric': self.metric}
+        if self.cache.state.setdefault('meta', meta) != meta:
+            raise ValueError(f"the store at {path} holds {self.cache.state['meta']}, not {meta}")
+
+    def update(self, new_rows, old_rows = None):
+        # new_rows: user level rows to add (new users and the current version of changed users)
+        # old_rows: the previous version of the changed users, subtracted from the aggregates
+        # returns the months whose results went stale
+
+        # NOTE: lo = -1 puts every month from 0 up on the delta's grid, see _stale_months()
+        deltas = []
+        if new_rows is not None and len(new_rows):
+            deltas.append(MonthHistogram.from_frame(new_rows, self.keys, self.metric, lo = -1))
+        if old_rows is not None and len(old_rows):
+            deltas.append(MonthHistogram.from_frame(old_rows, self.keys, self.metric, lo = -1).negate())
+
+        if not deltas:
+            return []
+
+        delta = deltas[0] if len(deltas) == 1 else deltas[0].merge(deltas[1])
+
+        # NOTE: merged into a local histogram, the store only changes once the update is known to be valid
+        hist = delta if self.hist is None else self.hist.merge(delta)
+
+        if (hist.counts < 0).any():
+            raise ValueError("old_rows removed users that are not in the store")
+
+        stale = _stale_months(delta)
+
+        # NOTE: stale months first, a crash before the aggregates are written then only costs a recompute
+        self.cache.mark_stale(stale)
+        _write_parquet(hist.to_frame(), os.path.join(self.path, 'aggregates.parquet'))
+        self.hist = hist
+
+        return stale
+
+    def results(self, test, period, groups = None):
+        # the same outputs as test_runner(df_n, test, metric, period, groups) over every row folded in so far
+
+        if self.hist is None:
+            raise ValueError(f"the store at {self.path} is empty, call update() first")
+
+        groups = self.groups if groups is None else list(groups)
+        name   = '_'.join([test, period] + groups)
+
+        months  = period_months(self.hist.lifetime_months(), period)
+        compute = self.cache.months_to_compute(name, months)
+
+        cached_tests, cached_agg = self.cache.load(name, 'tests'), self.cache.load(name, 'agg')
+        if not compute and cached_tests is not None:
+            return (cached_tests.loc[cached_tests['month'].isin(months)].reset_index(drop = True),
+                    cached_agg.loc[cached_agg['lifetime_month'].isin(months)].reset_index(drop = True))
+
+        compute = compute or months
+        fresh_tests, fresh_agg = run_from_stats(self.hist.month_stats(compute, period), self.hist.keys, compute, test, period, groups)
+
+        test_results   = _combine(cached_tests, fresh_tests, 'month',          months, compute)
+        df_agg_results = _combine(cached_agg,   fresh_agg,   'lifetime_month', months, compute)
+        self.cache.save(name, months, {'tests': test_results, 'agg': df_agg_results})
+
+        return test_results, df_agg_results
+
+
+class CohortStore:
+
+    # NOTE: usage
+    #   store = CohortStore('cohort_store/')
+    #   store.update(new_cohort_rows, old_rows = previous_cohort_rows)
+    #   prop_test_results, df_agg_results = store.results()
+
+    def __init__(self, path, group_var = 'group_var'):
+
+        self.path      = path
+        self.group_var = group_var
+        self.cache     = _ResultCache(path)
+        self.agg_path  = os.path.join(path, 'aggregates.parquet')
+        self.df_agg    = pd.read_parquet(self.agg_path) if os.path.exists(self.agg_path) else None
+
+    def _aggregate(self, df, sign):
+
+        return (df
+                 .groupby(['lifetime_month', self.group_var], observed = True)
+                 .agg(cohort_count_total   = ('cohort_count', 'sum'),
+                      retained_count_total = ('retained_count', 'sum'))
+                 .mul(sign))
+
+    def update(self, new_rows, old_rows = None):
+        # new_rows / old_rows: cohort level rows with lifetime_month, group_var, cohort_count, retained_count
+        # returns the months whose results went stale
+
+        deltas = [self._aggregate(rows, sign) for rows, sign in ((new_rows, 1), (old_rows, -1)) if rows is not None and len(rows)]
+        if not deltas:
+            return []
+
+        current = [self.df_agg.set_index(['lifetime_month', self.group_var])] if self.df_agg is not None else []
+        df_agg  = pd.concat(current + deltas).groupby(level = [0, 1]).sum()
+
+        if (df_agg < 0).any(axis = None):
+            raise ValueError("old_rows removed cohorts that are not in the store")
+
+        df_agg = df_agg.loc[df_agg['cohort_count_total'] != 0]
+        df_agg = df_agg.reset_index().sort_values(['lifetime_month', self.group_var]).reset_index(drop = True)
+
+        # NOTE: a month is tested on its own totals, it is stale only when the update moves them
+        delta = pd.concat(deltas).groupby(level = [0, 1]).sum()
+        stale = sorted(set(delta.loc[(delta != 0).any(axis = 1)].index.get_level_values(0).tolist()))
+
+        # NOTE: stale months first, a crash before the aggregates are written then only costs a recompute
+        self.cache.mark_stale(stale)
+        _write_parquet(df_agg, self.agg_path)
+        self.df_agg = df_agg
+
+        return stale
+
+    def results(self):
+        # the same outputs as prop_test_runner(df, group_var), months in sorted order
+
+        if self.df_agg is None:
+            raise ValueError(f"the store at {self.path} is empty, call update() first")
+
+        months  = sorted(self.df_agg['lifetime_month'].unique().tolist())
+        compute = self.cache.months_to_compute('prop_test', months)
+
+        cached_tests, cached_agg = self.cache.load('prop_test', 'tests'), self.cache.load('prop_test', 'agg')
+        if not compute and cached_tests is not None:
+            return cached_tests, cached_agg
+
+        compute = compute or months
+        df_agg = self.df_agg.loc[self.df_agg['lifetime_month'].isin(compute)]
+        stats  = df_agg.rename(columns = {self.group_var: 'group_var', 'retained_count_total': 'count', 'cohort_count_total': 'nobs'})
+
+        fresh_tests = prop_test_summary(stats).rename(columns = {'lifetime_month': 'month'})
+        fresh_tests['stat_sig'] = np.where(fresh_tests['pvalue'] <= 0.05, 'Yes', 'No')
+        fresh_agg   = df_agg.assign(retained_percent = lambda x: ((x['retained_count_total'] / x['cohort_count_total']) * 100).round(2))
+
+        prop_test_results = _combine(cached_tests, fresh_tests, 'month',          months, compute)
+        df_agg_results    = _combine(cached_agg,   fresh_agg,   'lifetime_month', months, compute)
+        self.cache.save('prop_test', months, {'tests': prop_test_results, 'agg': df_agg_results})
+
+        return prop_test_results, df_agg_results
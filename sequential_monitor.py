@@ -0,0 +1,265 @@
+# **Overview**
+# * Sequential monitoring of the `prop_test()` comparison while events arrive, instead of rerunning prop_test_runner() in batch on a schedule
+#   * `SequentialMonitor.run(source)` is an asyncio consumer, source is any async iterable of events (dicts)
+#   * `tail_events()` follows a local JSON lines file as it is appended to, `queue_events()` reads an in-process asyncio.Queue
+# * Each event adds to running count / nobs totals per (lifetime_month, arm), a dict update, so ingesting is O(1) per event
+#   * user level events: one row per user with is_retained, nobs = 1
+#   * cohort level events: retained_count / cohort_count increments, set count = 'retained_count', nobs = 'cohort_count'
+# * Every `every` events (and / or `interval` seconds) the tests are recomputed from the totals alone, history is never rescanned
+#   * every arm is compared with the control arm in each month, exposed - control like prop_test()
+# * The tests are anytime-valid, so the results can be looked at after every publish and stopped early without inflating the false positives
+#   * 'msprt': the mixture SPRT for a difference in proportions (normal approximation, N(0, tau^2) mixture over the difference)
+#     pvalue is the always-valid p-value (the running minimum of 1 / likelihood ratio), CI Lower / CI Upper a confidence sequence
+#   * 'alpha-spending': a Lan-DeMets spending function ('obf' O'Brien-Fleming type or 'pocock') over the information fraction nobs / max_nobs
+#     each look tests the agresti-caffo z-test at the alpha spent since the previous look, a Bonferroni split of the spent alpha,
+#     valid for any number of looks and a little conservative compared with the exact group sequential boundaries
+# * Once a comparison is significant it stays significant, stat_sig is 'Yes' from that publish on
+# * look numbers the results() calls (1, 2, ...), the interim analyses the p-values / intervals / spent alpha are valid over
+#
+# **Usage**
+# * monitor = SequentialMonitor(method = 'msprt', every = 10_000, publish = print)
+# * results = asyncio.run(monitor.run(tail_events('events.jsonl', idle_timeout = 60)))
+# * results = await monitor.run(queue_events(queue))    # in a notebook / a running event loop, producers queue.put(event), then queue.put(None)
+
+
+import asyncio
+import inspect
+import json
+import time
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from retention_schema import YES_VALUES
+from stats_kernels import prop_confint_newcomb, prop_ztest
+
+
+RESULT_COLUMNS = ['look', 'month', 'arm', 'vs', 'test', 'nobs', 'vs_nobs', 'diff', 'statistic', 'pvalue', 'CI Lower', 'CI Upper', 'stat_sig']
+
+
+def spending_function(t, alpha = 0.05, kind = 'obf'):
+
+    # NOTE: the cumulative alpha spent at information fraction t (0 to 1), Lan-DeMets approximations
+    t = np.clip(np.asarray(t, dtype = float), 0, 1)
+
+    if kind == 'obf':
+        with np.errstate(divide = 'ignore'):
+            return np.where(t > 0, 2 * stats.norm.sf(stats.norm.isf(alpha / 2) / np.sqrt(t)), 0.0)
+    elif kind == 'pocock':
+        return alpha * np.log(1 + (np.e - 1) * t)
+    else:
+        raise ValueError("kind must be 'obf' or 'pocock'")
+
+
+def msprt(count1, nobs1, count2, nobs2, tau = 0.05, alpha = 0.05):
+
+    # NOTE: the mixture SPRT for p1 - p2 with a N(0, tau^2) mixture, using the plug-in variance of the difference
+    # returns a dict of arrays: diff, statistic (the likelihood ratio), pvalue (1 / ratio, capped at 1), low_CI, high_CI
+    # the interval is the set of differences the ratio would not reject at alpha, one step of a confidence sequence
+    count1, nobs1 = np.asarray(count1, dtype = float), np.asarray(nobs1, dtype = float)
+    count2, nobs2 = np.asarray(count2, dtype = float), np.asarray(nobs2, dtype = float)
+
+    p1, p2 = count1 / nobs1, count2 / nobs2
+    diff   = p1 - p2
+    var    = p1 * (1 - p1) / nobs1 + p2 * (1 - p2) / nobs2
+    tau2   = tau ** 2
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore', over = 'ignore'):
+        ratio = np.sqrt(var / (var + tau2)) * np.exp(tau2 * diff ** 2 / (2 * var * (var + tau2)))
+        width = np.sqrt(2 * var * (var + tau2) / tau2 * (np.log(1 / alpha) + 0.5 * np.log((var + tau2) / var)))
+
+    # NOTE: a zero variance (every user retained, or none) says nothing yet, keep those at ratio 1
+    ratio = np.where(var > 0, ratio, 1.0)
+    width = np.where(var > 0, width, np.inf)
+
+    return {'diff':      diff,
+            'statistic': ratio,
+            'pvalue':    np.minimum(1, 1 / ratio),
+            'low_CI':    diff - width,
+            'high_CI':   diff + width}
+
+
+async def queue_events(queue):
+
+    # NOTE: events from an asyncio.Queue, a None put on the queue ends the stream
+    while True:
+        event = await queue.get()
+        if event is None:
+            return
+        yield event
+
+
+async def tail_events(path, poll = 0.5, idle_timeout = None, from_start = True, batch_lines = 10_000):
+
+    # NOTE: JSON lines appended to a local file, one event per line
+    # poll:         seconds to wait when the file has no new complete line
+    # idle_timeout: stop after this many seconds without a new line, None follows the file forever
+    # from_start:   False skips the lines already in the file, like tail -f
+    # a line without its newline yet is held back until the writer finishes it
+    with open(path, 'r') as f:
+        if not from_start:
+            f.seek(0, 2)
+
+        partial   = ''
+        last_line = time.monotonic()
+        while True:
+            lines = 0
+            while lines < batch_lines:
+                line = f.readline()
+                if not line:
+                    break
+                partial += line
+                if not partial.endswith('\n'):
+                    continue
+                if partial.strip():
+                    yield json.loads(partial)
+                partial = ''
+                lines  += 1
+
+            if lines:
+                last_line = time.monotonic()
+                await asyncio.sleep(0)      # NOTE: a long backlog still lets the rest of the event loop run
+                continue
+
+            if idle_timeout is not None and time.monotonic() - last_line >= idle_timeout:
+                return
+            await asyncio.sleep(poll)
+
+
+class SequentialMonitor:
+
+    # NOTE: usage
+    #   monitor = SequentialMonitor(method = 'msprt', tau = 0.05, every = 10_000)
+    #   results = asyncio.run(monitor.run(queue_events(queue)))   # or tail_events('events.jsonl')
+    #   monitor.add(event); monitor.results()                     # the same without asyncio, e.g. replaying a list of events
+    #   monitor.latest                                            # the last published results
+
+    def __init__(self, arm = 'group_var', month = 'lifetime_month', count = 'is_retained', nobs = None, control = 'Yes',
+                 method = 'msprt', alpha = 0.05, tau = 0.05, max_nobs = None, spending = 'obf',
+                 every = 10_000, interval = None, publish = None):
+        # arm / month:     the event fields of the arm and the lifetime_month
+        # count / nobs:    the success field and the trials field, nobs = None counts each event as one trial
+        # control:         the arm every other arm is compared with, the default 'Yes' reads group_var flags ('Yes' / 'No', bool, 0 / 1)
+        # method:          'msprt' (tau is the mixture sd of the difference) or 'alpha-spending' (needs max_nobs, the planned nobs of a comparison)
+        # every / interval: publish after this many events and / or seconds, None turns either off
+        # publish:         a function (or coroutine function) called with each results DataFrame
+
+        if method not in ('msprt', 'alpha-spending'):
+            raise ValueError("method must be 'msprt' or 'alpha-spending'")
+        if method == 'alpha-spending' and not max_nobs:
+            raise ValueError("alpha-spending needs max_nobs, the planned sample size of a comparison")
+
+        self.arm      = arm
+        self.month    = month
+        self.count    = count
+        self.nobs     = nobs
+        self.control  = control
+        self.method   = method
+        self.alpha    = alpha
+        self.tau      = tau
+        self.max_nobs = max_nobs
+        self.spending = spending
+        self.every    = every
+        self.interval = interval
+        self.publish  = publish
+
+        self.events   = 0
+        self.looks    = 0
+        self.latest   = None
+        self._totals  = {}     # NOTE: (month, arm) -> [count, nobs]
+        self._state   = {}     # NOTE: (month, arm) -> running pvalue / CI / spent alpha / stat_sig of that comparison
+        self._flag    = control == 'Yes'
+
+    def add(self, event):
+
+        arm = event[self.arm]
+        if self._flag:
+            arm = 'Yes' if arm in YES_VALUES else 'No'
+
+        totals = self._totals.get((event[self.month], arm))
+        if totals is None:
+            totals = self._totals[(event[self.month], arm)] = [0, 0]
+
+        totals[0] += event[self.count]
+        totals[1] += 1 if self.nobs is None else event[self.nobs]
+        self.events += 1
+
+    def _comparisons(self):
+
+        # NOTE: (month, arm) of every non-control arm whose month also has the control arm, and the four totals as arrays
+        pairs = [(month, arm) for (month, arm) in self._totals if arm != self.control and (month, self.control) in self._totals]
+        pairs.sort(key = lambda pair: (pair[0], str(pair[1])))
+
+        arm_totals     = np.array([self._totals[pair] for pair in pairs], dtype = float).reshape(-1, 2)
+        control_totals = np.array([self._totals[(month, self.control)] for month, _ in pairs], dtype = float).reshape(-1, 2)
+
+        return pairs, arm_totals, control_totals
+
+    def results(self):
+        # the anytime-valid tests over everything added so far, one row per (month, arm) vs the control arm
+
+        pairs, arm_totals, control_totals = self._comparisons()
+        count1, nobs1 = arm_totals.T
+        count2, nobs2 = control_totals.T
+        self.looks   += 1
+
+        if self.method == 'msprt':
+            test = msprt(count1, nobs1, count2, nobs2, tau = self.tau, alpha = self.alpha)
+        else:
+            test = prop_ztest(count1, nobs1, count2, nobs2)
+
+        rows = []
+        for i, pair in enumerate(pairs):
+            state = self._state.setdefault(pair, {'pvalue': 1.0, 'low': -np.inf, 'high': np.inf, 'spent': 0.0, 'stat_sig': 'No'})
+
+            if self.method == 'msprt':
+                # NOTE: the running minimum p-value and the running intersection of the intervals stay valid at any stopping time
+                state['pvalue'] = min(state['pvalue'], float(test['pvalue'][i]))
+                state['low']    = max(state['low'],  float(test['low_CI'][i]))
+                state['high']   = min(state['high'], float(test['high_CI'][i]))
+                diff, statistic, pvalue = test['diff'][i], test['statistic'][i], state['pvalue']
+                significant     = pvalue <= self.alpha
+            else:
+                spent   = float(spending_function((nobs1[i] + nobs2[i]) / self.max_nobs, self.alpha, self.spending))
+                level   = spent - state['spent']
+                state['spent'] = spent
+                if level > 0:
+                    state['low'], state['high'] = (float(v[0]) for v in prop_confint_newcomb(count1[i:i + 1], nobs1[i:i + 1], count2[i:i + 1], nobs2[i:i + 1], alpha = level))
+                diff, statistic, pvalue = count1[i] / nobs1[i] - count2[i] / nobs2[i], test['statistic'][i], test['pvalue'][i]
+                significant     = level > 0 and pvalue <= level
+
+            if significant:
+                state['stat_sig'] = 'Yes'
+
+            rows.append((self.looks, pair[0], pair[1], self.control, self.method, nobs1[i], nobs2[i], diff, statistic, pvalue,
+                         state['low'], state['high'], state['stat_sig']))
+
+        return pd.DataFrame(rows, columns = RESULT_COLUMNS)
+
+    async def _publish(self):
+
+        self.latest = self.results()
+        if self.publish is not None:
+            output = self.publish(self.latest)
+            if inspect.isawaitable(output):
+                await output
+
+    async def run(self, source):
+        # source: an async iterable of event dicts, e.g. tail_events() or queue_events()
+        # returns the results after the source ends, also published
+
+        since   = 0
+        due     = None if self.interval is None else time.monotonic() + self.interval
+        async for event in source:
+            self.add(event)
+            since += 1
+
+            if (self.every is not None and since >= self.every) or (due is not None and time.monotonic() >= due):
+                await self._publish()
+                since = 0
+                due   = None if self.interval is None else time.monotonic() + self.interval
+
+        await self._publish()
+
+        return self.latest
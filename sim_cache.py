@@ -0,0 +1,105 @@
+# **Overview**
+# * A content-addressed, on-disk cache of finished simulation grid cells
+#   * The key is a hash of (baseline_rate, mde, population, control_ratio, samples, seed, code version)
+#   * The code version is a hash of the source of the simulation kernels (`sim_fast()` and the helpers it calls), so changing
+#     how a cell is simulated invalidates old cells, while edits elsewhere in sim_engine.py or stats_kernels.py keep them
+# * Each cell is written as its own Parquet file as soon as it finishes, via a temp file + rename so a crash never leaves half a file
+# * So a re-run skips cached cells, an interrupted sweep resumes where it stopped, and widening the grid only computes the new cells
+#   * This relies on the per cell seeding of sim_runner_parallel(), a cell's stream depends only on the seed and its own parameters
+
+
+import hashlib
+import importlib
+import inspect
+import json
+import os
+
+import pandas as pd
+
+
+# NOTE: everything a cell's output depends on, from the per cell seed to the output columns
+ENGINE_KERNELS = {'sim_engine':    ['SIM_COLUMNS', 'segment_sizes', 'sim_tests_from_counts', 'sim_frame', 'sim_fast',
+                                    'cell_seed_sequence', '_sim_cell'],
+                  'stats_kernels': ['_pvalue', 'bernoulli_stats', 'welch_ttest', 'prop_ztest', 'wilson_confint',
+                                    'prop_confint_newcomb']}
+
+
+def code_version():
+
+    # NOTE: a short hash of the kernel source, functions by inspect.getsource() and constants by repr()
+    digest = hashlib.sha256()
+    for module_name, names in ENGINE_KERNELS.items():
+        module = importlib.import_module(module_name)
+        for name in names:
+            obj    = getattr(module, name)
+            source = inspect.getsource(obj) if inspect.isfunction(obj) else repr(obj)
+            digest.update(f'{module_name}.{name}\n{source}\n'.encode())
+
+    return digest.hexdigest()[:16]
+
+
+def cell_key(cell, samples, seed, version = None):
+
+    # NOTE: floats go through float() so 19 and 19.0 hash the same
+    if version is None:
+        version = code_version()
+
+    baseline_rate, mde, population, control_ratio = cell
+    payload = json.dumps({'baseline_rate': float(baseline_rate),
+                          'mde':           float(mde),
+                          'population':    int(population),
+                          'control_ratio': float(control_ratio),
+                          'samples':       int(samples),
+                          'seed':          seed,
+                          'version':       version}, sort_keys = True)
+
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class CellCache:
+
+    # NOTE: usage
+    #   cache = CellCache('sim_cache/')
+    #   sim_runner_parallel(..., seed = 2023, cache = cache)
+    #   cache.hits, cache.misses
+
+    def __init__(self, path):
+
+        self.path    = path
+        self.version = code_version()
+        self.hits    = 0
+        self.misses  = 0
+
+        os.makedirs(path, exist_ok = True)
+
+    def _file(self, key):
+        return os.path.join(self.path, key[:2], key + '.parquet')
+
+    def key(self, cell, samples, seed):
+        return cell_key(cell, samples, seed, self.version)
+
+    def get(self, key):
+
+        file_path = self._file(key)
+        if not os.path.exists(file_path):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return pd.read_parquet(file_path)
+
+    def put(self, key, sim_output):
+
+        file_path = self._file(key)
+        os.makedirs(os.path.dirname(file_path), exist_ok = True)
+
+        tmp_path = file_path + f'.{os.getpid()}.tmp'
+        sim_output.to_parquet(tmp_path, index = False)
+        os.replace(tmp_path, file_path)
+
+    def clear(self):
+
+        for root, _, files in os.walk(self.path):
+            for file_name in files:
+                if file_name.endswith('.parquet') or file_name.endswith('.tmp'):
+                    os.remove(os.path.join(root, file_name))
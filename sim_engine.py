@@ -0,0 +1,370 @@
+# **Overview**
+# * A faster engine for the `sim()` simulation in sim_t_test_vs_prop_test.py
+# * `sim()` draws a full 0/1 array per segment with `binomial(1, p, size = n)` and builds DescrStatsW objects from it
+#   * For binary outcomes the only thing the tests need is the success count of each segment
+#   * So `sim_fast()` draws `binomial(n, p, size = samples)` once per segment, which gives the counts of every replicate at once
+#   * The Welch t-test and the two proportions z-test are then computed in closed form over the whole arrays (see stats_kernels.py)
+# * The output has the same rows and columns as `sim()`, so the plots and summaries work unchanged
+#   * 'larger' alternative and unequal variance for the t-test, default methods for the prop test (as in `sim()`)
+# * `sim_runner_parallel()` spreads the grid cells over a `concurrent.futures` process pool
+#   * Each cell gets its own stream from one `numpy.random.SeedSequence`, keyed by the cell's parameters
+#   * So a run with a given seed gives the same results whatever the worker count or the order of the grid
+# * `sim_runner_parallel()` also takes an optional `cache` (sim_cache.py) to skip cells that were already simulated
+# * `sim_adaptive()` runs replicates in batches and stops once the Monte Carlo standard error of the target is small enough
+# * Both runners take an optional `sink` (result_sink.py) to stream cells to Parquet instead of concatenating in memory
+
+
+import hashlib
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from stats_kernels import bernoulli_stats, welch_ttest, prop_ztest, prop_confint_newcomb
+
+
+SIM_COLUMNS = ['test', 't statistic', 'pvalue', 'low_CI', 'high_CI', 'baseline_rate', 'mde', 'population', 'control_ratio']
+
+
+def segment_sizes(population, control_ratio):
+
+    # NOTE: the same split as sim(), control is population / control_ratio rounded up
+    control_n = math.ceil(population / control_ratio)
+    exposed_n = population - control_n
+
+    return control_n, exposed_n
+
+
+def sim_tests_from_counts(control_count, control_n, exposed_count, exposed_n):
+
+    # NOTE: a helper function to run both tests on arrays of success counts (one element per replicate)
+    # returns a dict of arrays for the 't test' and the 'prop test' rows
+    control_mean, control_var = bernoulli_stats(control_count, control_n)
+    exposed_mean, exposed_var = bernoulli_stats(exposed_count, exposed_n)
+
+    t_test = welch_ttest(control_n, control_mean, control_var,
+                         exposed_n, exposed_mean, exposed_var,
+                         alternative = 'larger')
+
+    prop_test    = prop_ztest(control_count, control_n, exposed_count, exposed_n, alternative = 'larger')
+    prop_test_ci = prop_confint_newcomb(control_count, control_n, exposed_count, exposed_n)
+
+    return {'t test':    {'t statistic': t_test['statistic'],
+                          'pvalue':      t_test['pvalue'],
+                          'low_CI':      t_test['low_CI'],
+                          'high_CI':     t_test['high_CI']},
+            'prop test': {'t statistic': prop_test['statistic'],
+                          'pvalue':      prop_test['pvalue'],
+                          'low_CI':      prop_test_ci[0],
+                          'high_CI':     np.full_like(prop_test_ci[0], np.inf)}}   # NOTE: sim() reports inf, not prop_test_ci[1]
+
+
+def sim_frame(tests, baseline_rate, mde, population, control_ratio):
+
+    # NOTE: a helper function to lay the arrays out like sim(), all 't test' rows first and then all 'prop test' rows
+    frames = []
+    for test, values in tests.items():
+        frame = pd.DataFrame(values)
+        frame.insert(0, 'test', test)
+        frames.append(frame)
+
+    output = pd.concat(frames, ignore_index=True, axis=0)
+    output = output.assign(baseline_rate = baseline_rate,
+                           mde           = mde,
+                           population    = population,
+                           control_ratio = control_ratio)
+
+    return output.loc[:, SIM_COLUMNS]
+
+
+# DEFINE sim_fast()
+def sim_fast(baseline_rate, mde, population, control_ratio, samples, rng = None):
+    # rng: a numpy Generator, defaults to a fresh np.random.default_rng()
+
+    if rng is None:
+        rng = np.random.default_rng()
+
+    control_n, exposed_n = segment_sizes(population, control_ratio)
+
+    control_count = rng.binomial(control_n, (baseline_rate + mde), size = samples)
+    exposed_count = rng.binomial(exposed_n, baseline_rate,         size = samples)
+
+    tests = sim_tests_from_counts(control_count, control_n, exposed_count, exposed_n)
+
+    return sim_frame(tests, baseline_rate, mde, population, control_ratio)
+
+
+def collect_outputs(sim_outputs, sink = None):
+
+    # NOTE: a helper function to gather per cell outputs, either with one concat at the end or streamed into a sink
+    if sink is None:
+        return pd.concat(list(sim_outputs), ignore_index=True, axis=0)
+
+    for sim_output in sim_outputs:
+        sink.append(sim_output)
+    sink.flush()
+
+    return sink
+
+
+# DEFINE sim_runner_fast()
+def sim_runner_fast(baseline_rates, mdes, populations, control_ratios, samples, rng = None, sink = None):
+
+    if rng is None:
+        rng = np.random.default_rng()
+
+    sim_outputs = (sim_fast(baseline_rate = baseline_rate,
+                            mde           = mde,
+                            population    = population,
+                            control_ratio = control_ratio,
+                            samples       = samples,
+                            rng           = rng)
+                   for baseline_rate in baseline_rates
+                   for mde in mdes
+                   for population in populations
+                   for control_ratio in control_ratios)
+
+    return collect_outputs(sim_outputs, sink)
+
+
+def grid_cells(baseline_rates, mdes, populations, control_ratios):
+
+    # NOTE: the grid in the same order as the nested loops of sim_runner()
+    return [(baseline_rate, mde, population, control_ratio)
+            for baseline_rate in baseline_rates
+            for mde in mdes
+            for population in populations
+            for control_ratio in control_ratios]
+
+
+def cell_seed_sequence(root, cell):
+
+    # NOTE: a child of root the same way SeedSequence.spawn() builds one, but the spawn key comes from a hash of the
+    # cell's parameters instead of a running counter, so a cell's stream does not depend on its position in the grid
+    digest = hashlib.sha256(repr(tuple(float(x) for x in cell)).encode()).digest()
+    key    = tuple(int.from_bytes(digest[i:i + 4], 'little') for i in range(0, 16, 4))
+
+    return np.random.SeedSequence(entropy = root.entropy, spawn_key = root.spawn_key + key)
+
+
+def _sim_cell(task):
+
+    # NOTE: the process pool worker, kept at module level so it can be pickled
+    cell, seed_seq, samples = task
+    baseline_rate, mde, population, control_ratio = cell
+
+    return sim_fast(baseline_rate = baseline_rate,
+                    mde           = mde,
+                    population    = population,
+                    control_ratio = control_ratio,
+                    samples       = samples,
+                    rng           = np.random.default_rng(seed_seq))
+
+
+def _cached_outputs(cache_keys, cached, computed, cache):
+
+    # NOTE: a helper function to walk the grid in order, taking each cell from the cache or from the computed stream
+    # a newly computed cell is written to the cache before the next one is yielded, so a crash loses at most the cells in flight
+    for key in cache_keys:
+        if key in cached:
+            yield cached.pop(key)
+        else:
+            sim_output = next(computed)
+            cache.put(key, sim_output)
+            yield sim_output
+
+
+# DEFINE sim_runner_parallel()
+def sim_runner_parallel(baseline_rates, mdes, populations, control_ratios, samples, seed = None, max_workers = None, sink = None, cache = None):
+    # seed:        an int (or None for fresh OS entropy), the root of every cell's SeedSequence
+    # max_workers: the process pool size, defaults to os.cpu_count(), 1 runs in this process without a pool
+    # sink:        an optional ResultSink (result_sink.py), each cell is appended as it finishes and the sink is returned
+    # cache:       an optional CellCache (sim_cache.py), cached cells are skipped and new cells are stored as they finish
+
+    if cache is not None and seed is None:
+        raise ValueError("a cache needs a fixed seed, otherwise no cell can be reused")
+
+    root  = np.random.SeedSequence(seed)
+    cells = grid_cells(baseline_rates, mdes, populations, control_ratios)
+    tasks = [(cell, cell_seed_sequence(root, cell), samples) for cell in cells]
+
+    if cache is not None:
+        cache_keys = [cache.key(cell, samples, seed) for cell in cells]
+        cached     = {}
+        for key in cache_keys:
+            sim_output = cache.get(key)
+            if sim_output is not None:
+                cached[key] = sim_output
+        todo = [task for task, key in zip(tasks, cache_keys) if key not in cached]
+    else:
+        todo = tasks
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+
+    if max_workers == 1 or len(todo) <= 1:
+        computed = map(_sim_cell, todo)
+        if cache is not None:
+            computed = _cached_outputs(cache_keys, cached, computed, cache)
+        return collect_outputs(computed, sink)
+
+    with ProcessPoolExecutor(max_workers = max_workers) as executor:
+        computed = executor.map(_sim_cell, todo, chunksize = max(1, len(todo) // (4 * max_workers)))
+        if cache is not None:
+            computed = _cached_outputs(cache_keys, cached, computed, cache)
+        return collect_outputs(computed, sink)
+
+
+def mc_tally(tests, target, mde, alpha = 0.05, tally = None):
+
+    # NOTE: a helper function for the running per test totals of the target, so each batch of replicates is read once
+    # power:    1 for a replicate with pvalue <= alpha
+    # coverage: 1 for a replicate whose one-sided CI covers the true difference (low_CI <= mde)
+    # low_CI:   the lower CI bound itself
+    # a tally is (replicates, sum, centred sum of squares), a new batch is merged in with Chan et al.'s pairwise update
+    tally = {} if tally is None else dict(tally)
+    for test, values in tests.items():
+        if target == 'power':
+            x = (values['pvalue'] <= alpha).astype(float)
+        elif target == 'coverage':
+            x = (values['low_CI'] <= mde).astype(float)
+        elif target == 'low_CI':
+            x = np.asarray(values['low_CI'], dtype = float)
+        else:
+            raise ValueError("target must be 'power', 'coverage' or 'low_CI'")
+
+        n_b, sum_b = len(x), x.sum()
+        m2_b       = ((x - sum_b / n_b) ** 2).sum()
+
+        if test not in tally:
+            tally[test] = (n_b, sum_b, m2_b)
+            continue
+
+        n_a, sum_a, m2_a = tally[test]
+        n     = n_a + n_b
+        delta = sum_b / n_b - sum_a / n_a
+        tally[test] = (n, sum_a + sum_b, m2_a + m2_b + delta ** 2 * n_a * n_b / n)
+
+    return tally
+
+
+def mc_estimate(tally, target):
+
+    # NOTE: a helper function for the Monte Carlo estimate of the target and its standard error, per test, from mc_tally()
+    # the shares get an Agresti-Coull standard error, (hits + 2) / (n + 4), so it stays above 0 when every replicate
+    # (or none) hits, the plain sqrt(p (1 - p) / n) is 0 there and would stop sim_adaptive() far too early
+    estimates = {}
+    for test, (n, total, m2) in tally.items():
+        estimate = total / n
+
+        if target == 'low_CI':
+            mc_se = math.sqrt(m2 / (n - 1) / n) if n > 1 else math.inf
+        else:
+            shrunk = (total + 2) / (n + 4)
+            mc_se  = math.sqrt(shrunk * (1 - shrunk) / (n + 4))
+
+        estimates[test] = (estimate, mc_se)
+
+    return estimates
+
+
+# DEFINE sim_adaptive()
+def sim_adaptive(baseline_rate, mde, population, control_ratio, target = 'power', tol = 0.005, batch_size = 50,
+                 min_samples = 50, max_samples = 5000, alpha = 0.05, rng = None):
+    # target:      'power', 'coverage' or 'low_CI', the quantity whose Monte Carlo standard error is controlled
+    # tol:         stop once the standard error of target is <= tol for both tests
+    # batch_size:  replicates drawn per batch, min_samples / max_samples bound the replicates per cell
+    # returns the sim_fast() style rows and a one row summary with the stopping rule and the final replicate count
+
+    if rng is None:
+        rng = np.random.default_rng()
+
+    control_n, exposed_n = segment_sizes(population, control_ratio)
+
+    # NOTE: only the new batch is tested, the stopping rule works from running totals and the rows are joined once at the end
+    batches = []
+    tally   = None
+    n       = 0
+
+    while True:
+        size = min(batch_size, max_samples - n)
+
+        control_count = rng.binomial(control_n, (baseline_rate + mde), size = size)
+        exposed_count = rng.binomial(exposed_n, baseline_rate,         size = size)
+
+        tests = sim_tests_from_counts(control_count, control_n, exposed_count, exposed_n)
+        batches.append(tests)
+
+        tally     = mc_tally(tests, target, mde, alpha = alpha, tally = tally)
+        estimates = mc_estimate(tally, target)
+        mc_se     = max(se for _, se in estimates.values())
+        n        += size
+
+        # NOTE: all hits / no hits (or identical low_CI values) in the first batches says little, ask for one more batch first
+        degenerate = any(estimate in (0, 1) if target != 'low_CI' else se == 0 for estimate, se in estimates.values())
+        enough     = min_samples + batch_size if degenerate else min_samples
+
+        if n >= enough and mc_se <= tol:
+            stop_rule = 'tolerance'
+            break
+        if n >= max_samples:
+            stop_rule = 'max_samples'
+            break
+
+    tests = {test: {col: np.concatenate([batch[test][col] for batch in batches]) for col in values}
+             for test, values in batches[0].items()}
+
+    summary = pd.DataFrame({'baseline_rate': baseline_rate,
+                            'mde':           mde,
+                            'population':    population,
+                            'control_ratio': control_ratio,
+                            'target':        target,
+                            'tol':           tol,
+                            'stop_rule':     stop_rule,
+                            'samples':       n,
+                            'mc_se':         mc_se}, index=[0])
+    for test, (estimate, se) in estimates.items():
+        summary[f'{test} {target}']       = estimate
+        summary[f'{test} {target} mc_se'] = se
+
+    return sim_frame(tests, baseline_rate, mde, population, control_ratio), summary
+
+
+def _sim_adaptive_cell(task):
+
+    # NOTE: the process pool worker for sim_runner_adaptive()
+    cell, seed_seq, stopping = task
+    baseline_rate, mde, population, control_ratio = cell
+
+    return sim_adaptive(baseline_rate = baseline_rate,
+                        mde           = mde,
+                        population    = population,
+                        control_ratio = control_ratio,
+                        rng           = np.random.default_rng(seed_seq),
+                        **stopping)
+
+
+# DEFINE sim_runner_adaptive()
+def sim_runner_adaptive(baseline_rates, mdes, populations, control_ratios, seed = None, max_workers = None, **stopping):
+    # stopping: the sim_adaptive() arguments, e.g. target = 'power', tol = 0.005, max_samples = 5000
+    # returns (sim_results, cell_summary), cell_summary has one row per cell with its stop_rule and samples
+
+    root  = np.random.SeedSequence(seed)
+    cells = grid_cells(baseline_rates, mdes, populations, control_ratios)
+    tasks = [(cell, cell_seed_sequence(root, cell), stopping) for cell in cells]
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+
+    if max_workers == 1:
+        outputs = list(map(_sim_adaptive_cell, tasks))
+    else:
+        with ProcessPoolExecutor(max_workers = max_workers) as executor:
+            outputs = list(executor.map(_sim_adaptive_cell, tasks))
+
+    sim_results  = pd.concat([sim_output for sim_output, _ in outputs], ignore_index=True, axis=0)
+    cell_summary = pd.concat([summary for _, summary in outputs],       ignore_index=True, axis=0)
+
+    return sim_results, cell_summary
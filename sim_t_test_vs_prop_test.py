@@ -44,6 +44,7 @@ import matplotlib
 # from mizani.formatters import percent_format
 import math 
 import pandas as pd 
+from plot_summary import boxplot_jitter_summary
 
 
 def extract_t_test(t_test_results, t_test_CIs): 
@@ -68,6 +69,8 @@ def sim(baseline_rate, mde, population, control_ratio, samples):
                             'mde':           mde, 
                             'population':    population,
                             'control_ratio': control_ratio}, index=[0]) 
+    t_test_results    = []
+    prop_test_results = []
     
     for i in range(1,samples): 
 
@@ -94,15 +97,15 @@ def sim(baseline_rate, mde, population, control_ratio, samples):
         exposed_sample_df = pd.DataFrame(exposed_sample)
         exposed_sample_df = pd.DataFrame(exposed_sample).rename(columns={exposed_sample_df.columns[0]: 'values'}) 
 
-        prop_test = test_proportions_2indep(count1      = int(control_sample_df.query('values == 1').groupby(['values']).size()), 
+        prop_test = test_proportions_2indep(count1      = int(control_sample_df.query('values == 1').groupby(['values']).size().iloc[0]), 
                                             nobs1       = int(len(control_sample_df)),
-                                            count2      = int(exposed_sample_df.query('values == 1').groupby(['values']).size()),
+                                            count2      = int(exposed_sample_df.query('values == 1').groupby(['values']).size().iloc[0]),
                                             nobs2       = int(len(exposed_sample_df)),
                                             alternative = 'larger')
 
-        prop_test_ci = confint_proportions_2indep(count1 = int(control_sample_df.query('values == 1').groupby(['values']).size()), 
+        prop_test_ci = confint_proportions_2indep(count1 = int(control_sample_df.query('values == 1').groupby(['values']).size().iloc[0]), 
                                                   nobs1  = int(len(control_sample_df)),
-                                                  count2 = int(exposed_sample_df.query('values == 1').groupby(['values']).size()),
+                                                  count2 = int(exposed_sample_df.query('values == 1').groupby(['values']).size().iloc[0]),
                                                   nobs2  = int(len(exposed_sample_df)))  
 
         prop_test_output = pd.DataFrame({'test':        ['prop test'],
@@ -112,16 +115,11 @@ def sim(baseline_rate, mde, population, control_ratio, samples):
                                          'high_CI':     float('inf')})   # [prop_test_ci[1]]
         prop_test_output = pd.concat([prop_test_output, params], axis=1)  
 
-        if i == 1: 
-            t_test_results    = t_test_output
-            prop_test_results = prop_test_output
-        else:
-            t_test_output.reset_index(drop=True, inplace=True)
-            t_test_results = pd.concat([t_test_results, t_test_output], ignore_index=True, axis=0)
-            prop_test_results.reset_index(drop=True, inplace=True) 
-            prop_test_results = pd.concat([prop_test_results, prop_test_output], ignore_index=True, axis=0)     
+        # NOTE: collect the per sample rows and concat once after the loop, concat-ing every iteration is quadratic
+        t_test_results.append(t_test_output)
+        prop_test_results.append(prop_test_output)
 
-        output = pd.concat([t_test_results, prop_test_results], ignore_index=True, axis=0) 
+    output = pd.concat(t_test_results + prop_test_results, ignore_index=True, axis=0) 
 
     return output 
 
@@ -140,6 +138,74 @@ results = sim(baseline_rate = baseline_rate,
 
 results
 
+# CHECK sim_fast()
+# NOTE: draws only the success counts and runs both tests in closed form (see sim_engine.py), same columns as sim()
+from sim_engine import sim_fast, sim_runner_fast
+
+results_fast = sim_fast(baseline_rate = baseline_rate,
+                        mde           = mde,
+                        population    = population,
+                        control_ratio = control_ratio,
+                        samples       = 3)
+
+results_fast
+
+# RUN sim_runner_parallel() for long-term  (e.g. new subscribers)
+# NOTE: one process per core, each grid cell gets its own seeded stream so the results do not depend on the worker count
+from sim_engine import sim_runner_parallel
+
+new_subscribers_sim_fast = sim_runner_parallel(baseline_rates = [0.55, 0.60, 0.65],
+                                               mdes           = [0.02, 0.03, 0.04],
+                                               populations    = [175000, 200000, 225000],
+                                               control_ratios = [5.66, 9, 19],
+                                               samples        = 500,
+                                               seed           = 2023)
+new_subscribers_sim_fast.shape
+
+# RUN sim_runner_parallel() into a ResultSink
+# NOTE: each cell is flushed in batches to a Parquet dataset partitioned by the grid parameters, so memory stays bounded
+from result_sink import ResultSink
+
+with ResultSink('sim_results/new_subscribers') as sink: 
+    sim_runner_parallel(baseline_rates = [0.55, 0.60, 0.65],
+                        mdes           = [0.02, 0.03, 0.04],
+                        populations    = [175000, 200000, 225000],
+                        control_ratios = [5.66, 9, 19],
+                        samples        = 500,
+                        seed           = 2023, 
+                        sink           = sink)
+
+sink.read(filters = [('mde', '=', 0.02)]).shape
+
+# RUN sim_runner_parallel() with a CellCache
+# NOTE: finished cells are stored on disk, so a re-run (or a resumed run after a crash) only simulates the missing cells
+from sim_cache import CellCache
+
+cell_cache = CellCache('sim_cache/')
+
+new_subscribers_sim_fast = sim_runner_parallel(baseline_rates = [0.55, 0.60, 0.65],
+                                               mdes           = [0.02, 0.03, 0.04],
+                                               populations    = [175000, 200000, 225000],
+                                               control_ratios = [5.66, 9, 19],
+                                               samples        = 500,
+                                               seed           = 2023,
+                                               cache          = cell_cache)
+print(f"cached cells: {cell_cache.hits}, simulated cells: {cell_cache.misses}")
+
+# RUN sim_runner_adaptive() for short-term  (e.g. existing subs)
+# NOTE: each cell runs batches of 50 replicates and stops once the Monte Carlo standard error of the power is <= 0.5%
+from sim_engine import sim_runner_adaptive
+
+existing_subscribers_sim_adaptive, existing_subscribers_cells = sim_runner_adaptive(baseline_rates = [0.85, 0.90, 0.95],
+                                                                                    mdes           = [0.01, 0.02, 0.03],
+                                                                                    populations    = [2750000, 3000000, 3250000],
+                                                                                    control_ratios = [19, 32.33, 49],
+                                                                                    seed           = 2023,
+                                                                                    target         = 'power',
+                                                                                    tol            = 0.005,
+                                                                                    max_samples    = 5000)
+existing_subscribers_cells.loc[:, ['baseline_rate', 'mde', 'population', 'control_ratio', 'stop_rule', 'samples', 'mc_se']]
+
 # POC sim_runner() for long-term (e.g. new subscribers)
 
 samples        = 50
@@ -170,7 +236,10 @@ for baseline_rate in baseline_rates:
 # sim_results.head(20)
 
 # DEFINE sim_runner()
-def sim_runner(baseline_rate, mde, population, control_ratio, samples): 
+def sim_runner(baseline_rate, mde, population, control_ratio, samples, sink = None): 
+    # sink: an optional ResultSink (result_sink.py) that streams each cell to a partitioned Parquet dataset
+
+    sim_outputs = []
 
     for baseline_rate in baseline_rates: 
         for mde in mdes: 
@@ -183,10 +252,16 @@ def sim_runner(baseline_rate, mde, population, control_ratio, samples):
                                      control_ratio = control_ratio,
                                      samples       = samples) 
 
-                    if 'sim_results' not in locals(): 
-                        sim_results = sim_output
+                    if sink is None: 
+                        sim_outputs.append(sim_output)
                     else: 
-                        sim_results = pd.concat([sim_results, sim_output], ignore_index=True, axis=0) 
+                        sink.append(sim_output) 
+
+    if sink is not None: 
+        sink.flush()
+        return sink
+
+    sim_results = pd.concat(sim_outputs, ignore_index=True, axis=0) 
     
     return sim_results
 
@@ -231,7 +306,13 @@ for var in vars:
 
 
 # DEFINE boxplot_jitter()
-def boxplot_jitter(df, x, y, color):
+def boxplot_jitter(df, x, y, color, max_points = None, facets = None):
+    # max_points: if set, the boxes are precomputed and only max_points jitter points per box are drawn (see plot_summary.py)
+    #             render time then stays flat as the replicates grow
+    # facets:     with max_points, the columns the plot will be faceted by so every panel gets its own boxes
+
+    if max_points is not None: 
+        return boxplot_jitter_summary(df, x, y, color, facets = facets, max_points = max_points)
 
     plt = (pn.ggplot(df) + 
             pn.aes(x = x, y = y, color = color) + 
@@ -262,7 +343,15 @@ control_ratios = [5.66, 9, 19]''') +
 
 
 # PLOT NOTE many CI boxplots
-(test_low_CI_plt + 
+# NOTE: the pre-aggregated path, boxes from per facet stats and 100 jitter points per box
+test_low_CI_facet_plt = boxplot_jitter(df         = new_subscribers_sim, 
+                                       x          = 'test', 
+                                       y          = 'low_CI', 
+                                       color      = "factor(test)",
+                                       max_points = 100,
+                                       facets     = ['baseline_rate', 'mde', 'population', 'control_ratio']) 
+
+(test_low_CI_facet_plt + 
     pn.facet_grid('baseline_rate + mde ~ population + control_ratio', scales='free') +
     pn.labs(title    = "T-test vs Prop-Test Confidence Interval For 500 Simulations \n\n Conditions: One-sided 'larger' and unequal variance",
             subtitle = 'By baseline_rate + mde ~ population + control_ratio', 
@@ -304,7 +393,7 @@ def five_num_sum_by_group(df, by, metric):
                 max     = (metric, 'max'),
             ).reset_index() 
             .assign(metric = metric)
-            # .iloc[:,[0,10,1,2,3,4,5,6,7,8,9]]
+            .loc[:, list(by) + ['metric', 'count', 'mean', 'std', 'min', 'q1', 'median', 'q3', 'max']]   # NOTE: by name, so any number of by columns works
             ) 
 
     return df
@@ -312,11 +401,27 @@ def five_num_sum_by_group(df, by, metric):
 
 vars = ['test', 'baseline_rate'] # 'mde', 'population', 'control_ratio'
 new_subs_sim_test_basel_five_num_sum = five_num_sum_by_group(new_subscribers_sim, vars, 'low_CI') 
-new_subs_sim_test_basel_five_num_sum = new_subs_sim_test_basel_five_num_sum.iloc[:,[0,1,10,2,3,4,5,6,7,8,9]] 
 
 print('Only sharing high level summary stats to limit the rows')
 new_subs_sim_test_basel_five_num_sum
 
+# NOTE: the same summary streamed while the simulation runs, without keeping every replicate (see five_num_summary.py)
+from five_num_summary import StreamingSummary
+
+low_CI_summary = sim_runner_parallel(baseline_rates = [0.55, 0.60, 0.65],
+                                     mdes           = [0.02, 0.03, 0.04],
+                                     populations    = [175000, 200000, 225000],
+                                     control_ratios = [5.66, 9, 19],
+                                     samples        = 500,
+                                     seed           = 2023,
+                                     sink           = StreamingSummary(vars, 'low_CI'))
+low_CI_summary.result()
+
+# NOTE: the exact summary of several metrics in one vectorized pass, no Python call per group (see five_num_summary.py)
+from five_num_summary import five_num_sum_fast
+
+five_num_sum_fast(new_subscribers_sim, ['test', 'baseline_rate', 'mde', 'population', 'control_ratio'], ['low_CI', 'pvalue'])
+
 # PLOT NOTE p-value high level 
 new_subscribers_sim["pvalue_log"] = log(new_subscribers_sim["pvalue"]) 
 
@@ -353,7 +458,6 @@ control_ratios = [5.66, 9, 19]''') +
 
 vars = ['test', 'baseline_rate'] # 'mde', 'population', 'control_ratio'
 new_subs_sim_test_basel_five_num_sum = five_num_sum_by_group(new_subscribers_sim, vars, 'pvalue') 
-new_subs_sim_test_basel_five_num_sum = new_subs_sim_test_basel_five_num_sum.iloc[:,[0,1,10,2,3,4,5,6,7,8,9]] 
 
 print('Note: the p-values skew extremely small') 
 print('Only sharing high level summary stats to limit the rows')
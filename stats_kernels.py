@@ -0,0 +1,136 @@
+# **Overview**
+# * Closed-form versions of the statsmodels tests used across this repo, written over whole numpy arrays
+#   * `welch_ttest()` matches `CompareMeans(...).ttest_ind(usevar = 'unequal')` and `.tconfint_diff(usevar = 'unequal')`
+#   * `prop_ztest()` matches `test_proportions_2indep()` with its default 'agresti-caffo' method for compare = 'diff'
+#   * `prop_confint_newcomb()` matches `confint_proportions_2indep()` with its default 'newcomb' (Wilson score) method
+# * Every argument can be a scalar or an array, so one call covers every replicate / month / grid cell at once
+# * The inputs are sufficient statistics (n, mean, variance or count, nobs) instead of user level samples
+
+
+import numpy as np
+from scipy import stats
+
+
+def _pvalue(statistic, dist, alternative):
+
+    # NOTE: a helper function to turn a test statistic into a p-value for the alternatives statsmodels uses
+    # dist is a frozen scipy distribution (or a module level one like stats.norm) with sf / cdf
+    if alternative in ('two-sided', '2-sided', '2s'):
+        return 2 * dist.sf(np.abs(statistic))
+    elif alternative in ('larger', 'l'):
+        return dist.sf(statistic)
+    elif alternative in ('smaller', 's'):
+        return dist.cdf(statistic)
+    else:
+        raise ValueError("alternative must be 'two-sided', 'larger' or 'smaller'")
+
+
+def bernoulli_stats(count, nobs):
+
+    # NOTE: a helper function to get the mean and ddof=0 variance of a 0/1 sample from its success count
+    # this is what DescrStatsW holds for a binary sample, so no user level array is needed
+    count = np.asarray(count, dtype = float)
+    nobs  = np.asarray(nobs,  dtype = float)
+    mean  = count / nobs
+    var   = mean * (1 - mean)
+
+    return mean, var
+
+
+def welch_ttest(nobs1, mean1, var1, nobs2, mean2, var2, alternative = 'two-sided', alpha = 0.05, value = 0):
+
+    # NOTE: Welch ttest with Satterthwait degrees of freedom for mean1 - mean2
+    # var1 and var2 are the ddof=0 variances (DescrStatsW.var), the same as statsmodels uses internally
+    # returns a dict of arrays: statistic, pvalue, df, diff, std_diff, low_CI, high_CI
+    nobs1 = np.asarray(nobs1, dtype = float)
+    nobs2 = np.asarray(nobs2, dtype = float)
+
+    sem1     = np.asarray(var1, dtype = float) / (nobs1 - 1)
+    sem2     = np.asarray(var2, dtype = float) / (nobs2 - 1)
+    semsum   = sem1 + sem2
+    std_diff = np.sqrt(semsum)
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        dof = 1.0 / ((sem1 / semsum) ** 2 / (nobs1 - 1) + (sem2 / semsum) ** 2 / (nobs2 - 1))
+
+        diff      = np.asarray(mean1, dtype = float) - np.asarray(mean2, dtype = float)
+        statistic = (diff - value) / std_diff
+
+    t_dist = stats.t(dof)
+    pvalue = _pvalue(statistic, t_dist, alternative)
+
+    if alternative in ('two-sided', '2-sided', '2s'):
+        tcrit   = t_dist.ppf(1 - alpha / 2.0)
+        low_CI  = diff - tcrit * std_diff
+        high_CI = diff + tcrit * std_diff
+    elif alternative in ('larger', 'l'):
+        tcrit   = t_dist.ppf(1 - alpha)
+        low_CI  = diff - tcrit * std_diff
+        high_CI = np.full_like(low_CI, np.inf)
+    else:
+        tcrit   = t_dist.ppf(1 - alpha)
+        high_CI = diff + tcrit * std_diff
+        low_CI  = np.full_like(high_CI, -np.inf)
+
+    return {'statistic': statistic,
+            'pvalue':    pvalue,
+            'df':        dof,
+            'diff':      diff,
+            'std_diff':  std_diff,
+            'low_CI':    low_CI,
+            'high_CI':   high_CI}
+
+
+def prop_ztest(count1, nobs1, count2, nobs2, alternative = 'two-sided', value = 0):
+
+    # NOTE: two proportions z-test for p1 - p2 using the 'agresti-caffo' adjustment (add one success and one failure)
+    # this is the default method of test_proportions_2indep for compare = 'diff'
+    # returns a dict of arrays: statistic, pvalue, diff
+    count1 = np.asarray(count1, dtype = float) + 1
+    count2 = np.asarray(count2, dtype = float) + 1
+    nobs1  = np.asarray(nobs1,  dtype = float) + 2
+    nobs2  = np.asarray(nobs2,  dtype = float) + 2
+
+    p1 = count1 / nobs1
+    p2 = count2 / nobs2
+
+    diff      = p1 - p2 - value
+    statistic = diff / np.sqrt(p1 * (1 - p1) / nobs1 + p2 * (1 - p2) / nobs2)
+    pvalue    = _pvalue(statistic, stats.norm, alternative)
+
+    return {'statistic': statistic,
+            'pvalue':    pvalue,
+            'diff':      diff}
+
+
+def wilson_confint(count, nobs, alpha = 0.05):
+
+    # NOTE: two-sided Wilson score interval, the same as proportion_confint(method = 'wilson')
+    count = np.asarray(count, dtype = float)
+    nobs  = np.asarray(nobs,  dtype = float)
+
+    q_     = count / nobs
+    crit   = stats.norm.isf(alpha / 2.0)
+    crit2  = crit ** 2
+    denom  = 1 + crit2 / nobs
+    center = (q_ + crit2 / (2 * nobs)) / denom
+    dist   = crit * np.sqrt(q_ * (1.0 - q_) / nobs + crit2 / (4.0 * nobs ** 2)) / denom
+
+    return np.clip(center - dist, 0, 1), np.clip(center + dist, 0, 1)
+
+
+def prop_confint_newcomb(count1, nobs1, count2, nobs2, alpha = 0.05):
+
+    # NOTE: Newcombe hybrid score interval for p1 - p2, built from the two Wilson intervals
+    # this is the default method of confint_proportions_2indep for compare = 'diff'
+    p1 = np.asarray(count1, dtype = float) / np.asarray(nobs1, dtype = float)
+    p2 = np.asarray(count2, dtype = float) / np.asarray(nobs2, dtype = float)
+
+    low1, upp1 = wilson_confint(count1, nobs1, alpha = alpha)
+    low2, upp2 = wilson_confint(count2, nobs2, alpha = alpha)
+
+    diff = p1 - p2
+    low  = diff - np.sqrt((p1 - low1) ** 2 + (upp2 - p2) ** 2)
+    upp  = diff + np.sqrt((p2 - low2) ** 2 + (upp1 - p1) ** 2)
+
+    return low, upp
@@ -0,0 +1,112 @@
+# **Overview**
+# * Summary statistics input for `t_test()` (t_test_or_anova_multi.py) and `prop_test()` (prop_test_multi.py)
+#   * `t_test()` pulls whole columns into Python lists and wraps them in DescrStatsW, `prop_test()` takes one aggregated row per group
+#   * here both tests take per-group sufficient statistics instead, so the aggregation can happen anywhere, e.g. in SQL
+#     * t-test:    n, sum, sumsq per group, i.e. COUNT(x), SUM(x), SUM(x * x)
+#     * prop test: count, nobs per group, i.e. SUM(retained_count), SUM(cohort_count)
+# * `summary_stats()` builds those columns from a DataFrame with one vectorized groupby
+# * Every other column of the stats frame is a key, so one call tests every month / segment at once
+#   * e.g. stats by ['lifetime_month', 'group_var'] gives one result row per lifetime_month
+# * The results are the same as `t_test()` / `prop_test()` (Welch ttest, agresti-caffo z-test with a Newcombe CI), see stats_kernels.py
+
+
+import numpy as np
+import pandas as pd
+
+from retention_schema import is_yes
+from stats_kernels import prop_confint_newcomb, prop_ztest, welch_ttest
+
+
+T_TEST_STATS    = ['n', 'sum', 'sumsq']
+PROP_TEST_STATS = ['count', 'nobs']
+
+
+# DEFINE summary_stats()
+def summary_stats(df, by, metric = None, count = None, nobs = None):
+    # by:     the group columns, include the group_var column, e.g. ['lifetime_month', 'group_var']
+    # metric: a numeric user level column, gives n / sum / sumsq for t_test_summary()
+    # count:  a success count column, and nobs: a trials column (e.g. 'retained_count', 'cohort_count'), give count / nobs for prop_test_summary()
+
+    aggs = {}
+    if metric is not None:
+        df   = df.assign(_sumsq = lambda x: x[metric].astype(float) ** 2)
+        aggs = {'n': (metric, 'count'), 'sum': (metric, 'sum'), 'sumsq': ('_sumsq', 'sum')}
+    if count is not None:
+        aggs.update({'count': (count, 'sum'), 'nobs': (nobs, 'sum')})
+    if not aggs:
+        raise ValueError("summary_stats() needs a metric, or a count and nobs column")
+
+    return (df
+             .groupby(by, observed = True)
+             .agg(**aggs)
+             .reset_index())
+
+
+def _split_groups(df_stats, group_var, stat_cols):
+
+    # NOTE: a helper function to line up the exposed ('No') and control ('Yes') rows of each key
+    # returns the key columns and two frames of stats with one row per key
+    keys     = [col for col in df_stats.columns if col not in [group_var] + stat_cols]
+    df_stats = df_stats.assign(**{group_var: np.where(is_yes(df_stats[group_var]), 'Yes', 'No')})   # NOTE: bool flags from retention_schema.py too
+
+    if keys:
+        wide = df_stats.pivot_table(index = keys, columns = group_var, values = stat_cols, aggfunc = 'sum', observed = True)
+        wide = wide.dropna()     # NOTE: a key needs both groups to be tested
+        return wide.index.to_frame(index = False), wide.xs('No', axis = 1, level = 1), wide.xs('Yes', axis = 1, level = 1)
+
+    wide = df_stats.groupby(group_var, observed = True)[stat_cols].sum()
+    return pd.DataFrame(index = [0]), wide.loc[['No']].reset_index(drop = True), wide.loc[['Yes']].reset_index(drop = True)
+
+
+def _results(keys, month, test, columns):
+
+    output = keys.copy()
+    if month is not None:
+        output.insert(0, 'month', month)
+    output['test'] = test
+
+    return output.assign(**columns).reset_index(drop = True)
+
+
+# DEFINE t_test_summary()
+def t_test_summary(df_stats, month = None, group_var = 'group_var', alternative = 'two-sided', alpha = 0.05):
+    # df_stats: columns group_var, n, sum, sumsq (e.g. from summary_stats(df, ['group_var'], metric = 'is_retained')), any other columns are keys
+    # month:    just for adding a data label, like t_test()
+    # the same columns as t_test(): month, test, t statistic, pvalue, CI Lower, CI Upper
+
+    keys, exposed, control = _split_groups(df_stats, group_var, T_TEST_STATS)
+
+    n_exp, n_con = exposed['n'].to_numpy(dtype = float), control['n'].to_numpy(dtype = float)
+    mean_exp     = exposed['sum'].to_numpy(dtype = float) / n_exp
+    mean_con     = control['sum'].to_numpy(dtype = float) / n_con
+
+    # NOTE: ddof=0 variances from the sums of squares, the ones DescrStatsW keeps
+    var_exp = np.maximum(exposed['sumsq'].to_numpy(dtype = float) / n_exp - mean_exp ** 2, 0)
+    var_con = np.maximum(control['sumsq'].to_numpy(dtype = float) / n_con - mean_con ** 2, 0)
+
+    t_test = welch_ttest(n_exp, mean_exp, var_exp, n_con, mean_con, var_con, alternative = alternative, alpha = alpha)
+
+    return _results(keys, month, 't test', {'t statistic': t_test['statistic'],
+                                            'pvalue':      t_test['pvalue'],
+                                            'CI Lower':    t_test['low_CI'],
+                                            'CI Upper':    t_test['high_CI']})
+
+
+# DEFINE prop_test_summary()
+def prop_test_summary(df_stats, month = None, group_var = 'group_var', alternative = 'two-sided', alpha = 0.05):
+    # df_stats: columns group_var, count, nobs (e.g. from summary_stats(df, ['lifetime_month', 'group_var'], count = 'retained_count', nobs = 'cohort_count'))
+    # month:    just for adding a data label, like prop_test()
+    # the same columns as prop_test(): month, test, statistic, pvalue, CI Lower, CI Upper
+
+    keys, exposed, control = _split_groups(df_stats, group_var, PROP_TEST_STATS)
+
+    count1, nobs1 = exposed['count'].to_numpy(dtype = float), exposed['nobs'].to_numpy(dtype = float)
+    count2, nobs2 = control['count'].to_numpy(dtype = float), control['nobs'].to_numpy(dtype = float)
+
+    prop_test       = prop_ztest(count1, nobs1, count2, nobs2, alternative = alternative)
+    ci_low, ci_high = prop_confint_newcomb(count1, nobs1, count2, nobs2, alpha = alpha)
+
+    return _results(keys, month, 'prop test', {'statistic': prop_test['statistic'],
+                                               'pvalue':    prop_test['pvalue'],
+                                               'CI Lower':  ci_low,
+                                               'CI Upper':  ci_high})
@@ -1,6 +1,11 @@
 
+import numpy as np
+import pandas as pd
 from statsmodels.stats.weightstats import CompareMeans, DescrStatsW  
 
+from poisson_bootstrap import bootstrap_test
+from retention_schema import is_yes
+
 
 def extract_t_test(t_test_results, t_test_CIs): 
 
@@ -16,14 +21,15 @@ def extract_t_test(t_test_results, t_test_CIs):
 def t_test(df, month, metric): 
     # NOTE month is just for adding a data labels 
 
+    # NOTE: group_var can be 'Yes' / 'No' strings or the bool flag of load_retention()
+    control_mask = is_yes(df['group_var'])
+
     control = (df
-                .query("group_var == 'Yes'")
-                .loc[:, metric] 
-                .to_list()) 
+                .loc[control_mask, metric] 
+                .to_numpy()) 
     exposed = (df
-                .query("group_var == 'No'")
-                .loc[:, metric] 
-                .to_list()) 
+                .loc[~control_mask, metric] 
+                .to_numpy()) 
 
     cm         = CompareMeans(DescrStatsW(exposed), DescrStatsW(control))
     t_test     = cm.ttest_ind(usevar = 'unequal')     # NOTE: If unequal, then Welch ttest is used.   alternative = 'larger',
@@ -38,46 +44,57 @@ def t_test(df, month, metric):
     return t_test_output
 
 
+# NOTE: the metric registry report_metric() draws from
+# each entry has the named aggregations it needs (passed to one groupby().agg()) and the columns derived from them
+# metrics that are not registered but are columns of df get count / mean / std, see engagement_metric()
+METRICS = {'retention_rate': {'aggs':   {'total_count':   ('user_id', 'count'),
+                                         'churned_count': ('is_retained', 'sum')},   # NOTE: is_retained is 0 / 1, so the sum counts the retained users
+                              'derive': lambda x: {'retention_rate': ((x['churned_count'] / x['total_count']) * 100).round(3)}}}
+
+
+def register_metric(name, aggs, derive = None):
+    # aggs:   named aggregations, e.g. {'total_count': ('user_id', 'count')}
+    # derive: a function of the aggregated frame returning a dict of new columns, e.g. rates from counts
+
+    METRICS[name] = {'aggs': aggs, 'derive': derive}
+
+
+def engagement_metric(metric):
+
+    # NOTE: count / mean / std of a user level column, the commented out engagement branch of report_metric()
+    return {'aggs': {f'{metric}_count': (metric, 'count'),
+                     f'{metric}_mean':  (metric, 'mean'),
+                     f'{metric}_std':   (metric, 'std')},
+            'derive': None}
+
+
 def report_metric(df, stat, groups): 
+    # stat:   a registered metric name, a user level column (engagement metric) or a list of those
+    # groups: the columns to report by, next to lifetime_month_ref
+
+    stats   = [stat] if isinstance(stat, str) else list(stat)
+    groupby = ['lifetime_month_ref'] + groups     # lifetime_month_ref
+
+    specs = [METRICS[name] if name in METRICS else engagement_metric(name) for name in stats]
+    aggs  = {col: agg for spec in specs for col, agg in spec['aggs'].items()}
+
+    # NOTE: one grouped pass for every metric, groups with no retained users are kept (churned_count = 0)
+    df_agg_output = (df
+                      .groupby(groupby, observed = True)
+                      .agg(**aggs)
+                      .reset_index())
+
+    for spec in specs:
+        if spec['derive'] is not None:
+            df_agg_output = df_agg_output.assign(**spec['derive'](df_agg_output))
 
-    if stat == "retention_rate": 
-
-        groupby = ['lifetime_month_ref'] + groups     # lifetime_month_ref
-        
-        df_base = (df
-                    .groupby(groupby)
-                    .agg(total_count = ('user_id', 'count'))  
-                    .reset_index()) 
-
-        df_retained = (df
-                        .query('is_retained == 1') 
-                        .groupby(groupby)
-                        .agg(churned_count = ('user_id', 'count')))  
-
-        df_agg_output = (pd.merge(df_base,
-                                  df_retained, 
-                                  on = groupby)
-                            .assign(retention_rate = lambda x: ((x['churned_count'] / x['total_count']) * 100).round(3)))    
-    
-    # elif stat IN ('list of engagement metrics'):  
-    #     df_base = (df
-    #                 .query("is_base_population == 'Yes'") 
-    #                 .groupby(['lifetime_month_ref', 'group_var'])
-    #                 .agg(total_user_id_count  = ('user_id', 'count'), 
-    #                      mean                 = (metric, 'mean'),
-    #                      std                  = (metric, 'std'))
-    #                 .reset_index())  
-
-    #     df_base
-    #     df_agg_output 
-        
     return df_agg_output
 
 
 # DEFINE test_runner() 
 
 def test_runner(df_n, test, metric, period, groups): 
-    # test:   't-test', 'anova' 
+    # test:   't-test', 'anova', 'bootstrap' (Poisson bootstrap CIs for heavy-tailed metrics, see poisson_bootstrap.py)
     # metric: 'is_retained'           # NOTE can update to engagement metrics 
     # period: 'prior', 'cumulative'     
     # groups: a list with any single value or combination of values: 'group_var', tier_type' & 'payment_provider' 
@@ -94,21 +111,25 @@ def test_runner(df_n, test, metric, period, groups):
     for lifetime_month in lifetime_months: 
         df = df_n
         df['lifetime_month_ref'] = lifetime_month
-        df['is_retained']        = df['lifetime_month'].apply(lambda x: 1 if x > lifetime_month else 0) 
+        df['is_retained']        = (df['lifetime_month'] > lifetime_month).astype('int8') 
 
         if period == 'prior':
-            df['is_eligible_population'] = np.where((df['lifetime_month'] >= (lifetime_month - 1))  
-                                                    & (df['potential_lifetime_month'] >= lifetime_month), 'Yes','No') 
+            df['is_eligible_population'] = ((df['lifetime_month'] >= (lifetime_month - 1))  
+                                            & (df['potential_lifetime_month'] >= lifetime_month)) 
 
         elif period == 'cumulative':
-            df['is_eligible_population'] = df['potential_lifetime_month'].apply(lambda x: 'Yes' if x >= lifetime_month else 'No') 
+            df['is_eligible_population'] = df['potential_lifetime_month'] >= lifetime_month 
 
-        df = df.query("is_eligible_population == 'Yes'") 
+        df = df.loc[df['is_eligible_population']] 
 
         if test == 't-test': 
             test_output             = t_test(df, lifetime_month, metric) 
             test_output['stat_sig'] = test_output['pvalue'].apply(lambda x: 'Yes' if x <= 0.05 else 'No') 
 
+        elif test == 'bootstrap': 
+            test_output             = bootstrap_test(df, lifetime_month, metric) 
+            test_output['stat_sig'] = test_output['pvalue'].apply(lambda x: 'Yes' if x <= 0.05 else 'No') 
+
         elif test == 'anova': 
             test_output = df.anova(dv      = 'is_retained', 
                                    between = groups).round(2)   
@@ -1,3 +1,9 @@
+# NOTE: optional, the compact schema (bool flags, int16 months, categorical groups) cuts memory several-fold
+# every test_runner*() function accepts it as well as the 'Yes' / 'No' strings
+from retention_schema import load_retention
+
+new_subs_user_level = load_retention(new_subs_user_level)
+
 
 t_test_results, t_test_agg_results = test_runner(new_subs_user_level,              # new_subs_user_level, df_2023_06
                                                  test   = 't-test',       
@@ -10,6 +16,16 @@ pd.set_option('display.max_rows', None)
 t_test_results 
 
 
+# NOTE: the same results from one pass over the users, see retention_engine.py (much faster on large frames)
+from retention_engine import test_runner_fast
+
+t_test_results, t_test_agg_results = test_runner_fast(new_subs_user_level,
+                                                      test   = 't-test',
+                                                      metric = 'is_retained',
+                                                      period = 'cumulative',
+                                                      groups = ['is_longterm'])
+
+
 
 pd.options.display.float_format = '{:.2f}'.format 
 t_test_agg_results.sort_values(by =  ['lifetime_month', 'is_group_member'], ascending = True) 
@@ -61,6 +77,14 @@ pd.set_option('display.max_rows', None)
 anova_tier_type_test_results 
 
 
+# NOTE: every month in one batched pass, one tidy table with a row per month and Source (see retention_engine.py)
+anova_tier_type_test_results, anova_tier_type_df_agg_results = test_runner_fast(new_subs_user_level,
+                                                                                 test   = 'anova',
+                                                                                 metric = 'is_retained',
+                                                                                 period = 'cumulative',
+                                                                                 groups = ['is_group_member', 'tier_type', 'payment_provider'])
+
+
 (col_plot(anova_tier_type_df_agg_results, 'factor(lifetime_month)', 'retention_rate', 'is_group_member', 
           text = 'retention_rate', 
           percent = 'retention_rate', 
@@ -99,3 +123,66 @@ labs(title="Cumulative Retention by Long Term  Status Lifetime Month",
      subtitle='By Tier Type',
      x = 'Lifetime Month')) 
 
+
+
+# NOTE: the tests from pre-aggregated summary statistics, see summary_tests.py
+# the stats frame can come from SQL instead: COUNT(x) AS n, SUM(x) AS sum, SUM(x * x) AS sumsq ... GROUP BY lifetime_month, group_var
+from summary_tests import summary_stats, t_test_summary, prop_test_summary
+
+engagement_stats   = summary_stats(new_subs_user_level, ['lifetime_month', 'group_var'], metric = 'is_retained')
+engagement_results = t_test_summary(engagement_stats)
+
+cohort_stats   = summary_stats(new_subs_cohort_level, ['lifetime_month', 'group_var'], count = 'retained_count', nobs = 'cohort_count')
+cohort_results = prop_test_summary(cohort_stats)
+
+
+# NOTE: several metrics from one grouped pass, engagement columns get count / mean / std unless registered
+register_metric('streaming_hours_per_user',
+                aggs   = {'streaming_users': ('user_id', 'count'),
+                          'streaming_hours': ('streaming_hours', 'sum')},
+                derive = lambda x: {'streaming_hours_per_user': x['streaming_hours'] / x['streaming_users']})
+
+df_month = new_subs_user_level.assign(lifetime_month_ref = 3, is_retained = lambda x: (x['lifetime_month'] > 3).astype(int))
+report_metric(df_month, ['retention_rate', 'streaming_hours_per_user', 'sessions'], ['group_var', 'tier_type'])
+
+
+# NOTE: cohorts too big for memory, streamed from Parquet a row group at a time (same outputs as test_runner())
+from retention_engine import test_runner_chunked
+
+t_test_results, t_test_agg_results = test_runner_chunked('new_subs_user_level.parquet',
+                                                         test   = 't-test',
+                                                         metric = 'is_retained',
+                                                         period = 'cumulative',
+                                                         groups = ['group_var'])
+
+
+# NOTE: daily refresh from persisted aggregates, only the new / changed users are read (see retention_store.py)
+from retention_store import RetentionStore
+
+store = RetentionStore('retention_store/', groups = ['group_var', 'tier_type'])
+store.update(new_and_changed_users, old_rows = previous_rows_of_changed_users)
+
+t_test_results, t_test_agg_results = store.results('t-test', 'cumulative')
+
+
+# NOTE: every test x period x grouping combination on a process pool, one tagged table (see retention_batch.py)
+from retention_batch import spec_grid, test_runner_batch
+
+batch_test_results, batch_agg_results = test_runner_batch(new_subs_user_level, spec_grid(groups = ('group_var', 'tier_type', 'payment_provider')))
+batch_test_results.query("spec_test == 'anova' and spec_period == 'cumulative'")
+
+
+# NOTE: sequential monitoring while retention events arrive, anytime-valid so it can be checked at every publish (see sequential_monitor.py)
+import asyncio
+from sequential_monitor import SequentialMonitor, tail_events
+
+monitor = SequentialMonitor(method = 'msprt', tau = 0.05, every = 10_000, publish = print)
+monitor_results = asyncio.run(monitor.run(tail_events('retention_events.jsonl', idle_timeout = 60)))    # in a notebook's running loop: await monitor.run(...)
+
+
+# NOTE: Poisson bootstrap CIs instead of Welch for a heavy-tailed engagement metric (see poisson_bootstrap.py)
+bootstrap_results, bootstrap_agg_results = test_runner(new_subs_user_level,
+                                                       test   = 'bootstrap',
+                                                       metric = 'streaming_hours',
+                                                       period = 'cumulative',
+                                                       groups = ['group_var'])
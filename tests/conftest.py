@@ -0,0 +1,18 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# NOTE: the modules live at the repository root, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark import make_retention_frame
+
+
+@pytest.fixture(scope = 'session')
+def df_n():
+
+    # NOTE: a small user level retention frame with a lognormal engagement metric next to is_retained
+    df = make_retention_frame(20_000, n_months = 8)
+    return df.assign(engagement = np.random.default_rng(1).lognormal(size = len(df)))
@@ -0,0 +1,15 @@
+import numpy as np
+
+
+def assert_same(actual, expected, rtol = 1e-9):
+
+    # NOTE: same columns and rows, numbers to rtol, everything else as strings
+    actual, expected = actual.reset_index(drop = True), expected.reset_index(drop = True)
+    assert list(actual.columns) == list(expected.columns)
+    assert actual.shape == expected.shape
+
+    numeric = expected.select_dtypes('number').columns
+    np.testing.assert_allclose(actual[numeric].to_numpy(dtype = float), expected[numeric].to_numpy(dtype = float), rtol = rtol, equal_nan = True)
+
+    other = [col for col in expected.columns if col not in numeric]
+    assert (actual[other].astype(str).to_numpy() == expected[other].astype(str).to_numpy()).all()
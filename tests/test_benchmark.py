@@ -0,0 +1,40 @@
+# **Overview**
+# * Smoke tests for benchmark.py: the inputs are deterministic, every benchmark loads, and run / compare round trip
+
+
+import json
+
+import pandas as pd
+import pytest
+
+import benchmark
+
+
+def test_data_generators_are_deterministic():
+
+    pd.testing.assert_frame_equal(benchmark.make_retention_frame(1_000), benchmark.make_retention_frame(1_000))
+    pd.testing.assert_frame_equal(benchmark.make_cohort_frame(1_000),    benchmark.make_cohort_frame(1_000))
+    pd.testing.assert_frame_equal(benchmark.make_sim_frame(1_000),       benchmark.make_sim_frame(1_000))
+
+
+@pytest.mark.parametrize('name', list(benchmark.BENCHMARKS))
+def test_every_benchmark_loads(name):
+
+    # NOTE: run_benchmarks() records a failing loader instead of raising, so a broken one would only show up in the JSON
+    _, _, loader = benchmark.BENCHMARKS[name]
+    assert callable(loader())
+
+
+def test_run_and_compare(tmp_path):
+
+    before, after = tmp_path / 'before.json', tmp_path / 'after.json'
+    for path in (before, after):
+        benchmark.main(['run', '--only', 'five_num_sum_fast', 'prop_test_runner_fast', '--sizes', '1e5', '--repeats', '1', '-o', str(path)])
+
+    with open(before) as f:
+        results = json.load(f)['results']
+    assert [(r['name'], r['status']) for r in results] == [('prop_test_runner_fast', 'ok'), ('five_num_sum_fast', 'ok')]
+
+    ratios = benchmark.compare(str(before), str(after))
+    assert len(ratios) == 2
+    assert (ratios['time_ratio'] > 0).all() and (ratios['memory_ratio'] > 0).all()
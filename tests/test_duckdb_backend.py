@@ -0,0 +1,60 @@
+# **Overview**
+# * Checks the DuckDB backend against the in-memory engines it mirrors, skipped without duckdb
+# * duckdb_backend is imported as a module, pytest would collect its test_runner_duckdb() otherwise
+
+
+import numpy as np
+import pytest
+
+pytest.importorskip('duckdb')
+
+from benchmark import make_cohort_frame
+import duckdb_backend
+from helpers import assert_same
+from prop_test_multi import prop_test_runner_fast
+import retention_engine
+
+
+@pytest.mark.parametrize('test', ['t-test', 'anova'])
+@pytest.mark.parametrize('period', ['prior', 'cumulative'])
+@pytest.mark.parametrize('groups', [['tier_type'], ['group_var', 'tier_type']])
+def test_duckdb_matches_fast(df_n, test, period, groups):
+
+    expected = retention_engine.test_runner_fast(df_n, test, 'engagement', period, groups)
+    actual   = duckdb_backend.test_runner_duckdb(duckdb_backend.duckdb_connect(df_n), test, 'engagement', period, groups)
+
+    assert_same(actual[0], expected[0])
+    assert_same(actual[1], expected[1])
+
+
+def test_duckdb_reads_parquet(df_n, tmp_path):
+
+    df_n.to_parquet(tmp_path / 'users.parquet')
+
+    expected = retention_engine.test_runner_fast(df_n, 't-test', 'is_retained', 'cumulative', ['group_var'])
+    actual   = duckdb_backend.test_runner_duckdb(duckdb_backend.duckdb_connect(tmp_path / 'users.parquet'), 't-test', 'is_retained', 'cumulative', ['group_var'])
+
+    assert_same(actual[0], expected[0])
+    assert_same(actual[1], expected[1])
+
+
+def cohorts():
+
+    # NOTE: a caller's own group column name, and month 5 only has exposed cohorts
+    df = make_cohort_frame(3_000, n_months = 8).rename(columns = {'group_var': 'is_control'})
+    df = df.loc[~((df['lifetime_month'] == 5) & (df['is_control'] == 'Yes'))]
+
+    return df.sort_values('lifetime_month', kind = 'stable')
+
+
+def test_prop_test_runner_duckdb_matches_fast():
+
+    df = cohorts()
+
+    expected = prop_test_runner_fast(df, 'is_control')
+    actual   = duckdb_backend.prop_test_runner_duckdb(duckdb_backend.duckdb_connect(df), 'is_control')
+
+    assert_same(actual[0], expected[0])
+    assert_same(actual[1], expected[1])
+    assert 'is_control' in actual[1].columns
+    assert np.isnan(actual[0].loc[actual[0]['month'] == 5, 'pvalue']).all()
@@ -0,0 +1,83 @@
+# **Overview**
+# * Checks five_num_sum_fast() and StreamingSummary (batches, merged across workers) against the exact five_num_sum_by_group()
+
+
+import numpy as np
+import pytest
+
+from benchmark import load_functions, make_sim_frame
+from five_num_summary import KLLSketch, StreamingSummary, five_num_sum_fast
+from helpers import assert_same
+
+
+BY = ['test', 'baseline_rate', 'mde', 'population', 'control_ratio']
+
+
+@pytest.fixture(scope = 'module')
+def five_num_sum_by_group():
+
+    return load_functions('sim_t_test_vs_prop_test.py', ['five_num_sum_by_group'])['five_num_sum_by_group']
+
+
+def streaming(df, k, workers = 3, batch_rows = 1_000):
+
+    # NOTE: each worker summarises its own batches, the worker summaries are merged at the end
+    summaries = [StreamingSummary(BY, 'low_CI', k = k) for _ in range(workers)]
+    for i, start in enumerate(range(0, len(df), batch_rows)):
+        summaries[i % workers].update(df.iloc[start:start + batch_rows])
+
+    for other in summaries[1:]:
+        summaries[0].merge(other)
+
+    return summaries[0].result()
+
+
+def test_streaming_summary_is_exact_while_groups_fit_the_sketch(five_num_sum_by_group):
+
+    # NOTE: 54 groups of about 90 rows, every sketch stays below k
+    df = make_sim_frame(5_000)
+
+    assert_same(streaming(df, k = 200), five_num_sum_by_group(df, BY, 'low_CI'), rtol = 1e-9)
+
+
+def test_streaming_summary_quantiles_within_rank_error(five_num_sum_by_group):
+
+    df       = make_sim_frame(200_000)
+    actual   = streaming(df, k = 200, batch_rows = 7_000)
+    expected = five_num_sum_by_group(df, BY, 'low_CI')
+
+    exact_cols = ['count', 'mean', 'std', 'min', 'max']
+    np.testing.assert_allclose(actual[exact_cols].to_numpy(float), expected[exact_cols].to_numpy(float), rtol = 1e-9)
+
+    # NOTE: the rank of each approximate quantile within its group, about 2 / k rank error
+    for (_, row), (_, values) in zip(actual.iterrows(), df.groupby(BY)['low_CI']):
+        values = np.sort(values.to_numpy())
+        for q, col in [(0.25, 'q1'), (0.5, 'median'), (0.75, 'q3')]:
+            rank = np.searchsorted(values, row[col], side = 'right') / len(values)
+            assert abs(rank - q) <= 0.03
+
+
+def test_kll_sketch_skips_nan_and_handles_empty():
+
+    sketch = KLLSketch()
+    assert np.isnan(sketch.quantile(0.5))
+
+    sketch.update([1.0, np.nan, 3.0])
+    assert sketch.n == 2
+    assert sketch.quantile(0.5) == 2.0
+
+
+@pytest.mark.parametrize('metric', ['low_CI', 'pvalue'])
+def test_five_num_sum_fast_matches(five_num_sum_by_group, metric):
+
+    df = make_sim_frame(30_000)
+    df.loc[::97, metric] = np.nan
+
+    assert_same(five_num_sum_fast(df, BY, metric), five_num_sum_by_group(df, BY, metric))
+
+
+def test_five_num_sum_fast_all_missing_key():
+
+    df = make_sim_frame(1_000).assign(population = np.nan)
+
+    assert five_num_sum_fast(df, BY, 'low_CI').empty
@@ -0,0 +1,67 @@
+# **Overview**
+# * key_codes() vs groupby(keys, sort = True, observed = True).ngroup(), on the mixed radix path, the sorted key path,
+#   the groupby() fallback past int64 and a key column with no levels
+
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from group_keys import key_codes
+
+
+def assert_matches_groupby(df, keys):
+
+    grouped = df.groupby(keys, sort = True, observed = True)
+    codes, key_table = key_codes(df, keys)
+
+    np.testing.assert_array_equal(codes, grouped.ngroup().fillna(-1).to_numpy(dtype = 'int64'))
+    expected = grouped.size().index.to_frame(index = False)
+    assert (key_table.astype(str).to_numpy() == expected.astype(str).to_numpy()).all()
+    assert list(key_table.dtypes) == list(expected.dtypes)
+
+
+def test_key_codes_matches_groupby():
+
+    rng = np.random.default_rng(0)
+    df  = pd.DataFrame({'month': rng.integers(0, 12, size = 5_000).astype(float),
+                        'tier':  pd.Categorical(rng.choice(['gold', 'silver', 'bronze'], size = 5_000), categories = ['silver', 'gold', 'bronze', 'none']),
+                        'arm':   rng.choice(['a', 'b', 'c'], size = 5_000)})
+    df.loc[::13, 'month'] = np.nan
+    df.loc[::17, 'arm']   = None
+
+    assert_matches_groupby(df, ['month', 'tier', 'arm'])
+
+
+def test_key_codes_sparse_key_space():
+
+    # NOTE: the product of the level counts is far above the rows, the observed keys come from a sort
+    rng = np.random.default_rng(1)
+    df  = pd.DataFrame({f'k{i}': rng.integers(0, 5_000, size = 2_000) for i in range(3)})
+
+    assert_matches_groupby(df, ['k0', 'k1', 'k2'])
+
+
+def test_key_codes_past_int64():
+
+    # NOTE: 10_000 ** 5 keys do not fit in int64, the mixed radix codes would wrap around
+    rng = np.random.default_rng(2)
+    df  = pd.DataFrame({f'k{i}': rng.permutation(10_000) for i in range(5)})
+    df  = pd.concat([df, df.iloc[:500]], ignore_index = True)
+    df.loc[3, 'k2'] = np.nan
+
+    assert_matches_groupby(df, [f'k{i}' for i in range(5)])
+    codes, _ = key_codes(df, [f'k{i}' for i in range(5)])
+    assert codes[3] == -1 and codes.max() == 9_999     # NOTE: row 3 lost its key, its copy at 10_003 keeps the group
+
+
+@pytest.mark.parametrize('dtype', ['float', 'category'])
+def test_key_codes_all_missing_column(dtype):
+
+    df = pd.DataFrame({'month': [1, 2, 3], 'tier': pd.Series([np.nan] * 3).astype(dtype)})
+
+    codes, key_table = key_codes(df, ['month', 'tier'])
+
+    np.testing.assert_array_equal(codes, [-1, -1, -1])
+    assert key_table.empty and list(key_table.columns) == ['month', 'tier']
+    assert key_table['tier'].dtype == df['tier'].dtype
@@ -0,0 +1,89 @@
+# **Overview**
+# * multi_arm_test() vs statsmodels, one pair of arms at a time (prop test and Welch t-test)
+# * adjust_pvalues() vs statsmodels multipletests(), NaN entries left out of the family
+# * rows with a missing key or arm are dropped instead of indexing the last key / arm
+
+
+import numpy as np
+import pandas as pd
+import pytest
+from statsmodels.stats.multitest import multipletests
+import statsmodels.stats.proportion as smp
+from statsmodels.stats.weightstats import CompareMeans, DescrStatsW
+
+from multi_arm import adjust_pvalues, multi_arm_test
+from summary_tests import summary_stats
+
+
+ARMS = ['a', 'b', 'c', 'd']
+
+
+def cohort_stats(seed = 0):
+
+    # NOTE: count / nobs per (lifetime_month, arm), arm 'b' retains a little better
+    rng  = np.random.default_rng(seed)
+    rows = pd.MultiIndex.from_product([range(4), ARMS], names = ['lifetime_month', 'arm']).to_frame(index = False)
+    nobs = rng.integers(500, 2000, size = len(rows))
+
+    return rows.assign(count = rng.binomial(nobs, np.where(rows['arm'] == 'b', 0.55, 0.5)), nobs = nobs)
+
+
+@pytest.mark.parametrize('control', [None, 'a'])
+def test_prop_pairs_match_statsmodels(control):
+
+    stats  = cohort_stats()
+    output = multi_arm_test(stats, 'arm', test = 'prop-test', control = control, method = 'bonferroni')
+
+    assert len(output) == 4 * (3 if control else 6)
+    for _, row in output.iterrows():
+        month = stats.loc[stats['lifetime_month'] == row['lifetime_month']].set_index('arm')
+        first, second = month.loc[row['arm']], month.loc[row['vs']]
+
+        expected = smp.test_proportions_2indep(first['count'], first['nobs'], second['count'], second['nobs'])
+        ci       = smp.confint_proportions_2indep(first['count'], first['nobs'], second['count'], second['nobs'])
+
+        np.testing.assert_allclose([row['statistic'], row['pvalue'], row['CI Lower'], row['CI Upper']],
+                                   [expected.statistic, expected.pvalue, ci[0], ci[1]], rtol = 1e-9)
+        assert row['pvalue_adj'] == pytest.approx(min(row['pvalue'] * (3 if control else 6), 1))
+
+
+def test_t_test_pairs_match_statsmodels():
+
+    rng = np.random.default_rng(1)
+    df  = pd.DataFrame({'arm': rng.choice(ARMS, size = 4_000), 'engagement': rng.lognormal(size = 4_000)})
+
+    output = multi_arm_test(summary_stats(df, ['arm'], metric = 'engagement'), 'arm', test = 't-test')
+
+    for _, row in output.iterrows():
+        compare  = CompareMeans(DescrStatsW(df.loc[df['arm'] == row['arm'], 'engagement']), DescrStatsW(df.loc[df['arm'] == row['vs'], 'engagement']))
+        expected = compare.ttest_ind(usevar = 'unequal')
+        ci       = compare.tconfint_diff(usevar = 'unequal')
+
+        np.testing.assert_allclose([row['statistic'], row['pvalue'], row['CI Lower'], row['CI Upper']],
+                                   [expected[0], expected[1], ci[0], ci[1]], rtol = 1e-9)
+
+
+@pytest.mark.parametrize('method', ['holm', 'bonferroni', 'fdr_bh'])
+def test_adjust_pvalues_matches_multipletests(method):
+
+    pvalues = np.random.default_rng(2).beta(0.3, 2, size = (5, 8))
+    pvalues[1, [2, 5]] = np.nan
+
+    adjusted = adjust_pvalues(pvalues, method = method)
+
+    for row, expected_row in zip(pvalues, adjusted):
+        present  = ~np.isnan(row)
+        expected = multipletests(row[present], method = method)[1]
+        np.testing.assert_allclose(expected_row[present], expected, rtol = 1e-12)
+        assert np.isnan(expected_row[~present]).all()
+
+
+def test_missing_key_or_arm_rows_are_dropped():
+
+    stats   = cohort_stats()
+    missing = pd.DataFrame({'lifetime_month': [np.nan, 1.0], 'arm': ['a', None], 'count': [10**6, 10**6], 'nobs': [10**6, 10**6]})
+
+    expected = multi_arm_test(stats, 'arm')
+    actual   = multi_arm_test(pd.concat([stats, missing], ignore_index = True), 'arm')
+
+    pd.testing.assert_frame_equal(actual.astype({'lifetime_month': int}), expected)
@@ -0,0 +1,56 @@
+# **Overview**
+# * Checks the pre-aggregated boxes of plot_summary.py against the statistics geom_boxplot computes itself
+
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('plotnine')
+
+from benchmark import make_sim_frame
+from plot_summary import box_stats, boxplot_jitter_summary, stratified_sample
+
+
+BY = ['test', 'baseline_rate', 'mde']
+
+
+def expected_box(values, coef = 1.5):
+
+    # NOTE: geom_boxplot's statistics for one group, whiskers at the most extreme values within coef * IQR of the box
+    values       = values.dropna()
+    q1, q2, q3 = values.quantile([0.25, 0.5, 0.75])
+    inside     = values[(values >= q1 - coef * (q3 - q1)) & (values <= q3 + coef * (q3 - q1))]
+
+    return [inside.min(), q1, q2, q3, inside.max(), len(values)]
+
+
+def test_box_stats_match_per_group_statistics():
+
+    df    = make_sim_frame(20_000)
+    boxes = box_stats(df, BY, 'low_CI')
+
+    expected = [expected_box(values) for _, values in df.groupby(BY)['low_CI']]
+    np.testing.assert_allclose(boxes[['ymin', 'lower', 'middle', 'upper', 'ymax', 'count']].to_numpy(float), expected, rtol = 1e-12)
+
+
+def test_box_stats_drops_rows_with_a_missing_key():
+
+    df = make_sim_frame(20_000)
+    df.loc[::50, 'mde']    = np.nan
+    df.loc[::70, 'low_CI'] = np.nan
+
+    boxes    = box_stats(df, BY, 'low_CI')
+    expected = [expected_box(values) for _, values in df.groupby(BY)['low_CI']]
+
+    assert len(boxes) == df.dropna(subset = BY).groupby(BY).ngroups
+    np.testing.assert_allclose(boxes[['ymin', 'lower', 'middle', 'upper', 'ymax', 'count']].to_numpy(float), expected, rtol = 1e-12)
+
+
+def test_stratified_sample_caps_points_per_box():
+
+    df     = make_sim_frame(20_000)
+    points = stratified_sample(df, BY, max_points = 30)
+
+    assert points.groupby(BY).size().max() == 30
+    assert len(boxplot_jitter_summary(df, 'test', 'low_CI', 'test', facets = ['baseline_rate', 'mde'], max_points = 30).layers) == 2
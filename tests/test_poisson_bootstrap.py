@@ -0,0 +1,85 @@
+# **Overview**
+# * The Poisson bootstrap is reproducible from its seed whatever max_workers / block / chunk_rows, and fresh without one
+# * float64 (the default) vs float32 weights, the CI coverage on skewed data, and bootstrap_test() in test_runner()
+
+
+import numpy as np
+import pytest
+
+from poisson_bootstrap import POISSON_TABLE, bootstrap_diff, bootstrap_means, bootstrap_test
+import t_test_or_anova_multi
+
+
+def lognormal(n, seed):
+
+    return np.random.default_rng(seed).lognormal(size = n)
+
+
+def test_same_seed_same_means_whatever_the_workers():
+
+    samples  = [lognormal(5_000, 0), lognormal(3_000, 1)]
+    expected = bootstrap_means(samples, replicates = 200, block = 32, chunk_rows = 1_000, max_workers = 1, seed = 7)
+
+    np.testing.assert_array_equal(bootstrap_means(samples, replicates = 200, block = 32, chunk_rows = 1_000, max_workers = 4, seed = 7), expected)
+    np.testing.assert_array_equal(bootstrap_means(samples, replicates = 200, block = 32, chunk_rows = 1_000, seed = np.random.SeedSequence(7)), expected)
+
+
+def test_unseeded_calls_draw_fresh_weights():
+
+    samples = [lognormal(2_000, 0)]
+
+    assert not np.array_equal(bootstrap_means(samples, replicates = 50), bootstrap_means(samples, replicates = 50))
+
+    # NOTE: one Generator or SeedSequence reproduces a whole run of calls, each call with its own weights
+    runs = []
+    for _ in range(2):
+        rng  = np.random.default_rng(3)
+        runs.append([bootstrap_means(samples, replicates = 50, seed = rng) for _ in range(2)])
+    np.testing.assert_array_equal(runs[0][0], runs[1][0])
+    np.testing.assert_array_equal(runs[0][1], runs[1][1])
+    assert not np.array_equal(runs[0][0], runs[0][1])
+
+
+def test_float32_close_to_float64():
+
+    samples = [lognormal(200_000, 2)]
+
+    means64 = bootstrap_means(samples, replicates = 64, seed = 1)
+    means32 = bootstrap_means(samples, replicates = 64, seed = 1, dtype = 'float32')
+
+    np.testing.assert_allclose(means32, means64, rtol = 1e-5)
+    with pytest.raises(ValueError, match = 'dtype'):
+        bootstrap_means(samples, dtype = 'int64')
+
+
+def test_poisson_table_matches_poisson_one():
+
+    values, counts = np.unique(POISSON_TABLE, return_counts = True)
+    pmf            = np.exp(-1) / np.cumprod(np.r_[1, np.arange(1, len(values))])
+
+    np.testing.assert_allclose(counts / len(POISSON_TABLE), pmf, atol = 1 / len(POISSON_TABLE))
+
+
+def test_percentile_ci_coverage_on_skewed_data():
+
+    # NOTE: exponential samples with a true difference of 0.5, the 95% interval should cover it about 95% of the time
+    rng     = np.random.default_rng(4)
+    covered = 0
+    trials  = 200
+    for _ in range(trials):
+        result   = bootstrap_diff(rng.exponential(1.5, size = 300), rng.exponential(1.0, size = 300), replicates = 500, max_workers = 1, seed = rng)
+        covered += result['low_CI'] <= 0.5 <= result['high_CI']
+
+    assert abs(covered / trials - 0.95) <= 3 * np.sqrt(0.95 * 0.05 / trials)
+
+
+def test_bootstrap_test_in_test_runner(df_n):
+
+    test_results, _ = t_test_or_anova_multi.test_runner(df_n.copy(), 'bootstrap', 'engagement', 'cumulative', ['group_var'])
+    welch, _        = t_test_or_anova_multi.test_runner(df_n.copy(), 't-test', 'engagement', 'cumulative', ['group_var'])
+
+    assert list(test_results.columns) == ['month', 'test', 'statistic', 'pvalue', 'CI Lower', 'CI Upper', 'stat_sig']
+    np.testing.assert_allclose(test_results[['CI Lower', 'CI Upper']], welch[['CI Lower', 'CI Upper']], atol = 0.02)
+
+    df = df_n.assign(is_retained = (df_n['lifetime_month'] > 2).astype(int))
+    np.testing.assert_array_equal(bootstrap_test(df, 3, 'engagement', seed = 5), bootstrap_test(df, 3, 'engagement', seed = 5))
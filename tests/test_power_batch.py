@@ -0,0 +1,60 @@
+# **Overview**
+# * Holds the batch solver in power_batch.py to statsmodels' power() through check_statsmodels(), and checks the --check exit status
+
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import power_batch
+
+
+def scenarios():
+
+    # NOTE: every test x alternative x solved quantity, 'smaller' rows get a negative effect
+    rows = []
+    for test in ['normal', 't']:
+        for alternative, sign in [('two-sided', 1), ('larger', 1), ('smaller', -1)]:
+            for effect_size in [0.02, 0.2]:
+                for ratio in [1.0, 3.0]:
+                    common = {'test': test, 'alternative': alternative, 'ratio': ratio, 'alpha': 0.05}
+                    rows.append({**common, 'effect_size': sign * effect_size, 'power': 0.8})
+                    rows.append({**common, 'effect_size': sign * effect_size, 'nobs1': 2_000})
+                    rows.append({**common, 'nobs1': 2_000 if effect_size < 0.1 else 200, 'power': 0.8})
+
+    return pd.DataFrame(rows)
+
+
+def test_solved_rows_match_statsmodels_power():
+
+    solved = power_batch.check_statsmodels(power_batch.solve_power_batch(scenarios()))
+
+    assert solved['within_tol'].all(), solved.loc[~solved['within_tol']]
+
+
+def test_mde_rows_match_statsmodels_power():
+
+    solved = power_batch.solve_power_batch(pd.DataFrame({'baseline_rate': [0.1, 0.5, 0.9], 'nobs1': [5_000, 20_000, 1_000_000], 'power': 0.8}))
+    solved = power_batch.check_statsmodels(solved)
+
+    assert solved['within_tol'].all()
+    np.testing.assert_allclose(power_batch.proportion_effectsize(solved['baseline_rate'] + solved['mde'], solved['baseline_rate']),
+                               solved['effect_size'], rtol = 1e-9)
+
+
+def test_check_exit_status(tmp_path, monkeypatch):
+
+    path = tmp_path / 'scenarios.csv'
+    scenarios().to_csv(path, index = False)
+
+    power_batch.main([str(path), '-o', str(tmp_path / 'solved.csv'), '--check'])
+
+    # NOTE: a solver that is off by one user per row has to fail the check
+    solve = power_batch.solve_power_batch
+    monkeypatch.setattr(power_batch, 'solve_power_batch', lambda df: solve(df).assign(nobs1 = lambda x: x['nobs1'] + 1))
+
+    with pytest.raises(SystemExit) as exit_info:
+        power_batch.main([str(path), '-o', str(tmp_path / 'solved.csv'), '--check'])
+
+    assert exit_info.value.code == 1
+    assert (tmp_path / 'solved.csv').exists()
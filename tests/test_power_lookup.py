@@ -0,0 +1,103 @@
+# **Overview**
+# * Checks the interpolated sample size table in power_lookup.py against the exact solver it is built from
+
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from power_lookup import DISCRETE_AXES, CONTINUOUS_AXES, SampleSizeLookup, _midpoint_error, build_lookup, exact_nobs1
+
+
+# NOTE: a coarser grid than DEFAULT_AXES so the test builds quickly, most cells fail rtol and fall back
+AXES = {'baseline_rate': np.round(np.arange(0.05, 0.951, 0.01), 4).tolist(),
+        'mde':           np.geomspace(0.001, 0.1, 41).tolist(),
+        'ratio':         np.geomspace(1, 50, 21).tolist(),
+        'alpha':         [0.05],
+        'power':         [0.80, 0.90],
+        'alternative':   ['larger', 'two-sided']}
+
+
+@pytest.fixture(scope = 'module')
+def lookup_path(tmp_path_factory):
+
+    path = str(tmp_path_factory.mktemp('power_lookup'))
+    build_lookup(path, axes = AXES)
+
+    return path
+
+
+@pytest.fixture(scope = 'module')
+def lookup(lookup_path):
+
+    return SampleSizeLookup(lookup_path)
+
+
+def scenarios(n = 20_000):
+
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({'baseline_rate': rng.uniform(0.05, 0.9, n),
+                         'mde':           np.exp(rng.uniform(np.log(0.001), np.log(0.05), n)),
+                         'ratio':         np.exp(rng.uniform(0, np.log(50), n)),
+                         'power':         rng.choice([0.80, 0.90], n),
+                         'alternative':   rng.choice(['larger', 'two-sided'], n)})
+
+
+def exact(df):
+
+    return exact_nobs1(df['baseline_rate'], df['mde'], df['ratio'], df['alpha'], df['power'], df['alternative'].to_numpy(object))
+
+
+def test_grid_rows_within_rtol_and_their_error_estimate(lookup):
+
+    result = lookup.lookup(scenarios())
+    grid   = result['source'] == 'grid'
+    error  = np.abs(result['nobs1'] / exact(result) - 1)
+
+    assert 0 < grid.mean() < 1
+    assert (error[grid] <= result.loc[grid, 'error_estimate']).all()
+    assert (error[grid] <= lookup.rtol).all()
+    np.testing.assert_allclose(result.loc[~grid, 'nobs1'], exact(result.loc[~grid]), rtol = 1e-12)
+
+
+def test_error_estimate_covers_the_midpoint_check(lookup):
+
+    names    = DISCRETE_AXES + CONTINUOUS_AXES
+    midpoint = _midpoint_error(np.asarray(lookup.log_n), [AXES[name] for name in names])
+
+    # NOTE: a NaN estimate (a corner with no solution) always falls back, so only numbers can be too low
+    assert not (np.asarray(lookup.error) < midpoint).any()
+
+
+def test_off_grid_rows_use_the_exact_solver(lookup):
+
+    df     = pd.DataFrame({'baseline_rate': [0.5, 0.97, 0.5], 'mde': [0.02, 0.01, 0.02], 'ratio': [1.0, 1.0, 200.0], 'alpha': [0.01, 0.05, 0.05]})
+    result = lookup.lookup(df)
+
+    assert (result['source'] == 'exact').all()
+    np.testing.assert_allclose(result['nobs1'], exact(result), rtol = 1e-12)
+
+
+def test_nobs1_matches_lookup(lookup, lookup_path):
+
+    result = lookup.lookup(pd.DataFrame({'baseline_rate': [0.615], 'mde': [0.02], 'ratio': [19.0], 'alternative': ['larger']}))
+
+    # NOTE: the second call is an LRU hit, a reopened table memory-maps the same files
+    assert lookup.nobs1(0.615, 0.02, ratio = 19, alternative = 'larger') == result['nobs1'].iloc[0]
+    assert lookup.nobs1(0.615, 0.02, ratio = 19, alternative = 'larger') == result['nobs1'].iloc[0]
+    assert lookup.nobs1.cache_info().hits == 1
+    assert SampleSizeLookup(lookup_path).nobs1(0.615, 0.02, ratio = 19, alternative = 'larger') == result['nobs1'].iloc[0]
+
+
+@pytest.mark.parametrize('alternative, mde', [('smaller', 0.02), ('larger', -0.02)])
+def test_mde_against_the_alternative_raises(lookup, alternative, mde):
+
+    with pytest.raises(ValueError, match = 'opposite direction'):
+        lookup.lookup(pd.DataFrame({'baseline_rate': [0.5], 'mde': [mde], 'alternative': [alternative]}))
+
+
+def test_smaller_with_a_negative_mde_is_solved(lookup):
+
+    result = lookup.lookup(pd.DataFrame({'baseline_rate': [0.5], 'mde': [-0.02], 'alternative': ['smaller']}))
+
+    assert result['nobs1'].iloc[0] == pytest.approx(exact(result)[0], rel = 1e-12)
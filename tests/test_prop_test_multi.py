@@ -0,0 +1,49 @@
+# **Overview**
+# * prop_test_runner_fast() vs prop_test_runner(), with 'Yes' / 'No' strings and bool flags
+# * a month with only one of the groups gives a NaN row instead of failing
+# * prop_test_multi is imported as a module, a star or name import would bring its test_proportions_2indep into pytest's view
+
+
+import numpy as np
+import pytest
+
+from benchmark import make_cohort_frame
+from helpers import assert_same
+import prop_test_multi
+
+
+@pytest.mark.parametrize('flags', ['strings', 'bool'])
+def test_prop_test_runner_fast_matches(flags):
+
+    df = make_cohort_frame(5_000, n_months = 12)
+    if flags == 'bool':
+        df = df.assign(group_var = df['group_var'] == 'Yes')
+
+    expected = prop_test_multi.prop_test_runner(df, 'group_var')
+    actual   = prop_test_multi.prop_test_runner_fast(df, 'group_var')
+
+    assert_same(actual[0], expected[0])
+    assert_same(actual[1], expected[1])
+
+
+def test_prop_test_runner_fast_keeps_first_seen_month_order():
+
+    df = make_cohort_frame(500, n_months = 6)
+
+    actual = prop_test_multi.prop_test_runner_fast(df, 'group_var')
+
+    np.testing.assert_array_equal(actual[0]['month'], df['lifetime_month'].unique())
+
+
+def test_prop_test_runner_fast_month_missing_a_group():
+
+    df = make_cohort_frame(2_000, n_months = 4)
+    df = df.loc[~((df['lifetime_month'] == 2) & (df['group_var'] == 'No'))]
+
+    prop_test_results, df_agg_results = prop_test_multi.prop_test_runner_fast(df, 'group_var')
+    missing = prop_test_results.loc[prop_test_results['month'] == 2].iloc[0]
+
+    assert np.isnan(missing[['statistic', 'pvalue', 'CI Lower', 'CI Upper']].astype(float)).all()
+    assert missing['stat_sig'] == 'No'
+    assert prop_test_results['pvalue'].notna().sum() == 3
+    assert len(df_agg_results) == 7
@@ -0,0 +1,68 @@
+# **Overview**
+# * Checks the one-pass report_metric() of t_test_or_anova_multi.py against the two groupbys + merge it replaced
+
+
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+
+import t_test_or_anova_multi
+from helpers import assert_same
+
+
+GROUPS = ['group_var', 'tier_type']
+
+
+def month_frame(df_n, month = 3):
+
+    return (df_n
+             .loc[df_n['potential_lifetime_month'] >= month]
+             .assign(lifetime_month_ref = month, is_retained = lambda x: (x['lifetime_month'] > month).astype('int8')))
+
+
+def test_retention_rate_matches_merge(df_n):
+
+    df      = month_frame(df_n)
+    groupby = ['lifetime_month_ref'] + GROUPS
+
+    # NOTE: the original report_metric(), an inner merge of the total and the retained counts
+    df_base     = df.groupby(groupby).agg(total_count = ('user_id', 'count')).reset_index()
+    df_retained = df.query('is_retained == 1').groupby(groupby).agg(churned_count = ('user_id', 'count'))
+    expected    = (pd.merge(df_base, df_retained, on = groupby)
+                    .assign(retention_rate = lambda x: ((x['churned_count'] / x['total_count']) * 100).round(3)))
+
+    assert_same(t_test_or_anova_multi.report_metric(df, 'retention_rate', GROUPS), expected)
+
+
+def test_groups_without_retained_users_are_kept(df_n):
+
+    df     = month_frame(df_n, month = 7)
+    df     = df.assign(is_retained = np.where(df['tier_type'] == 'basic', 0, df['is_retained']))
+    output = t_test_or_anova_multi.report_metric(df, 'retention_rate', GROUPS)
+
+    basic = output.loc[output['tier_type'] == 'basic']
+    assert len(basic) == 2
+    assert (basic['churned_count'] == 0).all() and (basic['retention_rate'] == 0).all()
+
+
+def test_engagement_and_registered_metrics_in_one_pass(df_n, monkeypatch):
+
+    monkeypatch.setitem(t_test_or_anova_multi.METRICS, 'user_count', {'aggs': {'users': ('user_id', 'nunique')}, 'derive': None})
+
+    df     = month_frame(df_n)
+    output = t_test_or_anova_multi.report_metric(df, ['retention_rate', 'engagement', 'user_count'], GROUPS)
+
+    expected = df.groupby(['lifetime_month_ref'] + GROUPS)['engagement'].agg(['count', 'mean', 'std']).reset_index(drop = True)
+    np.testing.assert_allclose(output[['engagement_count', 'engagement_mean', 'engagement_std']].to_numpy(), expected.to_numpy(), rtol = 1e-12)
+    assert (output['users'] == output['total_count']).all()
+
+
+def test_module_imports_on_its_own():
+
+    # NOTE: a fresh interpreter, so nothing like a notebook namespace supplies np / pd
+    code = ("import t_test_or_anova_multi as m, benchmark; "
+            "m.test_runner(benchmark.make_retention_frame(2_000, n_months = 4), 't-test', 'is_retained', 'cumulative', ['group_var'])")
+    subprocess.run([sys.executable, '-c', code], cwd = os.path.dirname(os.path.abspath(t_test_or_anova_multi.__file__)), check = True)
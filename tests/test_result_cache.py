@@ -0,0 +1,89 @@
+# **Overview**
+# * The cached tests give the same results as the originals, hits / misses / disk_hits count what happened
+# * Mutating a returned result (a DataFrame, a tuple of arrays) never changes what the cache returns next
+
+
+import numpy as np
+import pandas as pd
+import statsmodels.stats.proportion as smp
+
+from helpers import assert_same
+import prop_test_multi
+import result_cache
+from result_cache import ResultCache
+import t_test_or_anova_multi
+
+
+def df_agg(retained = 550, total = 1000):
+
+    return pd.DataFrame({'lifetime_month':       [3, 3],
+                         'group_var':            ['Yes', 'No'],
+                         'cohort_count_total':   [total, 1200],
+                         'retained_count_total': [retained, 610]})
+
+
+def test_prop_test_cached_hits_and_misses():
+
+    cache = ResultCache()
+
+    first  = result_cache.prop_test_cached(df_agg(), 3, 'group_var', cache = cache)
+    second = result_cache.prop_test_cached(df_agg(), 3, 'group_var', cache = cache)
+    result_cache.prop_test_cached(df_agg(retained = 551), 3, 'group_var', cache = cache)
+
+    assert_same(first, prop_test_multi.prop_test(df_agg(), 3, 'group_var'))
+    assert_same(second, first)
+    assert cache.info() == {'hits': 1, 'misses': 2, 'disk_hits': 0, 'size': 2, 'maxsize': 4096}
+
+
+def test_t_test_cached_matches_t_test(df_n):
+
+    cache = ResultCache()
+    df    = df_n.assign(is_retained = (df_n['lifetime_month'] > 2).astype(int))
+
+    for _ in range(2):
+        assert_same(result_cache.t_test_cached(df, 3, 'engagement', cache = cache), t_test_or_anova_multi.t_test(df, 3, 'engagement'))
+
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_memoize_shares_keys_across_call_styles():
+
+    cache = ResultCache()
+
+    positional = result_cache.test_proportions_2indep_cached(610, 1200, 550, 1000, cache = cache)
+    keyword    = result_cache.test_proportions_2indep_cached(count1 = 610.0, nobs1 = 1200, count2 = np.int64(550), nobs2 = 1000, cache = cache)
+
+    assert keyword.pvalue == positional.pvalue == smp.test_proportions_2indep(610, 1200, 550, 1000).pvalue
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_returned_results_are_copies():
+
+    cache = ResultCache()
+
+    frame = result_cache.prop_test_cached(df_agg(), 3, 'group_var', cache = cache)
+    frame['stat_sig'] = 'Yes'
+    frame.loc[0, 'pvalue'] = -1
+    assert list(result_cache.prop_test_cached(df_agg(), 3, 'group_var', cache = cache).columns) == list(prop_test_multi.prop_test(df_agg(), 3, 'group_var').columns)
+
+    ci = result_cache.confint_proportions_2indep_cached(np.array([610, 300]), np.array([1200, 700]), 550, 1000, cache = cache)
+    low = ci[0].copy()
+    ci[0][:] = 0
+    np.testing.assert_array_equal(result_cache.confint_proportions_2indep_cached(np.array([610, 300]), np.array([1200, 700]), 550, 1000, cache = cache)[0], low)
+
+
+def test_disk_cache_survives_a_new_session(tmp_path):
+
+    cache = ResultCache(maxsize = 1, path = str(tmp_path))
+    expected = result_cache.prop_test_cached(df_agg(), 3, 'group_var', cache = cache)
+    result_cache.prop_test_cached(df_agg(retained = 551), 3, 'group_var', cache = cache)     # NOTE: evicts the first key from memory
+
+    assert_same(result_cache.prop_test_cached(df_agg(), 3, 'group_var', cache = cache), expected)
+    assert cache.disk_hits == 1
+
+    fresh = ResultCache(path = str(tmp_path))
+    assert_same(result_cache.prop_test_cached(df_agg(), 3, 'group_var', cache = fresh), expected)
+    assert fresh.info()['disk_hits'] == 1 and fresh.misses == 0
+
+    fresh.clear(disk = True)
+    assert result_cache.prop_test_cached(df_agg(), 3, 'group_var', cache = fresh) is not None and fresh.misses == 1
@@ -0,0 +1,60 @@
+# **Overview**
+# * Round trips simulation output through ResultSink and read_results()
+
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from result_sink import ResultSink
+from sim_engine import sim_runner_fast
+
+
+BY = ['baseline_rate', 'mde', 'population', 'control_ratio', 'test', 't statistic', 'low_CI']
+
+
+def sim_output():
+
+    return sim_runner_fast([0.1, 0.2], [0.01, 0.02], [3_000], [2, 5], samples = 30, rng = np.random.default_rng(3))
+
+
+def ordered(df):
+
+    return df.sort_values(BY).reset_index(drop = True)
+
+
+def test_result_sink_round_trip(tmp_path):
+
+    expected = sim_output()
+
+    # NOTE: batch_rows smaller than a cell, so rows are split across several flushes
+    with ResultSink(str(tmp_path / 'sim'), batch_rows = 50) as sink:
+        sim_runner_fast([0.1, 0.2], [0.01, 0.02], [3_000], [2, 5], samples = 30, rng = np.random.default_rng(3), sink = sink)
+
+    assert sink.rows_written == len(expected)
+    assert sink.batches == -(-len(expected) // 50)
+
+    actual = sink.read()
+    assert list(actual.columns) == list(expected.columns)
+    pd.testing.assert_frame_equal(ordered(actual.astype({'test': str})), ordered(expected), check_dtype = False)
+
+
+def test_result_sink_reads_one_partition(tmp_path):
+
+    expected = sim_output()
+
+    with ResultSink(str(tmp_path / 'sim')) as sink:
+        sink.append(expected)
+
+    actual   = sink.read(filters = [('mde', '=', 0.02), ('control_ratio', '=', 5.0)])
+    expected = expected.loc[(expected['mde'] == 0.02) & (expected['control_ratio'] == 5)]
+
+    pd.testing.assert_frame_equal(ordered(actual.astype({'test': str})), ordered(expected), check_dtype = False)
+
+
+def test_result_sink_rejects_unknown_category(tmp_path):
+
+    rows = sim_output().assign(test = 'z test')
+
+    with pytest.raises(ValueError, match = "column 'test'"):
+        ResultSink(str(tmp_path / 'sim')).append(rows)
@@ -0,0 +1,55 @@
+# **Overview**
+# * test_runner_batch() vs test_runner_fast() per spec, in this process and on a process pool
+# * read_arrow() returns views into the memory-mapped file, copying only columns with nulls
+# * retention_batch is imported as a module, pytest would collect its test_runner_batch() otherwise
+
+
+import numpy as np
+import pyarrow as pa
+import pytest
+
+from helpers import assert_same
+import retention_batch
+import retention_engine
+
+
+@pytest.mark.parametrize('max_workers', [1, 2])
+def test_batch_matches_fast(df_n, max_workers):
+
+    specs = retention_batch.spec_grid(tests = ('t-test',), periods = ('cumulative',), groups = ('group_var', 'tier_type'), metrics = ('is_retained', 'engagement'))
+    test_results, df_agg_results = retention_batch.test_runner_batch(df_n, specs, max_workers = max_workers)
+
+    # NOTE: the batch tables hold every spec's columns side by side, so each spec is compared on its own columns
+    for spec in specs:
+        expected = retention_engine.test_runner_fast(df_n, spec['test'], spec['metric'], spec['period'], spec['groups'])
+        rows     = (test_results['spec_groups'] == '+'.join(spec['groups'])) & (test_results['spec_metric'] == spec['metric'])
+        agg_rows = (df_agg_results['spec_groups'] == '+'.join(spec['groups'])) & (df_agg_results['spec_metric'] == spec['metric'])
+
+        assert_same(test_results.loc[rows, expected[0].columns], expected[0])
+        assert_same(df_agg_results.loc[agg_rows, expected[1].columns], expected[1])
+
+
+def test_read_arrow_is_zero_copy(df_n, tmp_path):
+
+    path  = retention_batch.write_arrow(df_n, str(tmp_path / 'df_n.arrow'))
+    frame = retention_batch.read_arrow(path, ['lifetime_month', 'group_var', 'engagement'])
+    table = retention_batch._FRAMES.pop(path)
+
+    for name in frame.columns:
+        chunk  = table.column(name).chunk(0)
+        buffer = (chunk.indices if pa.types.is_dictionary(chunk.type) else chunk).buffers()[1]
+        values = frame[name].array.codes if frame[name].dtype == 'category' else frame[name].to_numpy()
+        assert values.__array_interface__['data'][0] == buffer.address
+
+    assert (frame['group_var'].astype(str) == df_n['group_var'].astype(str)).all()
+    np.testing.assert_array_equal(frame['engagement'], df_n['engagement'])
+
+
+def test_read_arrow_copies_columns_with_nulls(df_n, tmp_path):
+
+    df    = df_n.assign(engagement = df_n['engagement'].where(df_n.index % 7 != 0))
+    path  = retention_batch.write_arrow(df, str(tmp_path / 'df_n.arrow'))
+    frame = retention_batch.read_arrow(path, ['engagement'])
+    retention_batch._FRAMES.pop(path)
+
+    np.testing.assert_array_equal(frame['engagement'], df['engagement'])
@@ -0,0 +1,101 @@
+# **Overview**
+# * Pins test_runner_fast() to test_runner() on small synthetic frames from benchmark.py
+# * and its all-months ANOVA to scipy's f_oneway() (one-way, pingouin's layout) and statsmodels' anova_lm(typ = 2)
+# * test_runner_chunked() over DataFrame chunks and Parquet row groups vs test_runner_fast()
+
+
+import numpy as np
+import pytest
+from scipy import stats
+
+from helpers import assert_same
+import retention_engine
+import t_test_or_anova_multi
+
+
+GROUPS  = [['group_var'], ['group_var', 'tier_type']]
+PERIODS = ['prior', 'cumulative']
+
+
+@pytest.mark.parametrize('period', PERIODS)
+@pytest.mark.parametrize('groups', GROUPS)
+@pytest.mark.parametrize('metric', ['is_retained', 'engagement'])
+def test_t_test_fast_matches_test_runner(df_n, period, groups, metric):
+
+    expected = t_test_or_anova_multi.test_runner(df_n.copy(), 't-test', metric, period, groups)
+    actual   = retention_engine.test_runner_fast(df_n, 't-test', metric, period, groups)
+
+    assert_same(actual[0], expected[0])
+    assert_same(actual[1], expected[1])
+
+
+def eligible(df_n, month):
+
+    # NOTE: the cumulative population of a month with its is_retained, as test_runner() builds it
+    return df_n.loc[df_n['potential_lifetime_month'] >= month].assign(is_retained = lambda x: (x['lifetime_month'] > month).astype(int))
+
+
+@pytest.mark.parametrize('metric', ['is_retained', 'engagement'])
+def test_one_way_anova_matches_f_oneway(df_n, metric):
+
+    test_results, _ = retention_engine.test_runner_fast(df_n, 'anova', metric, 'cumulative', ['tier_type'])
+
+    # NOTE: pingouin's one-way anova() layout, one row per month
+    assert list(test_results.columns) == ['month', 'Source', 'ddof1', 'ddof2', 'F', 'p-unc', 'np2']
+    assert test_results['month'].is_unique
+
+    for row in test_results.to_dict('records'):
+        df     = eligible(df_n, row['month'])
+        groups = [values[metric].to_numpy() for _, values in df.groupby('tier_type')]
+        f, p   = stats.f_oneway(*groups)
+
+        assert row['Source'] == 'tier_type'
+        assert (row['ddof1'], row['ddof2']) == (len(groups) - 1, len(df) - len(groups))
+        np.testing.assert_allclose([row['F'], row['p-unc']], [f, p], atol = 0.006)
+
+
+@pytest.mark.parametrize('groups', [['group_var', 'tier_type'], ['group_var', 'tier_type', 'payment_provider']])
+@pytest.mark.parametrize('metric', ['is_retained', 'engagement'])
+def test_anova_fast_matches_anova_lm(df_n, groups, metric):
+
+    smf      = pytest.importorskip('statsmodels.formula.api')
+    anova_lm = pytest.importorskip('statsmodels.stats.anova').anova_lm
+    test_results, _ = retention_engine.test_runner_fast(df_n, 'anova', metric, 'cumulative', groups)
+
+    for month in test_results['month'].unique()[:3]:
+        df       = eligible(df_n, month)
+        expected = anova_lm(smf.ols(f"{metric} ~ {' * '.join(f'C({g})' for g in groups)}", df).fit(), typ = 2)
+        actual   = test_results.loc[test_results['month'] == month]
+
+        # NOTE: test_runner_fast() rounds the ANOVA table to 2 decimals, like test_runner()
+        assert actual['Source'].iloc[-1] == 'Residual'
+        np.testing.assert_allclose(actual['SS'].to_numpy(),     expected['sum_sq'].to_numpy(), atol = 0.006)
+        np.testing.assert_allclose(actual['DF'].to_numpy(),     expected['df'].to_numpy(),     atol = 0.006)
+        np.testing.assert_allclose(actual['F'].to_numpy()[:-1], expected['F'].to_numpy()[:-1], atol = 0.006)
+
+
+@pytest.mark.parametrize('test', ['t-test', 'anova'])
+@pytest.mark.parametrize('period', PERIODS)
+def test_chunked_matches_fast(df_n, test, period):
+
+    groups   = ['group_var', 'tier_type']
+    expected = retention_engine.test_runner_fast(df_n, test, 'engagement', period, groups)
+
+    # NOTE: chunks sorted by month, so most chunks miss some months and keys
+    ordered = df_n.sort_values('lifetime_month')
+    actual  = retention_engine.test_runner_chunked((ordered.iloc[i:i + 3_000] for i in range(0, len(ordered), 3_000)), test, 'engagement', period, groups)
+
+    assert_same(actual[0], expected[0])
+    assert_same(actual[1], expected[1])
+
+
+def test_chunked_reads_parquet_row_groups(df_n, tmp_path):
+
+    path = tmp_path / 'users.parquet'
+    df_n.to_parquet(path, row_group_size = 4_000)
+
+    expected = retention_engine.test_runner_fast(df_n, 't-test', 'engagement', 'cumulative', ['group_var'])
+    actual   = retention_engine.test_runner_chunked(str(path), 't-test', 'engagement', 'cumulative', ['group_var'], batch_rows = 4_000)
+
+    assert_same(actual[0], expected[0])
+    assert_same(actual[1], expected[1])
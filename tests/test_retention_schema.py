@@ -0,0 +1,101 @@
+# **Overview**
+# * load_retention() dtypes and round trips through .parquet / .csv
+# * test_runner() and test_runner_fast() give the same results on the compact schema as on 'Yes' / 'No' strings
+# * validate_retention() and is_yes() on the flag encodings they accept or reject
+
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from helpers import assert_same
+import retention_engine
+from retention_schema import is_yes, load_retention, validate_retention
+import t_test_or_anova_multi
+
+
+def test_load_retention_dtypes(df_n):
+
+    df = load_retention(df_n)
+
+    assert df['lifetime_month'].dtype == 'int16'
+    assert df['potential_lifetime_month'].dtype == 'int16'
+    assert df['group_var'].dtype == bool
+    assert df['tier_type'].dtype == 'category'
+    assert (df['group_var'] == (df_n['group_var'] == 'Yes')).all()
+    assert df.memory_usage(deep = True).sum() < df_n.memory_usage(deep = True).sum() / 2
+
+
+@pytest.mark.parametrize('suffix', ['.parquet', '.csv'])
+def test_load_retention_from_file(df_n, tmp_path, suffix):
+
+    path = str(tmp_path / f'df_n{suffix}')
+    df_n.to_parquet(path) if suffix == '.parquet' else df_n.to_csv(path, index = False)
+
+    expected = load_retention(df_n, columns = ['lifetime_month', 'potential_lifetime_month', 'group_var'])
+    actual   = load_retention(path, columns = ['lifetime_month', 'potential_lifetime_month', 'group_var'])
+
+    pd.testing.assert_frame_equal(actual, expected)
+
+
+def drop_flag(results):
+
+    # NOTE: group_var comes back as bool from the compact schema and as 'Yes' / 'No' from the strings
+    return results.drop(columns = 'group_var', errors = 'ignore')
+
+
+@pytest.mark.parametrize('period', ['prior', 'cumulative'])
+def test_compact_schema_same_results(df_n, period):
+
+    compact  = load_retention(df_n)
+    expected = t_test_or_anova_multi.test_runner(df_n.copy(), 't-test', 'is_retained', period, ['group_var', 'tier_type'])
+    actual   = t_test_or_anova_multi.test_runner(compact.copy(), 't-test', 'is_retained', period, ['group_var', 'tier_type'])
+
+    assert_same(drop_flag(actual[0]), drop_flag(expected[0]))
+
+
+@pytest.mark.parametrize('test', ['t-test', 'anova'])
+@pytest.mark.parametrize('period', ['prior', 'cumulative'])
+def test_compact_schema_same_results_fast(df_n, test, period):
+
+    expected = retention_engine.test_runner_fast(df_n, test, 'engagement', period, ['group_var', 'tier_type'])
+    actual   = retention_engine.test_runner_fast(load_retention(df_n), test, 'engagement', period, ['group_var', 'tier_type'])
+
+    assert_same(drop_flag(actual[0]), drop_flag(expected[0]))
+    assert_same(drop_flag(actual[1]), drop_flag(expected[1]))
+
+
+def test_validate_retention_lists_every_problem():
+
+    df = pd.DataFrame({'lifetime_month':           [1, -1, 3],
+                       'potential_lifetime_month': [2, 2, np.nan],
+                       'group_var':                ['Yes', 'No', 'Maybe']})
+
+    with pytest.raises(ValueError) as error:
+        validate_retention(df)
+
+    message = str(error.value)
+    assert 'lifetime_month: months must be whole numbers >= 0' in message
+    assert 'potential_lifetime_month: 1 missing or non numeric values' in message
+    assert "group_var: values other than Yes / No: ['Maybe']" in message
+
+    with pytest.raises(ValueError, match = 'missing column group_var'):
+        validate_retention(df.drop(columns = 'group_var'))
+
+
+def test_validate_retention_months_order():
+
+    df = pd.DataFrame({'lifetime_month': [3, 1], 'potential_lifetime_month': [2, 2], 'group_var': ['Yes', 'No']})
+
+    with pytest.raises(ValueError, match = 'above potential_lifetime_month for 1 users'):
+        validate_retention(df)
+
+
+@pytest.mark.parametrize('values', [['Yes', 'No', 'Yes'],
+                                    pd.Categorical(['Yes', 'No', 'Yes']),
+                                    [True, False, True],
+                                    [1, 0, 1],
+                                    ['true', '0', 'y']])
+def test_is_yes(values):
+
+    np.testing.assert_array_equal(is_yes(values), [True, False, True])
@@ -0,0 +1,132 @@
+# **Overview**
+# * Checks the incremental stores in retention_store.py against a full recompute over every row folded in
+
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmark import make_cohort_frame
+from helpers import assert_same
+from prop_test_multi import prop_test_runner_fast
+import retention_engine
+from retention_store import CohortStore, RetentionStore
+
+
+GROUPS = ['group_var', 'tier_type']
+
+
+def test_store_matches_fast(df_n, tmp_path):
+
+    first, rest = df_n.iloc[:12_000], df_n.iloc[12_000:]
+
+    store = RetentionStore(str(tmp_path / 'store'), groups = GROUPS, metric = 'engagement')
+    store.update(first)
+    store.results('t-test', 'cumulative')    # NOTE: cached, then partly stale after the next update
+    store.update(rest)
+
+    # NOTE: a reopened store reads the aggregates and the cached results back from disk
+    store = RetentionStore(str(tmp_path / 'store'), groups = GROUPS, metric = 'engagement')
+    for test in ['t-test', 'anova']:
+        expected = retention_engine.test_runner_fast(df_n, test, 'engagement', 'cumulative', GROUPS)
+        actual   = store.results(test, 'cumulative')
+        assert_same(actual[0], expected[0])
+        assert_same(actual[1], expected[1])
+
+
+def aged(df_n, users):
+
+    # NOTE: a month later for the given users, the retained ones stay retained
+    rows     = df_n.loc[users]
+    retained = rows['lifetime_month'] == rows['potential_lifetime_month']
+    return rows.assign(potential_lifetime_month = rows['potential_lifetime_month'] + 1,
+                       lifetime_month           = np.where(retained, rows['lifetime_month'] + 1, rows['lifetime_month']))
+
+
+@pytest.mark.parametrize('period', ['prior', 'cumulative'])
+def test_update_stales_only_the_months_it_moves(df_n, tmp_path, period):
+
+    store = RetentionStore(str(tmp_path / 'store'), groups = GROUPS)
+    store.update(df_n)
+    before = store.results('t-test', period)
+
+    # NOTE: a few users of the 3 month cohort age by a month
+    users   = df_n.index[df_n['potential_lifetime_month'] == 3][:20]
+    new     = aged(df_n, users)
+    after_n = pd.concat([df_n.drop(users), new])
+    stale   = store.update(new, old_rows = df_n.loc[users])
+
+    assert stale and max(stale) <= 4
+    assert len(stale) < df_n['potential_lifetime_month'].max()
+
+    actual   = store.results('t-test', period)
+    expected = retention_engine.test_runner_fast(after_n, 't-test', 'is_retained', period, GROUPS)
+    assert_same(actual[0], expected[0])
+    assert_same(actual[1], expected[1])
+
+    # NOTE: every month whose results moved is in stale
+    merged = before[0].merge(actual[0], on = 'month', suffixes = ('_before', '_after'))
+    moved  = merged.loc[merged['pvalue_before'] != merged['pvalue_after'], 'month']
+    assert set(moved) <= set(stale)
+
+
+def test_new_cohort_only_stales_month_zero(df_n, tmp_path):
+
+    store = RetentionStore(str(tmp_path / 'store'), groups = GROUPS)
+    store.update(df_n)
+
+    signups = df_n.loc[df_n['potential_lifetime_month'] == 0].head(50).assign(user_id = lambda x: x['user_id'] + len(df_n))
+    assert store.update(signups) == [0]
+
+
+def test_rejected_update_keeps_the_store(df_n, tmp_path):
+
+    store = RetentionStore(str(tmp_path / 'store'), groups = GROUPS)
+    store.update(df_n.iloc[:1_000])
+    counts = store.hist.counts.copy()
+
+    with pytest.raises(ValueError, match = 'not in the store'):
+        store.update(None, old_rows = df_n.iloc[1_000:1_010])
+
+    np.testing.assert_array_equal(store.hist.counts, counts)
+
+
+def test_empty_store_results_raise(tmp_path):
+
+    with pytest.raises(ValueError, match = 'empty'):
+        RetentionStore(str(tmp_path / 'store'), groups = GROUPS).results('t-test', 'cumulative')
+    with pytest.raises(ValueError, match = 'empty'):
+        CohortStore(str(tmp_path / 'cohorts')).results()
+
+
+def test_cohort_store_matches_fast(tmp_path):
+
+    df          = make_cohort_frame(4_000, n_months = 10).sort_values('lifetime_month', kind = 'stable')
+    first, rest = df.iloc[:2_500], df.iloc[2_500:]
+
+    store = CohortStore(str(tmp_path / 'cohorts'))
+    store.update(first)
+    store.results()
+    stale = store.update(rest.loc[rest['lifetime_month'] >= 7])
+    store.update(rest.loc[rest['lifetime_month'] < 7])
+
+    assert stale == [7, 8, 9]
+
+    expected = prop_test_runner_fast(df, 'group_var')
+    actual   = store.results()
+    assert_same(actual[0], expected[0])
+    assert_same(actual[1], expected[1])
+
+
+def test_cohort_store_rejects_negative_counts(tmp_path):
+
+    df    = make_cohort_frame(500, n_months = 4)
+    store = CohortStore(str(tmp_path / 'cohorts'))
+    store.update(df.iloc[:100])
+    df_agg = store.df_agg.copy()
+
+    with pytest.raises(ValueError, match = 'not in the store'):
+        store.update(None, old_rows = df.iloc[100:200])
+
+    pd.testing.assert_frame_equal(store.df_agg, df_agg)
+    pd.testing.assert_frame_equal(CohortStore(str(tmp_path / 'cohorts')).df_agg, df_agg)
@@ -0,0 +1,109 @@
+# **Overview**
+# * The false positive rate of mSPRT and alpha-spending on the null, looking after every batch, stays at about alpha
+# * run() over queue_events() / tail_events() gives the same results as add() / results(), look numbers the publishes
+
+
+import asyncio
+import json
+
+import numpy as np
+import pytest
+
+from sequential_monitor import SequentialMonitor, queue_events, spending_function, tail_events
+
+
+def null_experiment(monitor, rng, looks = 10, batch = 500, rate = 0.3):
+
+    # NOTE: cohort level increments of the same retention rate in both arms, returns whether any look was significant
+    for _ in range(looks):
+        for arm in ['Yes', 'No']:
+            monitor.add({'group_var': arm, 'lifetime_month': 1, 'retained_count': rng.binomial(batch, rate), 'cohort_count': batch})
+        results = monitor.results()
+
+    return results['stat_sig'].iloc[0] == 'Yes'
+
+
+@pytest.mark.parametrize('method', ['msprt', 'alpha-spending'])
+def test_false_positive_rate_on_the_null(method):
+
+    rng    = np.random.default_rng(0)
+    trials = 300
+    hits   = sum(null_experiment(SequentialMonitor(count = 'retained_count', nobs = 'cohort_count', method = method, max_nobs = 2 * 10 * 500), rng)
+                 for _ in range(trials))
+
+    # NOTE: a fixed z-test at every one of the 10 looks rejects about 20% of the nulls, the sequential tests stay near alpha
+    assert hits / trials <= 0.05 + 2 * np.sqrt(0.05 * 0.95 / trials)
+
+
+def test_msprt_pvalue_never_increases():
+
+    rng     = np.random.default_rng(1)
+    monitor = SequentialMonitor(count = 'retained_count', nobs = 'cohort_count')
+    pvalues, lows, highs = [], [], []
+
+    for _ in range(15):
+        for arm in ['Yes', 'No']:
+            monitor.add({'group_var': arm, 'lifetime_month': 1, 'retained_count': rng.binomial(300, 0.3), 'cohort_count': 300})
+        row = monitor.results().iloc[0]
+        pvalues.append(row['pvalue']), lows.append(row['CI Lower']), highs.append(row['CI Upper'])
+
+    assert (np.diff(pvalues) <= 0).all()
+    assert (np.diff(lows) >= 0).all() and (np.diff(highs) <= 0).all()
+
+
+def test_spending_function_spends_alpha_by_the_end():
+
+    t = np.linspace(0, 1, 11)
+    for kind in ['obf', 'pocock']:
+        spent = spending_function(t, 0.05, kind)
+        assert spent[0] == 0 and spent[-1] == pytest.approx(0.05)
+        assert (np.diff(spent) > 0).all()
+
+
+def user_events(n = 3_000, seed = 2):
+
+    rng = np.random.default_rng(seed)
+    return [{'group_var': str(rng.choice(['Yes', 'No'])), 'lifetime_month': int(rng.integers(1, 4)), 'is_retained': int(rng.random() < 0.4)}
+            for _ in range(n)]
+
+
+def test_run_over_a_queue_matches_add():
+
+    events    = user_events()
+    published = []
+
+    async def produce_and_run():
+        queue   = asyncio.Queue()
+        monitor = SequentialMonitor(every = 1_000, publish = published.append)
+        task    = asyncio.ensure_future(monitor.run(queue_events(queue)))
+        for event in events:
+            await queue.put(event)
+        await queue.put(None)
+        return await task
+
+    results = asyncio.run(produce_and_run())
+
+    # NOTE: the running p-value / interval depend on the looks, so the replay looks at the same points
+    replay = SequentialMonitor()
+    for i, event in enumerate(events, start = 1):
+        replay.add(event)
+        if i % 1_000 == 0:
+            replay.results()
+
+    assert [frame['look'].iloc[0] for frame in published] == [1, 2, 3, 4]
+    assert (results['look'] == 4).all()
+    assert results.equals(replay.results())
+    assert len(results) == 3     # NOTE: one 'No' vs 'Yes' row per month
+
+
+def test_tail_events_holds_back_a_partial_line(tmp_path):
+
+    events = user_events(10)
+    path   = tmp_path / 'events.jsonl'
+    text   = ''.join(json.dumps(event) + '\n' for event in events)
+    path.write_text(text + text[:20])     # NOTE: the writer is half way through an 11th line
+
+    async def read():
+        return [event async for event in tail_events(path, poll = 0.01, idle_timeout = 0.05)]
+
+    assert asyncio.run(read()) == events
@@ -0,0 +1,35 @@
+# **Overview**
+# * Checks that CellCache only simulates the cells it has not seen, and that cached cells match a fresh run
+
+
+import pandas as pd
+
+from sim_cache import CellCache, cell_key, code_version
+from sim_engine import sim_runner_parallel
+
+
+def test_cell_cache_only_computes_new_cells(tmp_path):
+
+    cache = CellCache(str(tmp_path / 'cache'))
+
+    first = sim_runner_parallel([0.1], [0.01, 0.02], [2_000], [2], samples = 30, seed = 11, max_workers = 1, cache = cache)
+    assert (cache.hits, cache.misses) == (0, 2)
+
+    # NOTE: widening the grid reuses the two cells above and simulates the two new ones
+    wider = sim_runner_parallel([0.1, 0.2], [0.01, 0.02], [2_000], [2], samples = 30, seed = 11, max_workers = 1, cache = cache)
+    assert (cache.hits, cache.misses) == (2, 4)
+
+    fresh = sim_runner_parallel([0.1, 0.2], [0.01, 0.02], [2_000], [2], samples = 30, seed = 11, max_workers = 1)
+    pd.testing.assert_frame_equal(wider, fresh)
+    pd.testing.assert_frame_equal(wider.iloc[:len(first)], first)
+
+
+def test_cell_key_depends_on_seed_samples_and_version():
+
+    cell = (0.1, 0.02, 2_000, 2)
+    key  = cell_key(cell, 30, 11)
+
+    assert key == cell_key((0.1, 0.02, 2_000.0, 2.0), 30, 11, code_version())
+    assert key != cell_key(cell, 31, 11)
+    assert key != cell_key(cell, 30, 12)
+    assert key != cell_key(cell, 30, 11, 'another version')
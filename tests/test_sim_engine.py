@@ -0,0 +1,67 @@
+# **Overview**
+# * Checks the simulation runners in sim_engine.py: reproducible seeding whatever the worker count or grid order
+# * and that sim_adaptive()'s running totals give the same estimates as recomputing them from every replicate
+
+
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from sim_engine import sim_adaptive, sim_runner_parallel
+
+
+GRID = dict(baseline_rates = [0.1, 0.3], mdes = [0.01, 0.03], populations = [2_000], control_ratios = [2, 10])
+
+
+def test_sim_runner_parallel_same_output_for_any_worker_count():
+
+    serial = sim_runner_parallel(**GRID, samples = 40, seed = 7, max_workers = 1)
+    pooled = sim_runner_parallel(**GRID, samples = 40, seed = 7, max_workers = 2)
+
+    pd.testing.assert_frame_equal(serial, pooled)
+
+
+def test_sim_runner_parallel_cells_do_not_depend_on_grid_order():
+
+    by       = ['baseline_rate', 'mde', 'population', 'control_ratio', 'test']
+    forward  = sim_runner_parallel(**GRID, samples = 40, seed = 7, max_workers = 1)
+    backward = sim_runner_parallel(**{key: values[::-1] for key, values in GRID.items()}, samples = 40, seed = 7, max_workers = 1)
+
+    # NOTE: a stable sort keeps the replicate order inside each cell
+    pd.testing.assert_frame_equal(forward.sort_values(by, kind = 'stable').reset_index(drop = True),
+                                  backward.sort_values(by, kind = 'stable').reset_index(drop = True))
+
+
+@pytest.mark.parametrize('target', ['power', 'coverage', 'low_CI'])
+def test_sim_adaptive_running_totals_match_all_replicates(target):
+
+    rows, summary = sim_adaptive(0.1, 0.02, 5_000, 4, target = target, tol = 0.01, batch_size = 40, max_samples = 600,
+                                 rng = np.random.default_rng(5))
+    samples = summary.loc[0, 'samples']
+
+    for test, values in rows.groupby('test', sort = False):
+        assert len(values) == samples
+
+        if target == 'low_CI':
+            estimate = values['low_CI'].mean()
+            mc_se    = values['low_CI'].std(ddof = 1) / math.sqrt(samples)
+        else:
+            hits     = (values['pvalue'] <= 0.05) if target == 'power' else (values['low_CI'] <= 0.02)
+            estimate = hits.mean()
+            shrunk   = (hits.sum() + 2) / (samples + 4)
+            mc_se    = math.sqrt(shrunk * (1 - shrunk) / (samples + 4))
+
+        assert summary.loc[0, f'{test} {target}'] == pytest.approx(estimate, rel = 1e-9)
+        assert summary.loc[0, f'{test} {target} mc_se'] == pytest.approx(mc_se, rel = 1e-9)
+
+
+def test_sim_adaptive_needs_an_extra_batch_when_every_replicate_hits():
+
+    # NOTE: a huge effect, every replicate rejects, the standard error is under tol after the first batch
+    _, summary = sim_adaptive(0.1, 0.2, 50_000, 2, target = 'power', tol = 0.05, batch_size = 50, min_samples = 50,
+                              rng = np.random.default_rng(5))
+
+    assert summary.loc[0, 'stop_rule'] == 'tolerance'
+    assert summary.loc[0, 'samples'] == 100
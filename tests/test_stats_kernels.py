@@ -0,0 +1,66 @@
+# **Overview**
+# * Pins the closed-form kernels in stats_kernels.py to the statsmodels calls they replace
+# * statsmodels.stats.proportion is imported as a module, pytest would collect its test_proportions_2indep() otherwise
+
+
+import numpy as np
+import pytest
+import statsmodels.stats.proportion as smp
+from statsmodels.stats.weightstats import CompareMeans, DescrStatsW
+
+from stats_kernels import bernoulli_stats, prop_confint_newcomb, prop_ztest, welch_ttest, wilson_confint
+
+
+@pytest.mark.parametrize('alternative', ['two-sided', 'larger', 'smaller'])
+def test_welch_ttest_matches_compare_means(alternative):
+
+    rng = np.random.default_rng(0)
+    x1, x2 = rng.lognormal(size = 300), rng.lognormal(0.1, 1.3, size = 170)
+
+    cm = CompareMeans(DescrStatsW(x1), DescrStatsW(x2))
+    statistic, pvalue, dof = cm.ttest_ind(usevar = 'unequal', alternative = alternative)
+    low_CI, high_CI        = cm.tconfint_diff(usevar = 'unequal', alternative = alternative)
+
+    result = welch_ttest(len(x1), x1.mean(), x1.var(), len(x2), x2.mean(), x2.var(), alternative = alternative)
+
+    np.testing.assert_allclose([result['statistic'], result['pvalue'], result['df'], result['low_CI'], result['high_CI']],
+                               [statistic, pvalue, dof, low_CI, high_CI], rtol = 1e-10)
+
+
+def test_welch_ttest_on_bernoulli_stats_matches_compare_means():
+
+    # NOTE: the sim() case, 0/1 samples summarised by their success count
+    rng = np.random.default_rng(1)
+    x1, x2 = rng.binomial(1, 0.3, size = 500), rng.binomial(1, 0.25, size = 4_500)
+
+    mean1, var1 = bernoulli_stats(x1.sum(), len(x1))
+    mean2, var2 = bernoulli_stats(x2.sum(), len(x2))
+    result      = welch_ttest(len(x1), mean1, var1, len(x2), mean2, var2, alternative = 'larger')
+
+    statistic, pvalue, _ = CompareMeans(DescrStatsW(x1), DescrStatsW(x2)).ttest_ind(usevar = 'unequal', alternative = 'larger')
+
+    np.testing.assert_allclose([result['statistic'], result['pvalue']], [statistic, pvalue], rtol = 1e-10)
+
+
+@pytest.mark.parametrize('alternative', ['two-sided', 'larger', 'smaller'])
+def test_prop_ztest_matches_test_proportions_2indep(alternative):
+
+    counts = [(30, 200, 22, 210), (0, 50, 3, 40), (480, 5_000, 410, 4_900)]
+
+    for count1, nobs1, count2, nobs2 in counts:
+        expected = smp.test_proportions_2indep(count1, nobs1, count2, nobs2, alternative = alternative)
+        result   = prop_ztest(count1, nobs1, count2, nobs2, alternative = alternative)
+
+        np.testing.assert_allclose([result['statistic'], result['pvalue']], [expected.statistic, expected.pvalue], rtol = 1e-10)
+
+
+def test_prop_confint_newcomb_matches_confint_proportions_2indep():
+
+    count1, nobs1 = np.array([30, 0, 480]),  np.array([200, 50, 5_000])
+    count2, nobs2 = np.array([22, 3, 410]),  np.array([210, 40, 4_900])
+
+    low, upp = prop_confint_newcomb(count1, nobs1, count2, nobs2)
+
+    for i in range(len(count1)):
+        np.testing.assert_allclose([low[i], upp[i]], smp.confint_proportions_2indep(count1[i], nobs1[i], count2[i], nobs2[i]), rtol = 1e-10)
+        np.testing.assert_allclose(wilson_confint(count1[i], nobs1[i]), smp.proportion_confint(count1[i], nobs1[i], method = 'wilson'), rtol = 1e-10)
@@ -0,0 +1,53 @@
+# **Overview**
+# * Checks the summary statistics mode of summary_tests.py against t_test() and prop_test() on the same data
+
+
+import numpy as np
+import pandas as pd
+
+from benchmark import make_cohort_frame
+from helpers import assert_same
+import prop_test_multi
+import t_test_or_anova_multi
+from summary_tests import prop_test_summary, summary_stats, t_test_summary
+
+
+def test_t_test_summary_matches_t_test(df_n):
+
+    for metric in ['is_retained', 'engagement']:
+        df = df_n.assign(is_retained = (df_n['lifetime_month'] > 2).astype(int))
+
+        expected = t_test_or_anova_multi.t_test(df, 3, metric)
+        actual   = t_test_summary(summary_stats(df, ['group_var'], metric = metric), month = 3)
+
+        assert_same(actual, expected, rtol = 1e-8)
+
+
+def test_t_test_summary_one_row_per_key(df_n):
+
+    # NOTE: stats by tier_type give one result row per tier, each the same as t_test() on that tier alone
+    actual = t_test_summary(summary_stats(df_n, ['tier_type', 'group_var'], metric = 'engagement'))
+
+    for tier, row in actual.set_index('tier_type').iterrows():
+        expected = t_test_or_anova_multi.t_test(df_n.loc[df_n['tier_type'] == tier], 0, 'engagement')
+        np.testing.assert_allclose(row[['t statistic', 'pvalue', 'CI Lower', 'CI Upper']].to_numpy(float),
+                                   expected[['t statistic', 'pvalue', 'CI Lower', 'CI Upper']].to_numpy(float)[0], rtol = 1e-8)
+
+
+def test_prop_test_summary_matches_prop_test():
+
+    df = make_cohort_frame(2_000, n_months = 6)
+
+    stats  = summary_stats(df, ['lifetime_month', 'group_var'], count = 'retained_count', nobs = 'cohort_count')
+    actual = prop_test_summary(stats)
+
+    expected = []
+    for month, df_month in df.groupby('lifetime_month'):
+        df_agg = (df_month
+                   .groupby('group_var', as_index = False)
+                   .agg(cohort_count_total = ('cohort_count', 'sum'), retained_count_total = ('retained_count', 'sum')))
+        expected.append(prop_test_multi.prop_test(df_agg, month, 'group_var'))
+    expected = pd.concat(expected, ignore_index = True)
+
+    np.testing.assert_array_equal(actual['lifetime_month'], expected['month'])
+    assert_same(actual.drop(columns = 'lifetime_month'), expected.drop(columns = 'month'), rtol = 1e-10)